@@ -1,11 +1,15 @@
 import os
+import sys
 import sqlite3
 import shutil
 import subprocess
 import csv
+import logging
+import queue
+import threading
+from array import array
+import time
 from datetime import datetime
-import smtplib
-from email.message import EmailMessage
 
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
@@ -25,6 +29,26 @@ from reportlab.lib.utils import ImageReader
 
 from dotenv import load_dotenv
 
+from fs_watcher import FileSyncWatcher
+import templating
+from client_directory import ClientDirectory, parse_entry, merge_duplicates as merge_duplicate_clients
+from client_import import ClientImport
+from outbox import Outbox, Dispatcher, DELIVERY_STAGES
+from attachment_cache import AttachmentCache
+from bundling import Bundler, MODES as COMPRESSION_MODES
+from receipt_archive import ReceiptArchive
+from sales_ledger import SalesLedger
+from thumbnails import ThumbnailCache, can_preview
+from api_server import ApiServer, CatalogApi
+from purger import Purger
+from scrubber import Scrubber
+from storage_layout import client_files_dir, reserve_receipt_path
+import profiling
+import catalog_snapshot
+from catalog_model import CatalogModel
+from catalog_pages import ProductPages
+import fuzzy_search
+
 load_dotenv()  # Load environment variables from .env
 EMAIL_ADDRESS = os.getenv("APP_EMAIL")
 EMAIL_PASSWORD = os.getenv("APP_PASSWORD")
@@ -42,10 +66,42 @@ os.makedirs(CLIENT_FILES_DIR, exist_ok=True)
 
 os.makedirs(FILE_DIR, exist_ok=True)
 
+# Derived data (safe to delete); kept outside files/ so the watcher ignores it
+CACHE_DIR = ".cache"
+ATTACHMENT_CACHE_DIR = os.path.join(CACHE_DIR, "attachments")
+ATTACHMENT_CACHE_MB = int(os.getenv("ATTACHMENT_CACHE_MB", "1024"))
+BUNDLE_CACHE_DIR = os.path.join(CACHE_DIR, "bundles")
+RECEIPT_VIEW_DIR = os.path.join(CACHE_DIR, "receipts")  # archived receipts extracted for viewing
+THUMBNAIL_DIR = os.path.join(CACHE_DIR, "thumbnails")
+THUMBNAIL_CACHE_MB = int(os.getenv("THUMBNAIL_CACHE_MB", "200"))
+PREVIEW_SIZE = (240, 300)
+PRODUCT_PAGE = 500  # Treeview rows added per scroll-to-bottom
+PRODUCT_COLUMNS = ("Title", "Tags", "Category", "File")
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, "catalog.snap")  # first screen of products, painted before the DB loads
+
+LOG_DIR = "logs"
+os.makedirs(LOG_DIR, exist_ok=True)
+_delivery_handler = logging.FileHandler(os.path.join(LOG_DIR, "deliveries.jsonl"), encoding="utf-8")
+_delivery_handler.setFormatter(logging.Formatter("%(message)s"))
+logging.getLogger("dpo.delivery").addHandler(_delivery_handler)
+logging.getLogger("dpo.delivery").setLevel(logging.INFO)
+DEFAULT_COMPRESSION = os.getenv("ATTACHMENT_COMPRESSION", "auto")
+SCRUB_INTERVAL_HOURS = float(os.getenv("SCRUB_INTERVAL_HOURS", "6"))
+SCRUB_MB_PER_SECOND = float(os.getenv("SCRUB_MB_PER_SECOND", "8"))
+
+def add_column(c, table, column, decl):
+    # CREATE TABLE IF NOT EXISTS leaves older databases without newer columns
+    # table_xinfo rather than table_info: it also lists generated columns
+    if column not in [row[1] for row in c.execute(f"PRAGMA table_xinfo({table})")]:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
 # Initialize DB
 def init_db():
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
+    # Write-ahead log: readers (API server, background workers) don't block on writers
+    c.execute("PRAGMA journal_mode=WAL")
     # Product table
     c.execute('''CREATE TABLE IF NOT EXISTS products (
                     id INTEGER PRIMARY KEY,
@@ -55,6 +111,74 @@ def init_db():
                     filepath TEXT,
                     date_added TEXT
                 )''')
+    # Deleted products are hidden at once and purged (file, then row) in the background
+    add_column(c, "products", "deleted_at", "REAL")
+    # Set (with deleted_at) when the file watcher finds a product's file gone; cleared if it comes back
+    add_column(c, "products", "missing_since", "REAL")
+    # Newest-first listing and path lookups from the file watcher
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_date_added ON products(date_added)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_live ON products(date_added) WHERE deleted_at IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_deleted ON products(deleted_at) WHERE deleted_at IS NOT NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_filepath ON products(filepath)")
+    # Sortable headings (see catalog_pages.py); each index walks the live rows in that column's order
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_title_sort "
+              "ON products(ifnull(title, '') COLLATE NOCASE) WHERE deleted_at IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_tags_sort "
+              "ON products(ifnull(tags, '') COLLATE NOCASE) WHERE deleted_at IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_category_sort "
+              "ON products(ifnull(category, '') COLLATE NOCASE) WHERE deleted_at IS NULL")
+    # The File heading shows and sorts by the file name; split off after either separator, as stored
+    # paths may come from Windows. rtrim() strips every trailing character that is not a separator
+    add_column(c, "products", "file_name",
+               "TEXT GENERATED ALWAYS AS (ifnull(substr(filepath, length(rtrim(filepath, "
+               "replace(replace(filepath, '\\', '/'), '/', ''))) + 1), '')) VIRTUAL")
+    c.execute("DROP INDEX IF EXISTS idx_products_file_sort")  # sorted by the full path, which looked random
+    c.execute("CREATE INDEX IF NOT EXISTS idx_products_file_name_sort "
+              "ON products(file_name COLLATE NOCASE) WHERE deleted_at IS NULL")
+    # Fuzzy search (see fuzzy_search.py): trigram indexes over the products and their words, kept by triggers
+    new_search_index = not c.execute(  # plan-ok: the schema table is tiny
+        "SELECT 1 FROM sqlite_master WHERE name = 'products_trgm'").fetchone()
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS products_trgm USING fts5("
+              "title, tags, content='products', content_rowid='id', tokenize='trigram')")
+    c.execute('''CREATE TABLE IF NOT EXISTS search_words (
+                    id INTEGER PRIMARY KEY,
+                    word TEXT UNIQUE,
+                    docs INTEGER
+                )''')
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_words_trgm USING fts5("
+              "word, content='search_words', content_rowid='id', tokenize='trigram')")
+    new_words = fuzzy_search.words_source("new.title", "new.tags")
+    old_words = fuzzy_search.words_source("old.title", "old.tags")
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS products_search_insert AFTER INSERT ON products BEGIN
+                    INSERT INTO products_trgm (rowid, title, tags) VALUES (new.id, new.title, new.tags);
+                    INSERT INTO search_words (word, docs) SELECT DISTINCT value, 1 FROM {new_words}
+                        WHERE value <> '' ON CONFLICT (word) DO UPDATE SET docs = docs + 1;
+                END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS products_search_delete AFTER DELETE ON products BEGIN
+                    INSERT INTO products_trgm (products_trgm, rowid, title, tags)
+                        VALUES ('delete', old.id, old.title, old.tags);
+                    UPDATE search_words SET docs = docs - 1 WHERE word IN (SELECT value FROM {old_words});
+                END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS products_search_update AFTER UPDATE OF title, tags ON products BEGIN
+                    INSERT INTO products_trgm (products_trgm, rowid, title, tags)
+                        VALUES ('delete', old.id, old.title, old.tags);
+                    INSERT INTO products_trgm (rowid, title, tags) VALUES (new.id, new.title, new.tags);
+                    UPDATE search_words SET docs = docs - 1 WHERE word IN (SELECT value FROM {old_words});
+                    INSERT INTO search_words (word, docs) SELECT DISTINCT value, 1 FROM {new_words}
+                        WHERE value <> '' ON CONFLICT (word) DO UPDATE SET docs = docs + 1;
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS search_words_insert AFTER INSERT ON search_words BEGIN
+                    INSERT INTO search_words_trgm (rowid, word) VALUES (new.id, new.word);
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS search_words_delete AFTER DELETE ON search_words BEGIN
+                    INSERT INTO search_words_trgm (search_words_trgm, rowid, word) VALUES ('delete', old.id, old.word);
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS search_words_unused AFTER UPDATE OF docs ON search_words
+                    WHEN new.docs <= 0 BEGIN
+                    DELETE FROM search_words WHERE id = new.id;
+                END''')
+    if new_search_index:
+        fuzzy_search.rebuild(c)
     # Client table
     c.execute('''CREATE TABLE IF NOT EXISTS clients (
                     id INTEGER PRIMARY KEY,
@@ -62,6 +186,10 @@ def init_db():
                     name TEXT,
                     date_added TEXT
                 )''')
+    # Client lookups: case-insensitive prefix search and newest-first paging
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_name_nocase ON clients(name COLLATE NOCASE)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_email_nocase ON clients(email COLLATE NOCASE)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_clients_date_added ON clients(date_added, id)")
     # Email templates table
     c.execute('''CREATE TABLE IF NOT EXISTS templates (
                     id INTEGER PRIMARY KEY,
@@ -69,6 +197,138 @@ def init_db():
                     body TEXT,
                     date_added TEXT
                 )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_templates_date_added ON templates(date_added)")
+    # Files seen on disk under files/ (kept in sync by FileSyncWatcher)
+    c.execute('''CREATE TABLE IF NOT EXISTS file_index (
+                    path TEXT PRIMARY KEY,
+                    root TEXT,
+                    size INTEGER,
+                    mtime REAL
+                )''')
+    # Outgoing email queue (delivered by outbox.Dispatcher)
+    c.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY,
+                    to_email TEXT,
+                    subject TEXT,
+                    body TEXT,
+                    attachments TEXT,
+                    sender TEXT,
+                    provider TEXT,
+                    status TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL,
+                    last_error TEXT,
+                    created_at REAL,
+                    sent_at REAL
+                )''')
+    add_column(c, "outbox", "compress", "TEXT DEFAULT 'auto'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+    # Per-attempt delivery timings (ms) and sizes, written by the dispatcher
+    c.execute('''CREATE TABLE IF NOT EXISTS deliveries (
+                    id INTEGER PRIMARY KEY,
+                    outbox_id INTEGER,
+                    to_email TEXT,
+                    status TEXT,
+                    started_at REAL,
+                    read_ms REAL,
+                    build_ms REAL,
+                    dns_ms REAL,
+                    connect_ms REAL,
+                    starttls_ms REAL,
+                    login_ms REAL,
+                    send_ms REAL,
+                    total_ms REAL,
+                    attachment_bytes INTEGER,
+                    message_bytes INTEGER,
+                    upload_bps REAL,
+                    error TEXT
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_started ON deliveries(started_at)")
+    # Receipts moved into monthly bundles under receipts/archive/
+    c.execute('''CREATE TABLE IF NOT EXISTS receipt_archive (
+                    filename TEXT PRIMARY KEY,
+                    client TEXT,
+                    issued TEXT,
+                    size INTEGER,
+                    bundle TEXT,
+                    archived_at TEXT
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipt_archive_client ON receipt_archive(client COLLATE NOCASE, issued)")
+    add_column(c, "receipt_archive", "client_id", "INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipt_archive_issued ON receipt_archive(issued)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_receipt_archive_client_id ON receipt_archive(client_id, issued)")
+    # Last known size/mtime/checksum of every stored file (see scrubber.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS file_integrity (
+                    path TEXT PRIMARY KEY,
+                    kind TEXT,
+                    product_id INTEGER,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    sha256 TEXT,
+                    status TEXT,
+                    detail TEXT,
+                    checked_at REAL,
+                    verified_at REAL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_file_integrity_status ON file_integrity(status, path)")
+    # One row per receipt line; amounts in cents (see sales_ledger.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS sales_ledger (
+                    id INTEGER PRIMARY KEY,
+                    sale_id INTEGER,
+                    line_no INTEGER,
+                    sold_at TEXT,
+                    client_name TEXT,
+                    client_email TEXT,
+                    product TEXT,
+                    quantity INTEGER DEFAULT 1,
+                    unit_price_cents INTEGER,
+                    discount_cents INTEGER,
+                    tax_rate REAL,
+                    tax_cents INTEGER,
+                    total_cents INTEGER,
+                    receipt TEXT
+                )''')
+    # Covering indexes so each report is a single ordered index walk
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sales_sale ON sales_ledger(sale_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sales_sold_at ON sales_ledger(sold_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sales_month ON sales_ledger("
+              "substr(sold_at, 1, 7), line_no, quantity, total_cents)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sales_client ON sales_ledger("
+              "client_email, sold_at, line_no, quantity, total_cents)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sales_product ON sales_ledger("
+              "product, sold_at, line_no, quantity, total_cents)")
+    # Daily rollups of the ledger, kept current by SalesLedger.record() for the dashboard
+    c.execute('''CREATE TABLE IF NOT EXISTS sales_daily (
+                    day TEXT PRIMARY KEY,
+                    orders INTEGER,
+                    units INTEGER,
+                    revenue_cents INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sales_daily_product (
+                    day TEXT,
+                    product TEXT,
+                    orders INTEGER,
+                    units INTEGER,
+                    revenue_cents INTEGER,
+                    PRIMARY KEY (day, product)
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sales_daily_client (
+                    day TEXT,
+                    client_email TEXT,
+                    orders INTEGER,
+                    units INTEGER,
+                    revenue_cents INTEGER,
+                    PRIMARY KEY (day, client_email)
+                )''')
+    # One client per address whatever its letter case (see client_directory.py); last, since merging
+    # duplicates re-points receipts and ledger lines in the tables above
+    add_column(c, "clients", "email_norm", "TEXT GENERATED ALWAYS AS (lower(trim(email))) VIRTUAL")
+    try:
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clients_email_norm ON clients(email_norm)")
+    except sqlite3.IntegrityError:
+        # Saved before the index existed: merge the duplicates, then it can be built
+        merge_duplicate_clients(c, RECEIPT_DIR, CLIENT_FILES_DIR)
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clients_email_norm ON clients(email_norm)")
 
     conn.commit()
     conn.close()
@@ -79,22 +339,45 @@ class ProductOrganizerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Digital Product Organizer")
-        self.root.geometry("850x600")
+        self.root.geometry("1120x600")
         self.style = tb.Style("flatly")  # You can change theme
+        self.templates = templating.TemplateStore(DB_FILE)
+        self.clients = ClientDirectory(DB_FILE)
+        self.receipts = ReceiptArchive(DB_FILE, RECEIPT_DIR, RECEIPT_VIEW_DIR)
+        self.sales = SalesLedger(DB_FILE)
 
         # Search bar
         self.search_var = tb.StringVar()
         tb.Entry(root, textvariable=self.search_var).pack(fill=X, padx=10, pady=5)
         tb.Button(root, text="Search", bootstyle=INFO, command=self.search_products).pack(pady=(0, 10))
 
-        # Treeview table
-        columns = ("Title", "Tags", "Category", "File")
-        self.tree = tb.Treeview(root, columns=columns, show="headings", height=15, bootstyle="info")
-        for col in columns:
-            self.tree.heading(col, text=col)
+        # Treeview table with a preview pane beside it
+        content = tb.Frame(root)
+        content.pack(padx=10, pady=5)
+        self.tree = tb.Treeview(content, columns=PRODUCT_COLUMNS, show="headings", height=15, bootstyle="info")
+        for col in PRODUCT_COLUMNS:
+            self.tree.heading(col, text=col, command=lambda col=col: self.sort_by(col))
             self.tree.column(col, width=180, anchor="w")
-        self.tree.pack(padx=10, pady=5)
+        self.tree.pack(side=LEFT)
         self.tree.bind("<Double-1>", self.open_selected_file)
+        self.tree.bind("<<TreeviewSelect>>", self.show_preview)
+        # Product data lives in the model; the tree only holds the rows scrolled into view
+        self.catalog = CatalogModel()
+        self.view = None  # ids matching the current search/sort, or None for the whole catalog newest first
+        self.shown = 0    # leading ids of the view that are in the tree
+        # A clicked heading sorts in the database a page at a time (see catalog_pages.py)
+        self.product_pages = ProductPages(DB_FILE)
+        self.fuzzy = fuzzy_search.FuzzySearch(DB_FILE)
+        self.sort = None  # (heading, descending)
+        self.sort_cursor = None
+        self.sort_more = False
+        self.tree.configure(yscrollcommand=self.on_products_scroll)
+
+        self.preview = tb.Label(content, text="No preview", anchor="center", width=30)
+        self.preview.pack(side=LEFT, fill=Y, padx=(10, 0))
+        self.preview_image = None  # keep a reference or Tk drops the image
+        self.preview_events = queue.Queue()
+        self.thumbnails = ThumbnailCache(THUMBNAIL_DIR, PREVIEW_SIZE, THUMBNAIL_CACHE_MB * 1024 * 1024).start()
 
         # Buttons
         button_frame = tb.Frame(root)
@@ -107,8 +390,547 @@ class ProductOrganizerApp:
         tb.Button(button_frame, text="Delete Product", bootstyle=DANGER, command=self.delete_product).pack(side=LEFT,padx=5)
         tb.Button(button_frame, text="Email Templates", bootstyle=WARNING, command=self.manage_templates).pack(
             side=LEFT, padx=5)
+        tb.Button(button_frame, text="Outbox", bootstyle=SECONDARY, command=self.view_outbox).pack(side=LEFT, padx=5)
+        tb.Button(button_frame, text="Archive Receipts", bootstyle=SECONDARY,
+                  command=self.archive_receipts).pack(side=LEFT, padx=5)
+        tb.Button(button_frame, text="Sales Reports", bootstyle=INFO, command=self.view_sales_reports).pack(
+            side=LEFT, padx=5)
+        tb.Button(button_frame, text="Dashboard", bootstyle=SUCCESS, command=self.view_dashboard).pack(
+            side=LEFT, padx=5)
+        tb.Button(button_frame, text="Integrity", bootstyle=WARNING, command=self.view_integrity).pack(
+            side=LEFT, padx=5)
 
-        self.refresh_products()
+        # Paint last session's first screen now; the full list loads in the background
+        self.catalog_events = queue.Queue()
+        self.catalog_generation = 0
+        self.catalog_pending = None
+        self.snapshot_rows = catalog_snapshot.load(SNAPSHOT_FILE)
+        self.show_products(self.snapshot_rows)
+        self.load_products_async()
+
+        # Background services start once the first screen is drawn (see start_services)
+        self.fs_changes = queue.Queue()
+        self.outbox = Outbox(DB_FILE)
+        self.outbox_events = queue.Queue()
+        self.import_events = queue.Queue()  # (on_done, summary, error) from client imports
+        self.fs_watcher = self.dispatcher = self.purger = self.scrubber = self.api_server = None
+        self.last_input = time.monotonic()
+        for sequence in ("<Any-KeyPress>", "<Any-ButtonPress>"):
+            self.root.bind_all(sequence, self.note_input, add="+")
+        self.root.after_idle(self.start_services)
+
+        self.root.after(300, self.poll_background)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def start_services(self):
+        # Pick up files added/removed under files/ outside the app
+        self.fs_watcher = FileSyncWatcher(DB_FILE, [FILE_DIR], FILE_DIR, on_change=self.fs_changes.put,
+                                          slow_dirs=[RECEIPT_DIR, CLIENT_FILES_DIR]).start()
+
+        # Emails are queued and delivered in the background, resuming after restarts
+        attachment_cache = AttachmentCache(ATTACHMENT_CACHE_DIR, ATTACHMENT_CACHE_MB * 1024 * 1024)
+        self.dispatcher = Dispatcher(self.outbox, password=EMAIL_PASSWORD,
+                                     on_result=lambda *event: self.outbox_events.put(event),
+                                     workers=int(os.getenv("SMTP_WORKERS", "2")),
+                                     attachment_cache=attachment_cache,
+                                     bundler=Bundler(BUNDLE_CACHE_DIR, digest=attachment_cache.digest)).start()
+
+        # Files of deleted products are removed off the UI thread
+        self.purger = Purger(DB_FILE, grace=float(os.getenv("PURGE_GRACE_SECONDS", "0"))).start()
+
+        # Stored files are re-checked in the background, backing off while the user is clicking or typing
+        self.scrubber = Scrubber(DB_FILE, CLIENT_FILES_DIR, RECEIPT_DIR, interval=SCRUB_INTERVAL_HOURS * 3600,
+                                 max_bytes_per_second=int(SCRUB_MB_PER_SECOND * 1024 * 1024),
+                                 busy=lambda: time.monotonic() - self.last_input < 2.0).start()
+
+        # Optional local JSON API for the storefront and scripts
+        if os.getenv("API_PORT"):
+            api = CatalogApi(DB_FILE, RECEIPT_DIR, RECEIPT_VIEW_DIR, on_enqueue=self.dispatcher.wake)
+            self.api_server = ApiServer(api, os.getenv("API_HOST", "127.0.0.1"), int(os.getenv("API_PORT")),
+                                        os.getenv("API_TOKEN"), os.path.join(CACHE_DIR, "api_token")).start()
+
+    def on_close(self):
+        self.save_snapshot()
+        # Services are None when the window closes before start_services ran
+        for service in (self.fs_watcher, self.dispatcher, self.thumbnails, self.purger, self.scrubber,
+                        self.api_server):
+            if service:
+                service.stop()
+        self.root.destroy()
+
+    def poll_background(self):
+        # Worker threads never touch Tk; their results are applied here on the UI thread
+        while True:
+            try:
+                generation, catalog, head = self.catalog_events.get_nowait()
+            except queue.Empty:
+                break
+            if generation == self.catalog_pending:
+                self.reconcile_products(catalog, head)
+        # File changes wait until the list they patch has loaded
+        while self.catalog_pending is None:
+            try:
+                changes = self.fs_changes.get_nowait()
+            except queue.Empty:
+                break
+            self.apply_product_changes(changes)
+        failures = []
+        while True:
+            try:
+                outbox_id, status, to_email, error = self.outbox_events.get_nowait()
+            except queue.Empty:
+                break
+            if status == "failed":
+                failures.append((to_email, error))
+        if failures:
+            self.report_failures(failures)
+        while True:
+            try:
+                path, png = self.preview_events.get_nowait()
+            except queue.Empty:
+                break
+            if path == self.selected_filepath():
+                self.set_preview(png)
+        while True:
+            try:
+                on_done, summary, error = self.import_events.get_nowait()
+            except queue.Empty:
+                break
+            on_done(summary, error)
+        self.root.after(300, self.poll_background)
+
+    def report_failures(self, failures, shown=5):
+        # One dialog per poll, however many deliveries failed since the last one
+        if len(failures) == 1:
+            to_email, error = failures[0]
+            messagebox.showerror("Delivery Failed", f"Email to {to_email} could not be delivered:\n{error}")
+            return
+        lines = [f"{to_email}: {error}" for to_email, error in failures[:shown]]
+        if len(failures) > shown:
+            lines.append(f"...and {len(failures) - shown} more")
+        if messagebox.askyesno("Delivery Failed", f"{len(failures)} emails could not be delivered:\n\n"
+                               + "\n".join(lines) + "\n\nOpen the outbox?", icon="error"):
+            self.view_outbox()
+
+    def note_input(self, event=None):
+        self.last_input = time.monotonic()
+
+    def queue_email(self, to_email, subject, body, attachments=(), compress=DEFAULT_COMPRESSION):
+        # Split across numbered messages when the files exceed the provider's size limit
+        outbox_ids = self.outbox.enqueue_split(to_email, subject, body, attachments, sender=EMAIL_ADDRESS,
+                                               compress=compress)
+        self.dispatcher.wake()
+        return outbox_ids
+
+    def add_compression_option(self, win):
+        # Whether attachments go out as-is, zipped, or zipped only when it pays off
+        tb.Label(win, text="Zip attachments:").pack(anchor="w", padx=10, pady=(10, 0))
+        compress_var = tb.StringVar(value=DEFAULT_COMPRESSION)
+        tb.Combobox(win, textvariable=compress_var, values=COMPRESSION_MODES, state="readonly",
+                    width=20).pack(padx=10, pady=5, anchor="w")
+        return compress_var
+
+    def view_outbox(self):
+        win = tb.Toplevel(self.root)
+        win.title("Outbox")
+        win.geometry("750x400")
+
+        summary_var = tb.StringVar()
+        tb.Label(win, textvariable=summary_var).pack(anchor="w", padx=10, pady=(10, 0))
+
+        columns = ("To", "Subject", "Status", "Attempts", "Last Error")
+        tree = tb.Treeview(win, columns=columns, show="headings", bootstyle="info")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=140, anchor="w")
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            for outbox_id, to_email, subject, status, attempts, error in self.outbox.recent():
+                tree.insert("", "end", iid=outbox_id, values=(to_email, subject, status, attempts, error or ""))
+            counts = self.outbox.counts()
+            stats = self.dispatcher.stats.snapshot()
+            summary = "  ".join(f"{k}: {counts.get(k, 0)}" for k in ("pending", "sending", "sent", "failed"))
+            stages = "  ".join(f"{name} p50 {s['p50'] * 1000:.0f}ms / p95 {s['p95'] * 1000:.0f}ms"
+                               for name, s in stats["stages"].items() if s["n"])
+            summary_var.set(f"{summary}   ({stats['sends_per_sec']:.2f} sends/s)\n{stages}")
+
+        def retry_failed():
+            self.outbox.retry_failed([int(i) for i in tree.selection()] or None)
+            self.dispatcher.wake()
+            refresh()
+
+        btn_frame = tb.Frame(win)
+        btn_frame.pack(pady=5)
+        tb.Button(btn_frame, text="Refresh", bootstyle=INFO, command=refresh).pack(side=LEFT, padx=5)
+        tb.Button(btn_frame, text="Retry Failed", bootstyle=WARNING, command=retry_failed).pack(side=LEFT, padx=5)
+        tb.Button(btn_frame, text="Delivery Timings", bootstyle=SECONDARY,
+                  command=self.view_delivery_stats).pack(side=LEFT, padx=5)
+
+        refresh()
+
+    def view_delivery_stats(self):
+        win = tb.Toplevel(self.root)
+        win.title("Delivery Timings")
+        win.geometry("500x380")
+
+        count_var = tb.StringVar()
+        tb.Label(win, textvariable=count_var).pack(anchor="w", padx=10, pady=(10, 0))
+
+        columns = ("Stage", "Samples", "p50", "p95")
+        tree = tb.Treeview(win, columns=columns, show="headings", bootstyle="info")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=110, anchor="w")
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def fmt(name, value):
+            if name.endswith("_bytes"):
+                return f"{value / 1024:.1f} KB"
+            if name == "upload_bps":
+                return f"{value / 1024 / 1024:.2f} MB/s"
+            return f"{value:.1f} ms"
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            total, summary = self.outbox.delivery_summary(500)
+            count_var.set(f"Last {total} delivery attempts")
+            for name in list(DELIVERY_STAGES) + ["total", "attachment_bytes", "message_bytes", "upload_bps"]:
+                s = summary[name]
+                if s["n"]:
+                    tree.insert("", "end", values=(name, s["n"], fmt(name, s["p50"]), fmt(name, s["p95"])))
+
+        tb.Button(win, text="Refresh", bootstyle=INFO, command=refresh).pack(pady=5)
+        refresh()
+
+    def show_receipts(self, name, email, client_id=None):
+        win = tb.Toplevel(self.root)
+        win.title(f"Receipts for {name or email}")
+        win.geometry("550x400")
+
+        columns = ("File", "Date", "Location")
+        tree = tb.Treeview(win, columns=columns, show="headings", bootstyle="info")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=170, anchor="w")
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            for receipt in self.receipts.for_client(name or email.split("@")[0], client_id):
+                location = f"Archived ({os.path.basename(receipt.bundle)})" if receipt.bundle else "Active"
+                tree.insert("", "end", iid=receipt.filename, values=(
+                    os.path.basename(receipt.filename), receipt.issued.strftime("%Y-%m-%d %H:%M"), location))
+            if not tree.get_children():
+                messagebox.showinfo("No Receipts", f"No receipts found for {name or email}.", parent=win)
+
+        def open_selected():
+            for filename in tree.selection():
+                try:
+                    subprocess.Popen(['start', self.receipts.open_path(filename)], shell=True)
+                except Exception as e:
+                    messagebox.showerror("Error", f"Could not open receipt: {e}", parent=win)
+
+        def email_selected():
+            selected = tree.selection()
+            if not selected:
+                return
+            paths = [(self.receipts.open_path(filename), os.path.basename(filename)) for filename in selected]
+            self.queue_email(email, "Your Receipt", f"Hello {name},\n\nAttached is your receipt.", paths)
+            messagebox.showinfo("Queued", f"Receipt queued for delivery to {email}.", parent=win)
+
+        def archive_selected():
+            active = [r for r in self.receipts.for_client(name or email.split("@")[0], client_id)
+                      if r.bundle is None and r.filename in tree.selection()]
+            if not active:
+                return
+            count, before, after = self.receipts.archive(active)
+            refresh()
+            messagebox.showinfo("Archived", f"{count} receipt(s) archived ({before // 1024} KB -> {after // 1024} KB).",
+                                parent=win)
+
+        btn_frame = tb.Frame(win)
+        btn_frame.pack(pady=5)
+        tb.Button(btn_frame, text="Open", bootstyle=PRIMARY, command=open_selected).pack(side=LEFT, padx=5)
+        tb.Button(btn_frame, text="Email", bootstyle=INFO, command=email_selected).pack(side=LEFT, padx=5)
+        tb.Button(btn_frame, text="Archive", bootstyle=SECONDARY, command=archive_selected).pack(side=LEFT, padx=5)
+
+        refresh()
+
+    def archive_receipts(self):
+        win = tb.Toplevel(self.root)
+        win.title("Archive Receipts")
+        win.geometry("420x330")
+
+        # Every filled-in policy must match for a receipt to be archived
+        tb.Label(win, text="Older than (days):").pack(anchor="w", padx=10, pady=(10, 0))
+        days_var = tb.StringVar(value="90")
+        tb.Entry(win, textvariable=days_var).pack(fill=X, padx=10, pady=5)
+
+        tb.Label(win, text="Client (optional):").pack(anchor="w", padx=10)
+        client_var = tb.StringVar()
+        client_box = tb.Combobox(win, textvariable=client_var)
+        client_box.pack(fill=X, padx=10, pady=5)
+        self.bind_client_autocomplete(client_box, client_var)
+
+        tb.Label(win, text="Month issued, YYYY-MM (optional):").pack(anchor="w", padx=10)
+        month_var = tb.StringVar()
+        tb.Entry(win, textvariable=month_var).pack(fill=X, padx=10, pady=5)
+
+        preview_var = tb.StringVar()
+        tb.Label(win, textvariable=preview_var).pack(anchor="w", padx=10, pady=5)
+
+        def selection():
+            days = days_var.get().strip()
+            if days and not days.isdigit():
+                messagebox.showerror("Invalid", "Days must be a whole number.", parent=win)
+                return None
+            name, email = parse_entry(client_var.get())
+            client = name or (email.split("@")[0] if email else client_var.get().strip())
+            return self.receipts.select(older_than_days=int(days) if days else None, client=client or None,
+                                        month=month_var.get().strip() or None,
+                                        client_id=self.clients.id_for(email) if email else None)
+
+        def preview():
+            receipts = selection()
+            if receipts is not None:
+                preview_var.set(f"{len(receipts)} receipt(s), {sum(r.size for r in receipts) // 1024} KB")
+
+        def run_archive():
+            receipts = selection()
+            if not receipts:
+                preview_var.set("Nothing to archive.")
+                return
+            if not messagebox.askyesno("Archive", f"Archive {len(receipts)} receipt(s)?", parent=win):
+                return
+            count, before, after = self.receipts.archive(receipts)
+            preview_var.set(f"Archived {count} receipt(s): {before // 1024} KB -> {after // 1024} KB")
+
+        btn_frame = tb.Frame(win)
+        btn_frame.pack(pady=10)
+        tb.Button(btn_frame, text="Preview", bootstyle=INFO, command=preview).pack(side=LEFT, padx=5)
+        tb.Button(btn_frame, text="Archive", bootstyle=SUCCESS, command=run_archive).pack(side=LEFT, padx=5)
+
+    def view_sales_reports(self):
+        win = tb.Toplevel(self.root)
+        win.title("Sales Reports")
+        win.geometry("600x450")
+
+        reports = {
+            "Revenue by Month": lambda start, end: self.sales.revenue_by_month(start[:7] or None, end[:7] or None),
+            "Revenue by Client": lambda start, end: self.sales.revenue_by_client(start or None, end or None),
+            "Revenue by Product": lambda start, end: self.sales.revenue_by_product(start or None, end or None),
+        }
+
+        form = tb.Frame(win)
+        form.pack(fill=X, padx=10, pady=(10, 0))
+        report_var = tb.StringVar(value="Revenue by Month")
+        tb.Combobox(form, textvariable=report_var, values=list(reports), state="readonly",
+                    width=20).pack(side=LEFT, padx=(0, 10))
+        tb.Label(form, text="From:").pack(side=LEFT)
+        start_var = tb.StringVar()
+        tb.Entry(form, textvariable=start_var, width=12).pack(side=LEFT, padx=5)
+        tb.Label(form, text="To:").pack(side=LEFT)
+        end_var = tb.StringVar()
+        tb.Entry(form, textvariable=end_var, width=12).pack(side=LEFT, padx=5)
+
+        total_var = tb.StringVar()
+        tb.Label(win, textvariable=total_var).pack(anchor="w", padx=10, pady=(5, 0))
+
+        columns = ("Period / Name", "Orders", "Units", "Revenue")
+        tree = tb.Treeview(win, columns=columns, show="headings", bootstyle="info")
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=130, anchor="w")
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def run_report(*_):
+            start, end = start_var.get().strip(), end_var.get().strip()
+            for value in (start, end):
+                try:
+                    if value:
+                        datetime.strptime(value, "%Y-%m-%d")
+                except ValueError:
+                    messagebox.showerror("Invalid", "Dates must be YYYY-MM-DD.", parent=win)
+                    return
+            tree.delete(*tree.get_children())
+            rows = reports[report_var.get()](start, end)
+            for key, orders, units, revenue in rows:
+                tree.insert("", "end", values=(key, orders, units, f"${revenue / 100:,.2f}"))
+            total_var.set(f"{len(rows)} rows, ${sum(r[3] for r in rows) / 100:,.2f} total")
+
+        report_var.trace_add("write", run_report)
+        tb.Button(win, text="Run", bootstyle=PRIMARY, command=run_report).pack(pady=(0, 10))
+        run_report()
+
+    def view_dashboard(self):
+        win = tb.Toplevel(self.root)
+        win.title("Sales Dashboard")
+        win.geometry("760x560")
+
+        top = tb.Frame(win)
+        top.pack(fill=X, padx=10, pady=(10, 0))
+        period_var = tb.StringVar(value="30")
+        tb.Label(top, text="Last days:").pack(side=LEFT)
+        tb.Combobox(top, textvariable=period_var, values=("7", "30", "90", "365"), state="readonly",
+                    width=6).pack(side=LEFT, padx=5)
+        summary_var = tb.StringVar()
+        tb.Label(top, textvariable=summary_var).pack(side=LEFT, padx=10)
+
+        chart = tk.Canvas(win, height=200, background="white", highlightthickness=0)
+        chart.pack(fill=X, padx=10, pady=10)
+
+        tables = tb.Frame(win)
+        tables.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        trees = {}
+        for key, heading in (("top_products", "Top Products"), ("top_clients", "Top Clients")):
+            columns = (heading, "Orders", "Revenue")
+            tree = tb.Treeview(tables, columns=columns, show="headings", bootstyle="info")
+            for col in columns:
+                tree.heading(col, text=col)
+                tree.column(col, width=180 if col == heading else 80, anchor="w")
+            tree.pack(side=LEFT, fill="both", expand=True, padx=(0, 5))
+            trees[key] = tree
+
+        def draw_trend(trend):
+            chart.delete("all")
+            width, height = max(chart.winfo_width(), 700), int(chart["height"])
+            peak = max((revenue for _, _, revenue in trend), default=0) or 1
+            bar = (width - 20) / len(trend)
+            for i, (day, orders, revenue) in enumerate(trend):
+                x = 10 + i * bar
+                y = height - 20 - (height - 40) * revenue / peak
+                chart.create_rectangle(x, y, x + max(bar - 1, 1), height - 20, fill="#2780e3", width=0)
+            chart.create_text(10, 10, anchor="nw", text=f"Peak day ${peak / 100:,.2f}")
+            chart.create_text(10, height - 5, anchor="sw", text=trend[0][0])
+            chart.create_text(width - 10, height - 5, anchor="se", text=trend[-1][0])
+
+        def refresh(*_):
+            data = self.sales.dashboard(int(period_var.get()))
+            summary_var.set(f"Revenue ${data['revenue_cents'] / 100:,.2f}   Orders {data['orders']}   "
+                            f"Average order ${data['average_order_cents'] / 100:,.2f}")
+            draw_trend(data["trend"])
+            for key, tree in trees.items():
+                tree.delete(*tree.get_children())
+                for name, orders, revenue in data[key]:
+                    tree.insert("", "end", values=(name, orders, f"${revenue / 100:,.2f}"))
+
+        def rebuild():
+            days = self.sales.rebuild_rollups()
+            refresh()
+            messagebox.showinfo("Rebuilt", f"Rollups rebuilt for {days} days of sales.", parent=win)
+
+        period_var.trace_add("write", refresh)
+        tb.Button(top, text="Rebuild Rollups", bootstyle=SECONDARY, command=rebuild).pack(side=RIGHT)
+        win.after(50, refresh)  # after layout, so the chart knows its width
+
+    def view_integrity(self):
+        win = tb.Toplevel(self.root)
+        win.title("File Integrity")
+        win.geometry("760x450")
+
+        summary_var = tb.StringVar()
+        tb.Label(win, textvariable=summary_var, justify=LEFT).pack(anchor="w", padx=10, pady=(10, 0))
+
+        columns = ("Status", "Kind", "Path", "Detail")
+        tree = tb.Treeview(win, columns=columns, show="headings", bootstyle="info")
+        for col, width in zip(columns, (80, 100, 380, 180)):
+            tree.heading(col, text=col)
+            tree.column(col, width=width, anchor="w")
+        tree.pack(fill="both", expand=True, padx=10, pady=10)
+
+        def refresh():
+            result = self.scrubber.report()
+            totals = {}
+            for (kind, status), n in result["counts"].items():
+                totals[status] = totals.get(status, 0) + n
+            summary_var.set("   ".join(f"{status}: {n}" for status, n in sorted(totals.items())) or
+                            "No pass has finished yet.")
+            tree.delete(*tree.get_children())
+            for path, kind, status, detail, checked_at in result["problems"]:
+                tree.insert("", "end", values=(status, kind, path, detail or ""))
+            if self.scrubber.last_error:
+                summary_var.set(f"{summary_var.get()}\nLast error: {self.scrubber.last_error}")
+
+        def scan_now():
+            self.scrubber.wake()
+            messagebox.showinfo("Integrity", "A check has started in the background. "
+                                "Refresh later to see its results.", parent=win)
+
+        btn_frame = tb.Frame(win)
+        btn_frame.pack(pady=(0, 10))
+        tb.Button(btn_frame, text="Refresh", bootstyle=INFO, command=refresh).pack(side=LEFT, padx=5)
+        tb.Button(btn_frame, text="Check Now", bootstyle=PRIMARY, command=scan_now).pack(side=LEFT, padx=5)
+        refresh()
+
+    def selected_filepath(self):
+        selected = self.tree.selection()
+        if not selected:
+            return None
+        return self.catalog.filepath(int(selected[0]))
+
+    def set_preview(self, png):
+        if png is None:
+            self.preview_image = None
+            self.preview.configure(image="", text="No preview")
+            return
+        try:
+            self.preview_image = tk.PhotoImage(file=png)
+        except tk.TclError:
+            self.preview_image = None
+            self.preview.configure(image="", text="No preview")
+            return
+        self.preview.configure(image=self.preview_image, text="")
+
+    def show_preview(self, event=None):
+        filepath = self.selected_filepath()
+        if not filepath or not os.path.exists(filepath) or not can_preview(filepath):
+            self.set_preview(None)
+            return
+
+        # Warm the neighbours so arrow-key browsing finds them ready; the selection is
+        # requested last because the newest request is rendered first
+        iid = self.tree.selection()[0]
+        following = self.tree.next(iid)
+        for neighbour in (following and self.tree.next(following), self.tree.prev(iid), following):
+            path = self.catalog.filepath(int(neighbour)) if neighbour else None
+            if path and os.path.exists(path):
+                self.thumbnails.request(path, lambda path, png: None)
+
+        # Only cached previews are shown synchronously; others arrive via poll_background
+        png = self.thumbnails.request(filepath, lambda path, png: self.preview_events.put((path, png)))
+        if png:
+            self.set_preview(png)
+        else:
+            self.preview_image = None
+            self.preview.configure(image="", text="Loading preview...")
+
+    def apply_product_changes(self, changes):
+        # Patch only the affected rows instead of reloading the whole list
+        for path in changes.files_changed + changes.files_removed:
+            self.thumbnails.invalidate(path)
+        self.remove_products(changes.products_removed)
+        for row in changes.products_added:
+            product_id = row[0]
+            if product_id in self.catalog:
+                continue
+            self.catalog.add(row)
+            if self.view is not None:
+                self.view.insert(0, product_id)
+            self.tree.insert("", 0, iid=str(product_id), values=self.catalog.display(product_id))
+            self.shown += 1
+
+    def remove_products(self, product_ids):
+        gone = {product_id for product_id in product_ids if product_id in self.catalog}
+        if not gone:
+            return
+        self.catalog.remove_many(gone)
+        if self.view is not None:
+            self.view = array("q", (product_id for product_id in self.view if product_id not in gone))
+        rendered = [str(product_id) for product_id in gone if self.tree.exists(str(product_id))]
+        self.tree.delete(*rendered)
+        self.shown -= len(rendered)
 
     def add_product(self):
         filepath = filedialog.askopenfilename()
@@ -125,13 +947,22 @@ class ProductOrganizerApp:
 
         filename = os.path.basename(filepath)
         dest_path = os.path.join(FILE_DIR, filename)
-        shutil.copy(filepath, dest_path)
 
+        # The row goes in before the copy so the file watcher finds it and does not add the file a second time
         conn = sqlite3.connect(DB_FILE)
         c = conn.cursor()
         c.execute("INSERT INTO products (title, tags, category, filepath, date_added) VALUES (?, ?, ?, ?, ?)",
                   (title, tags, category, dest_path, datetime.now().strftime("%Y-%m-%d")))
+        product_id = c.lastrowid
         conn.commit()
+        try:
+            shutil.copy(filepath, dest_path)
+        except OSError as e:
+            c.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            conn.commit()
+            conn.close()
+            messagebox.showerror("Error", f"Failed to copy the file:\n{e}")
+            return
         conn.close()
 
         self.refresh_products()
@@ -142,80 +973,148 @@ class ProductOrganizerApp:
             messagebox.showwarning("No selection", "Please select a product to delete.")
             return
 
-        confirm = messagebox.askyesno("Delete Confirmation",
-                                      "Are you sure you want to delete this product and its file?")
+        what = "this product and its file" if len(selected) == 1 else f"these {len(selected)} products and their files"
+        confirm = messagebox.askyesno("Delete Confirmation", f"Are you sure you want to delete {what}?")
         if not confirm:
             return
 
-        index = self.tree.index(selected[0])
-
         try:
+            # Hide the rows in one transaction; the purger removes files and rows afterwards
             conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT id, filepath FROM products ORDER BY date_added DESC")
-            rows = c.fetchall()
+            with conn:
+                conn.executemany("UPDATE products SET deleted_at = ? WHERE id = ? AND deleted_at IS NULL",
+                                 [(time.time(), int(iid)) for iid in selected])
             conn.close()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to delete product:\n{e}")
+            return
 
-            product_id, filepath = rows[index]
+        # Drop just those rows instead of reloading the list
+        self.remove_products([int(iid) for iid in selected])
+        self.set_preview(None)
+        self.purger.wake()
+        if self.catalog_pending is not None:
+            self.load_products_async()  # the load in flight may have read these rows before they were hidden
 
-            # Delete from DB
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("DELETE FROM products WHERE id = ?", (product_id,))
-            conn.commit()
+    def query_products(self, limit=-1):
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            return conn.execute("SELECT id, title, tags, category, filepath FROM products WHERE deleted_at IS NULL "
+                                "ORDER BY date_added DESC LIMIT ?", (limit,)).fetchall()
+        finally:
             conn.close()
 
-            # Delete file
-            if os.path.exists(filepath):
-                os.remove(filepath)
+    def show_products(self, rows):
+        self.catalog.load(rows)
+        self.apply_view()
 
-            messagebox.showinfo("Deleted", "Product and file deleted successfully.")
-            self.refresh_products()
+    def show_view(self, ids, paged=False):
+        self.view = ids
+        self.sort_cursor, self.sort_more = None, paged
+        self.tree.delete(*self.tree.get_children())
+        self.shown = 0
+        self.render_more()
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to delete product:\n{e}")
+    def apply_view(self):
+        keyword = self.search_var.get().strip()
+        if self.catalog_pending is not None and (keyword or self.sort):
+            self.refresh_products()  # only the snapshot is loaded so far
+            return
+        if not keyword:
+            if self.sort:
+                self.show_view(array("q"), paged=True)
+            else:
+                self.show_view(None)
+            return
+        # Searched in memory: the model already holds every live product
+        matches = self.catalog.search(keyword)
+        if not matches:
+            # Nothing contains it as typed: fall back to close spellings, best match first
+            matches = array("q", (product_id for product_id in self.fuzzy.search(keyword)
+                                  if product_id in self.catalog))
+        if self.sort:
+            # Only the matches are ordered here; the full list is always sorted by the database
+            column, descending = self.sort
+            field = PRODUCT_COLUMNS.index(column) + 1
+            matches = array("q", sorted(matches, key=lambda product_id: (
+                (self.catalog.get(product_id)[field] or "").lower(), product_id), reverse=descending))
+        self.show_view(matches)
+
+    def sort_by(self, column):
+        # Each click on a heading: ascending, then descending, then back to newest first
+        if self.sort and self.sort[0] == column:
+            self.sort = None if self.sort[1] else (column, True)
+        else:
+            self.sort = (column, False)
+        for col in PRODUCT_COLUMNS:
+            arrow = "" if not self.sort or self.sort[0] != col else (" \u25bc" if self.sort[1] else " \u25b2")
+            self.tree.heading(col, text=col + arrow)
+        self.apply_view()
+
+    def render_more(self):
+        if self.sort_more and self.shown + PRODUCT_PAGE > len(self.view):
+            column, descending = self.sort
+            ids, self.sort_cursor = self.product_pages.page(column, descending, self.sort_cursor, PRODUCT_PAGE)
+            self.sort_more = self.sort_cursor is not None
+            self.view.extend(product_id for product_id in ids if product_id in self.catalog)
+        ids = self.catalog.order if self.view is None else self.view
+        for product_id in ids[self.shown:self.shown + PRODUCT_PAGE]:
+            self.tree.insert("", tb.END, iid=str(product_id), values=self.catalog.display(product_id))
+        self.shown = min(self.shown + PRODUCT_PAGE, len(ids))
+
+    def on_products_scroll(self, first, last):
+        if float(last) >= 1.0:
+            self.render_more()
 
     def refresh_products(self):
-        for row in self.tree.get_children():
-            self.tree.delete(row)
+        self.catalog_generation += 1
+        self.catalog_pending = None  # supersedes any background load still running
+        self.show_products(self.query_products())
+
+    def load_products_async(self):
+        self.catalog_generation += 1
+        generation = self.catalog_pending = self.catalog_generation
+        shown = len(self.snapshot_rows)
+
+        def load():
+            # The model is built here too; the UI thread only swaps it in
+            rows = self.query_products()
+            self.catalog_events.put((generation, CatalogModel(rows), [tuple(row) for row in rows[:shown]]))
+
+        threading.Thread(target=load, name="catalog-load", daemon=True).start()
+
+    def reconcile_products(self, catalog, head):
+        self.catalog_pending = None
+        self.catalog = catalog
+        # When the snapshot was right, keep its rows (and the selection); the rest render on scroll
+        shown = len(self.snapshot_rows)
+        if shown and list(self.tree.get_children()) == [str(row[0]) for row in self.snapshot_rows] \
+                and head == [tuple(row) for row in self.snapshot_rows]:
+            self.view, self.shown = None, shown
+            self.render_more()
+        else:
+            self.apply_view()
+        self.snapshot_rows = []
 
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT id, title, tags, category, filepath FROM products ORDER BY date_added DESC")
-        self.filepaths = []  # Track actual paths
-        for row in c.fetchall():
-            title, tags, category, filepath = row[1], row[2], row[3], os.path.basename(row[4])
-            self.tree.insert("", tb.END, values=(title, tags, category, filepath))
-            self.filepaths.append(row[4])
-        conn.close()
+    def save_snapshot(self):
+        try:
+            catalog_snapshot.save(SNAPSHOT_FILE, self.query_products(catalog_snapshot.SNAPSHOT_ROWS))
+        except (OSError, sqlite3.Error) as e:
+            print("Failed to save catalog snapshot:", e)
 
     def open_selected_file(self, event=None):
         selected = self.tree.selection()
         if not selected:
             return
 
-        index = self.tree.index(selected[0])
         try:
-            filepath = self.filepaths[index]
+            filepath = self.catalog.filepath(int(selected[0]))
             subprocess.Popen(['start', filepath], shell=True)
         except Exception as e:
             messagebox.showerror("Error", f"Could not open file: {e}")
 
     def search_products(self):
-        keyword = self.search_var.get().lower()
-        self.tree.delete(*self.tree.get_children())
-        self.filepaths = []
-
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT title, tags, category, filepath FROM products")
-        for row in c.fetchall():
-            title, tags, category, path = row
-            if keyword in title.lower() or keyword in tags.lower() or keyword in category.lower():
-                display = (title, tags, category, os.path.basename(path))
-                self.tree.insert("", tb.END, values=display)
-                self.filepaths.append(path)
-        conn.close()
+        self.apply_view()
 
     def export_csv(self):
         export_path = filedialog.asksaveasfilename(defaultextension=".csv")
@@ -223,7 +1122,8 @@ class ProductOrganizerApp:
             return
         conn = sqlite3.connect(DB_FILE)
         c = conn.cursor()
-        c.execute("SELECT title, tags, category, filepath, date_added FROM products")
+        # plan-ok: full export
+        c.execute("SELECT title, tags, category, filepath, date_added FROM products WHERE deleted_at IS NULL")
         rows = c.fetchall()
         conn.close()
 
@@ -235,49 +1135,38 @@ class ProductOrganizerApp:
         messagebox.showinfo("Exported", f"Exported {len(rows)} products to {export_path}")
 #############################################
     def send_email(self):
-        import smtplib
-        from email.message import EmailMessage
-
-        # Ensure a product is selected
+        # Every selected product goes to the recipient together, with one receipt
         selected = self.tree.selection()
         if not selected:
             messagebox.showwarning("No selection", "Please select a product to send.")
             return
 
-        index = self.tree.index(selected[0])
+        ids = [int(iid) for iid in selected]
         conn = sqlite3.connect(DB_FILE)
         c = conn.cursor()
-        c.execute("SELECT title, filepath FROM products ORDER BY date_added DESC")
-        rows = c.fetchall()
+        c.execute("SELECT id, title, filepath FROM products WHERE deleted_at IS NULL AND id IN (%s)"
+                  % ",".join("?" * len(ids)), ids)
+        found = {row[0]: row[1:] for row in c.fetchall()}
         conn.close()
 
-        if index >= len(rows):
+        products = [found[i] for i in ids if i in found]  # selection order
+        if not products:
             messagebox.showerror("Error", "Selected product not found.")
             return
-
-        title, filepath = rows[index]
+        title = products[0][0] if len(products) == 1 else f"{len(products)} products"
 
         # ---- Create dialog window ----
         win = tb.Toplevel(self.root)
-        win.title("Send Product via Email")
-        win.geometry("700x800")
+        win.title("Send Product via Email" if len(products) == 1 else f"Send {len(products)} Products via Email")
+        win.geometry("700x800" if len(products) == 1 else "700x950")
         win.grab_set()
 
-        # Get saved clients
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT name, email FROM clients ORDER BY date_added DESC")
-        clients = c.fetchall()
-        conn.close()
-
-        emails = [f"{name or '(No Name)'} <{email}>" for name, email in clients]
-        email_lookup = {f"{name or '(No Name)'} <{email}>": email for name, email in clients}
-
-        # Dropdown + manual email entry
+        # Dropdown (autocompletes against saved clients) + manual email entry
         tb.Label(win, text="Recipient:").pack(anchor="w", padx=10, pady=(10, 0))
         recipient_var = tb.StringVar()
-        dropdown = tb.Combobox(win, textvariable=recipient_var, values=emails, width=60)
+        dropdown = tb.Combobox(win, textvariable=recipient_var, values=self.clients.suggestions(""), width=60)
         dropdown.pack(padx=10, pady=5)
+        self.bind_client_autocomplete(dropdown, recipient_var)
 
         tb.Label(win, text="Or type email manually:").pack(anchor="w", padx=10, pady=(10, 0))
         manual_var = tb.StringVar()
@@ -291,38 +1180,59 @@ class ProductOrganizerApp:
         # Message
         tb.Label(win, text="Message:").pack(anchor="w", padx=10, pady=(10, 0))
         message_box = tb.Text(win, height=6, wrap="word")
-        message_box.insert("1.0", "Please find the attached file.")
+        message_box.insert("1.0", "Please find the attached file." if len(products) == 1
+                           else "Please find the attached files.")
         message_box.pack(padx=10, pady=5, fill="both", expand=False)
 
-        # Load templates
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT title, body FROM templates ORDER BY date_added DESC")
-        templates = c.fetchall()
-        conn.close()
-
+        # Templates (placeholders are filled in per recipient when sending)
         tb.Label(win, text="Use Template:").pack(anchor="w", padx=10, pady=(10, 0))
         template_var = tb.StringVar()
         template_dropdown = tb.Combobox(win, textvariable=template_var,
-                                        values=[title for title, body in templates],
+                                        values=self.templates.titles(),
                                         width=60)
         template_dropdown.pack(padx=10, pady=5)
 
         def fill_template(event=None):
-            selected_title = template_var.get()
-            for title, body in templates:
-                if title == selected_title:
-                    message_box.delete("1.0", "end")
-                    message_box.insert("1.0", body)
-                    break
+            body = self.templates.body(template_var.get())
+            if body is not None:
+                message_box.delete("1.0", "end")
+                message_box.insert("1.0", body)
 
         template_dropdown.bind("<<ComboboxSelected>>", fill_template)
 
+        compress_var = self.add_compression_option(win)
+
         # Price, discount, tax inputs
-        tb.Label(win, text="Price:").pack(anchor="w", padx=10, pady=(10, 0))
+        tb.Label(win, text="Price:" if len(products) == 1 else "Price (each):").pack(anchor="w", padx=10,
+                                                                                      pady=(10, 0))
         price_var = tb.StringVar()
         tb.Entry(win, textvariable=price_var, width=20).pack(padx=10, pady=5, anchor="w")
 
+        # Per-product prices for a multi-product send; double-click a row to override "Price (each)"
+        item_prices = {}
+        if len(products) > 1:
+            items_tree = tb.Treeview(win, columns=("Product", "Price"), show="headings", height=5,
+                                     bootstyle="info")
+            items_tree.heading("Product", text="Product")
+            items_tree.heading("Price", text="Price")
+            items_tree.column("Product", width=480, anchor="w")
+            items_tree.column("Price", width=120, anchor="w")
+            items_tree.pack(padx=10, pady=5, fill=X)
+            for n, (product_title, _) in enumerate(products):
+                items_tree.insert("", "end", iid=str(n), values=(product_title, ""))
+
+            def edit_price(event):
+                row = items_tree.identify_row(event.y)
+                if not row:
+                    return
+                value = simpledialog.askfloat("Price", f"Price for {products[int(row)][0]}:", parent=win,
+                                              minvalue=0.0)
+                if value is not None:
+                    item_prices[int(row)] = value
+                    items_tree.set(row, "Price", f"{value:.2f}")
+
+            items_tree.bind("<Double-1>", edit_price)
+
         tb.Label(win, text="Discount:").pack(anchor="w", padx=10, pady=(10, 0))
         discount_var = tb.StringVar(value="0.0")
         tb.Entry(win, textvariable=discount_var, width=20).pack(padx=10, pady=5, anchor="w")
@@ -332,7 +1242,7 @@ class ProductOrganizerApp:
         tb.Entry(win, textvariable=tax_var, width=20).pack(padx=10, pady=5, anchor="w")
 
         def send_action():
-            selected_email = email_lookup.get(recipient_var.get())
+            selected_email = parse_entry(recipient_var.get())[1]
             manual_email = manual_var.get().strip()
             to_email = manual_email or selected_email
 
@@ -340,41 +1250,25 @@ class ProductOrganizerApp:
                 messagebox.showerror("Missing", "Please select or type a recipient email.")
                 return
 
-            subject = subject_var.get()
-            message_body = message_box.get("1.0", "end").strip()
-
+            name_guess = parse_entry(recipient_var.get())[0]
+            file_names = [os.path.basename(path) for _, path in products]
             try:
-                EMAIL_ADDRESS = os.getenv("APP_EMAIL")
-                EMAIL_PASSWORD = os.getenv("APP_PASSWORD")
-
-                msg = EmailMessage()
-                msg['Subject'] = subject
-                msg['From'] = EMAIL_ADDRESS
-                msg['To'] = to_email
-                msg.set_content(message_body)
+                context = templating.make_context(
+                    client_name=name_guess, client_email=to_email,
+                    product_title=", ".join(product_title for product_title, _ in products),
+                    file_name=", ".join(file_names), price=price_var.get(),
+                    discount=discount_var.get(), tax=tax_var.get(), sender=os.getenv("APP_EMAIL"))
+                subject = templating.render(subject_var.get(), context)
+                message_body = templating.render(message_box.get("1.0", "end").strip(), context)
 
-                with open(filepath, 'rb') as f:
-                    file_data = f.read()
-                    file_name = os.path.basename(filepath)
+                outbox_ids = self.queue_email(to_email, subject, message_body, [path for _, path in products],
+                                              compress=compress_var.get())
 
-                msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=file_name)
-
-                with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-                    smtp.starttls()
-                    smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                    smtp.send_message(msg)
-
-                name_guess = recipient_var.get().split(" <")[0] if "<" in recipient_var.get() else ""
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                c.execute("INSERT OR IGNORE INTO clients (email, name, date_added) VALUES (?, ?, ?)",
-                          (to_email, name_guess, datetime.now().strftime("%Y-%m-%d")))
-                conn.commit()
-                conn.close()
+                self.clients.upsert(to_email, name_guess)
 
-                if price_var.get():
+                if price_var.get() or item_prices:
                     try:
-                        price = float(price_var.get())
+                        price = float(price_var.get()) if price_var.get() else 0.0
                         discount = float(discount_var.get()) if discount_var.get() else 0.0
                         tax_rate = float(tax_var.get()) / 100 if tax_var.get() else 0.0
                         client_name = name_guess or to_email.split("@")[0]
@@ -387,10 +1281,11 @@ class ProductOrganizerApp:
                         if not logo_path:
                             logo_path = None
 
+                        # One receipt listing every item
                         receipt_path = self.generate_receipt(
                             client_name=client_name,
                             client_email=to_email,
-                            items=[(file_name, price)],
+                            items=[(file_name, item_prices.get(n, price)) for n, file_name in enumerate(file_names)],
                             discount=discount,
                             tax=tax_rate,
                             logo_path=logo_path
@@ -404,11 +1299,12 @@ class ProductOrganizerApp:
                     except Exception as e:
                         print("Failed to generate receipt:", e)
 
-                messagebox.showinfo("Success", f"Email sent to {to_email}\nReceipt saved.")
+                parts = f" in {len(outbox_ids)} emails (size limit)" if len(outbox_ids) > 1 else ""
+                messagebox.showinfo("Success", f"Email to {to_email} queued for delivery{parts}.\nReceipt saved.")
                 win.destroy()
 
             except Exception as e:
-                messagebox.showerror("Error", f"Failed to send email:\n{e}")
+                messagebox.showerror("Error", f"Failed to queue email:\n{e}")
 
         tb.Button(win, text="Send Email", bootstyle=SUCCESS, command=send_action).pack(pady=10)
 
@@ -421,8 +1317,8 @@ class ProductOrganizerApp:
         item = tree.item(selected[0])
         client_name = item['values'][0]
         email = item['values'][1]
-        client_folder = os.path.join(CLIENT_FILES_DIR, client_name.replace(" ", "_"))
-        os.makedirs(client_folder, exist_ok=True)
+        # Keyed by id so a renamed client keeps their files; an old name-keyed folder is moved over
+        client_folder = client_files_dir(CLIENT_FILES_DIR, int(selected[0]), legacy_name=client_name)
 
         win = tb.Toplevel(self.root)
         win.title(f"Files for {client_name}")
@@ -478,28 +1374,22 @@ class ProductOrganizerApp:
             message_box.pack(padx=10, pady=5, fill="both", expand=False)
 
             # Templates
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT title, body FROM templates ORDER BY date_added DESC")
-            templates = c.fetchall()
-            conn.close()
-
             tb.Label(send_win, text="Use Template:").pack(anchor="w", padx=10, pady=(10, 0))
             template_var = tb.StringVar()
             template_dropdown = tb.Combobox(send_win, textvariable=template_var,
-                                            values=[title for title, _ in templates], width=60)
+                                            values=self.templates.titles(), width=60)
             template_dropdown.pack(padx=10, pady=5)
 
             def fill_template(event=None):
-                selected_title = template_var.get()
-                for title, body in templates:
-                    if title == selected_title:
-                        message_box.delete("1.0", "end")
-                        message_box.insert("1.0", body)
-                        break
+                body = self.templates.body(template_var.get())
+                if body is not None:
+                    message_box.delete("1.0", "end")
+                    message_box.insert("1.0", body)
 
             template_dropdown.bind("<<ComboboxSelected>>", fill_template)
 
+            compress_var = self.add_compression_option(send_win)
+
             # Price, discount, tax inputs
             tb.Label(send_win, text="Price:").pack(anchor="w", padx=10, pady=(10, 0))
             price_var = tb.StringVar()
@@ -529,31 +1419,19 @@ class ProductOrganizerApp:
             tb.Button(send_win, text="Browse Logo", command=browse_logo).pack(padx=10, pady=(0, 10), anchor="w")
 
             def send_action():
-                subject = subject_var.get().strip()
-                message_body = message_box.get("1.0", "end").strip()
-
-                if not subject or not message_body:
-                    messagebox.showwarning("Missing", "Subject and message are required.")
-                    return
-
                 try:
-                    EMAIL_ADDRESS = os.getenv("APP_EMAIL")
-                    EMAIL_PASSWORD = os.getenv("APP_PASSWORD")
-
-                    msg = EmailMessage()
-                    msg['Subject'] = subject
-                    msg['From'] = EMAIL_ADDRESS
-                    msg['To'] = email
-                    msg.set_content(message_body)
+                    context = templating.make_context(
+                        client_name=client_name, client_email=email, product_title=filename,
+                        file_name=filename, price=price_var.get(), discount=discount_var.get(),
+                        tax=tax_var.get(), sender=os.getenv("APP_EMAIL"))
+                    subject = templating.render(subject_var.get().strip(), context)
+                    message_body = templating.render(message_box.get("1.0", "end").strip(), context)
 
-                    with open(filepath, 'rb') as f:
-                        file_data = f.read()
-                        msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=filename)
+                    if not subject or not message_body:
+                        messagebox.showwarning("Missing", "Subject and message are required.")
+                        return
 
-                    with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-                        smtp.starttls()
-                        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                        smtp.send_message(msg)
+                    self.queue_email(email, subject, message_body, [filepath], compress=compress_var.get())
 
                     # Generate receipt if price was entered
                     if price_var.get():
@@ -576,11 +1454,11 @@ class ProductOrganizerApp:
                         except Exception as e:
                             print("Failed to generate receipt PDF:", e)
 
-                    messagebox.showinfo("Success", f"Email sent to {email}")
+                    messagebox.showinfo("Success", f"Email to {email} queued for delivery.")
                     send_win.destroy()
 
                 except Exception as e:
-                    messagebox.showerror("Error", f"Failed to send email:\n{e}")
+                    messagebox.showerror("Error", f"Failed to queue email:\n{e}")
 
             tb.Button(send_win, text="Send Email", bootstyle=SUCCESS, command=send_action).pack(pady=10)
 
@@ -596,17 +1474,32 @@ class ProductOrganizerApp:
 
     ################################################
 
-    def view_clients(self):
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT id, name, email, date_added FROM clients ORDER BY date_added DESC")
-        clients = c.fetchall()
-        conn.close()
+    def bind_client_autocomplete(self, combobox, var):
+        # Refill the dropdown from the index as the user types (debounced)
+        pending = {"job": None}
+
+        def update():
+            pending["job"] = None
+            combobox["values"] = self.clients.suggestions(var.get())
+
+        def on_key(event):
+            if event.keysym in ("Up", "Down", "Return", "Escape", "Tab"):
+                return
+            if pending["job"]:
+                combobox.after_cancel(pending["job"])
+            pending["job"] = combobox.after(150, update)
+
+        combobox.bind("<KeyRelease>", on_key)
 
+    def view_clients(self):
         win = tb.Toplevel(self.root)
         win.title("Saved Clients")
         win.geometry("600x400")
 
+        # Search by name/email prefix
+        search_var = tb.StringVar()
+        tb.Entry(win, textvariable=search_var).pack(fill=X, padx=10, pady=(10, 0))
+
         columns = ("Name", "Email", "Date Added")
         tree = tb.Treeview(win, columns=columns, show="headings", bootstyle="info")
         for col in columns:
@@ -614,16 +1507,88 @@ class ProductOrganizerApp:
             tree.column(col, width=180, anchor="w")
         tree.pack(fill="both", expand=True, padx=10, pady=10)
 
-        # Populate table
-        for client in clients:
-            cid, name, email, date_added = client
-            tree.insert("", "end", iid=cid, values=(name or "(No Name)", email, date_added))
+        # Populate table a page at a time; the next page loads when scrolled to the bottom
+        paging = {"cursor": None, "done": False}
+
+        def insert_rows(rows):
+            for cid, name, email, date_added in rows:
+                if not tree.exists(cid):
+                    tree.insert("", "end", iid=cid, values=(name or "(No Name)", email, date_added))
+
+        def load_next_page():
+            if paging["done"]:
+                return
+            rows, paging["cursor"] = self.clients.page(paging["cursor"])
+            paging["done"] = paging["cursor"] is None
+            insert_rows(rows)
+
+        def on_scroll(first, last):
+            if float(last) >= 1.0 and not search_var.get().strip():
+                load_next_page()
+
+        def run_search(*_):
+            tree.delete(*tree.get_children())
+            keyword = search_var.get().strip()
+            if keyword:
+                paging["done"] = True
+                insert_rows(self.clients.search(keyword, limit=500))
+            else:
+                paging["cursor"], paging["done"] = None, False
+                load_next_page()
+
+        tree.configure(yscrollcommand=on_scroll)
+        search_var.trace_add("write", run_search)
+        load_next_page()
+
+        def import_clients():
+            path = filedialog.askopenfilename(
+                parent=win, title="Import Clients",
+                filetypes=[("Contacts", "*.csv *.vcf"), ("CSV", "*.csv"), ("vCard", "*.vcf"), ("All files", "*.*")])
+            if not path:
+                return
+            import_button.configure(state="disabled", text="Importing...")
+
+            def work():
+                # One write transaction for the whole file; kept off the UI thread, reported by poll_background
+                try:
+                    self.import_events.put((import_done, ClientImport(DB_FILE).run(path), None))
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    self.import_events.put((import_done, None, e))
+
+            threading.Thread(target=work, name="client-import", daemon=True).start()
+
+        def import_done(summary, error):
+            alive = win.winfo_exists()
+            if alive:
+                import_button.configure(state="normal", text="Import CSV / vCard")
+            parent = win if alive else self.root
+            if error is not None:
+                messagebox.showerror("Import Failed", str(error), parent=parent)
+                return
+            details = "".join(f"\nline {line}: {reason}" for line, reason in summary["errors"][:10])
+            messagebox.showinfo("Import Complete", f"{summary['inserted']} added, {summary['updated']} updated, "
+                                                   f"{summary['rejected']} rejected.{details}", parent=parent)
+            if alive:
+                run_search()
+
+        import_button = tb.Button(win, text="Import CSV / vCard", bootstyle=PRIMARY, command=import_clients)
+        import_button.pack(pady=(0, 10))
 
         # Right-click menu
         menu = tb.Menu(win, tearoff=0)
         menu.add_command(label="Edit", command=lambda: edit_client(tree))
         menu.add_command(label="Delete", command=lambda: delete_client(tree))
         menu.add_command(label="Manage Files", command=lambda: self.manage_client_files(tree))
+        menu.add_separator()
+        menu.add_command(label="View Receipts", command=lambda: view_receipts(tree))
+
+        def view_receipts(treeview):
+            selected = treeview.selection()
+            if not selected:
+                messagebox.showwarning("Select Client", "Please select a client.")
+                return
+            name, email, _ = treeview.item(selected[0])["values"]
+            self.show_receipts("" if name == "(No Name)" else name, email, int(selected[0]))
 
         def show_menu(event):
             if tree.identify_row(event.y):
@@ -645,18 +1610,12 @@ class ProductOrganizerApp:
                 messagebox.showinfo("Select Product", "Please select a product from the main list to send.")
                 return
 
-            product_index = self.tree.index(main_selected[0])
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT title, filepath FROM products ORDER BY date_added DESC")
-            rows = c.fetchall()
-            conn.close()
-
-            if product_index >= len(rows):
-                messagebox.showerror("Error", "Product index out of range.")
+            product = self.catalog.get(int(main_selected[0]))
+            if product is None:
+                messagebox.showerror("Error", "Selected product not found.")
                 return
 
-            title, filepath = rows[product_index]
+            title, filepath = product.title, product.filepath
             file_name = os.path.basename(filepath)
 
             win = tb.Toplevel(self.root)
@@ -668,16 +1627,10 @@ class ProductOrganizerApp:
             subject_var = tb.StringVar(value=f"Sharing: {title}")
             tb.Entry(win, textvariable=subject_var, width=60).pack(padx=10, pady=5)
 
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT title, body FROM templates ORDER BY date_added DESC")
-            templates = c.fetchall()
-            conn.close()
-
             tb.Label(win, text="Use Template:").pack(anchor="w", padx=10, pady=(10, 0))
             template_var = tb.StringVar()
             template_dropdown = tb.Combobox(win, textvariable=template_var,
-                                            values=[t[0] for t in templates], width=60)
+                                            values=self.templates.titles(), width=60)
             template_dropdown.pack(padx=10, pady=5)
 
             tb.Label(win, text="Message:").pack(anchor="w", padx=10)
@@ -685,6 +1638,8 @@ class ProductOrganizerApp:
             message_box.insert("1.0", "Please find the attached file.")
             message_box.pack(padx=10, pady=5, fill="both", expand=True)
 
+            compress_var = self.add_compression_option(win)
+
             tb.Label(win, text="Price:").pack(padx=10, anchor="w")
             price_var = tb.StringVar()
             tb.Entry(win, textvariable=price_var).pack(padx=10, pady=5)
@@ -712,42 +1667,27 @@ class ProductOrganizerApp:
             tb.Label(win, textvariable=logo_path_var, wraplength=500, justify="left").pack(padx=10)
 
             def fill_template(event=None):
-                selected_title = template_var.get()
-                for t_title, t_body in templates:
-                    if t_title == selected_title:
-                        message_box.delete("1.0", "end")
-                        message_box.insert("1.0", t_body)
-                        break
+                body = self.templates.body(template_var.get())
+                if body is not None:
+                    message_box.delete("1.0", "end")
+                    message_box.insert("1.0", body)
 
             template_dropdown.bind("<<ComboboxSelected>>", fill_template)
 
             def send_email():
-                subject = subject_var.get().strip()
-                message_body = message_box.get("1.0", "end").strip()
-
-                if not subject or not message_body:
-                    messagebox.showwarning("Missing", "Subject and message are required.")
-                    return
-
                 try:
-                    EMAIL_ADDRESS = os.getenv("APP_EMAIL")
-                    EMAIL_PASSWORD = os.getenv("APP_PASSWORD")
-
-                    msg = EmailMessage()
-                    msg['Subject'] = subject
-                    msg['From'] = EMAIL_ADDRESS
-                    msg['To'] = email
-                    msg.set_content(message_body)
-
-                    with open(filepath, 'rb') as f:
-                        file_data = f.read()
+                    context = templating.make_context(
+                        client_name=name, client_email=email, product_title=title, file_name=file_name,
+                        price=price_var.get(), discount=discount_var.get(), tax=tax_var.get(),
+                        sender=os.getenv("APP_EMAIL"))
+                    subject = templating.render(subject_var.get().strip(), context)
+                    message_body = templating.render(message_box.get("1.0", "end").strip(), context)
 
-                    msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=file_name)
+                    if not subject or not message_body:
+                        messagebox.showwarning("Missing", "Subject and message are required.")
+                        return
 
-                    with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-                        smtp.starttls()
-                        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                        smtp.send_message(msg)
+                    self.queue_email(email, subject, message_body, [filepath], compress=compress_var.get())
 
                     client_name_final = name or email.split("@")[0]
                     try:
@@ -771,11 +1711,11 @@ class ProductOrganizerApp:
                     except Exception as e:
                         print("Failed to generate receipt:", e)
 
-                    messagebox.showinfo("Success", f"Email sent to {email}")
+                    messagebox.showinfo("Success", f"Email to {email} queued for delivery.")
                     win.destroy()
 
                 except Exception as e:
-                    messagebox.showerror("Error", f"Failed to send email:\n{e}")
+                    messagebox.showerror("Error", f"Failed to queue email:\n{e}")
 
             tb.Button(win, text="Send Email", bootstyle=SUCCESS, command=send_email).pack(pady=10)
 
@@ -824,18 +1764,12 @@ class ProductOrganizerApp:
                 messagebox.showwarning("No selection", "Please select a product first in the main list.")
                 return
 
-            index = self.tree.index(selected[0])
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT title, filepath FROM products ORDER BY date_added DESC")
-            rows = c.fetchall()
-            conn.close()
-
-            if index >= len(rows):
+            product = self.catalog.get(int(selected[0]))
+            if product is None:
                 messagebox.showerror("Error", "Selected product not found.")
                 return
 
-            title, filepath = rows[index]
+            title, filepath = product.title, product.filepath
             file_name = os.path.basename(filepath)
 
             win = tb.Toplevel(self.root)
@@ -860,27 +1794,22 @@ class ProductOrganizerApp:
             message_box.pack(padx=10, pady=5, fill="both")
 
             # Template dropdown
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT title, body FROM templates ORDER BY date_added DESC")
-            templates = c.fetchall()
-            conn.close()
-
             tb.Label(win, text="Use Template:").pack(anchor="w", padx=10)
             template_var = tk.StringVar()
             template_dropdown = tb.Combobox(win, textvariable=template_var,
-                                            values=[t[0] for t in templates], width=60)
+                                            values=self.templates.titles(), width=60)
             template_dropdown.pack(padx=10, pady=5)
 
             def fill_template(event=None):
-                for t_title, t_body in templates:
-                    if t_title == template_var.get():
-                        message_box.delete("1.0", "end")
-                        message_box.insert("1.0", t_body)
-                        break
+                body = self.templates.body(template_var.get())
+                if body is not None:
+                    message_box.delete("1.0", "end")
+                    message_box.insert("1.0", body)
 
             template_dropdown.bind("<<ComboboxSelected>>", fill_template)
 
+            compress_var = self.add_compression_option(win)
+
             # Price / Discount / Tax inputs
             tb.Label(win, text="Price:").pack(padx=10, anchor="w")
             price_var = tk.StringVar()
@@ -910,31 +1839,18 @@ class ProductOrganizerApp:
 
             def send_action():
                 to = to_var.get().strip()
-                subject = subject_var.get().strip()
-                body = message_box.get("1.0", "end").strip()
-
-                if not to or not subject or not body:
-                    messagebox.showerror("Missing Data", "Email, subject, and message are required.")
-                    return
-
                 try:
-                    EMAIL_ADDRESS = os.getenv("APP_EMAIL")
-                    EMAIL_PASSWORD = os.getenv("APP_PASSWORD")
+                    context = templating.make_context(
+                        client_email=to, product_title=title, file_name=file_name, price=price_var.get(),
+                        discount=discount_var.get(), tax=tax_var.get(), sender=os.getenv("APP_EMAIL"))
+                    subject = templating.render(subject_var.get().strip(), context)
+                    body = templating.render(message_box.get("1.0", "end").strip(), context)
 
-                    msg = EmailMessage()
-                    msg['Subject'] = subject
-                    msg['From'] = EMAIL_ADDRESS
-                    msg['To'] = to
-                    msg.set_content(body)
+                    if not to or not subject or not body:
+                        messagebox.showerror("Missing Data", "Email, subject, and message are required.")
+                        return
 
-                    with open(filepath, 'rb') as f:
-                        file_data = f.read()
-                    msg.add_attachment(file_data, maintype='application', subtype='octet-stream', filename=file_name)
-
-                    with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-                        smtp.starttls()
-                        smtp.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                        smtp.send_message(msg)
+                    self.queue_email(to, subject, body, [filepath], compress=compress_var.get())
 
                     client_name = to.split("@")[0]
                     price_str = price_var.get().strip()
@@ -960,18 +1876,18 @@ class ProductOrganizerApp:
                             print("Error generating receipt:", e)
                     else:
                         # fallback text receipt
-                        txt_path = os.path.join(FILE_DIR, "receipts", f"{client_name}_{file_name}.txt")
-                        os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+                        txt_path = reserve_receipt_path(RECEIPT_DIR, client_name, self.clients.id_for(to),
+                                                        datetime.now(), ext=".txt")
                         with open(txt_path, "w") as f:
                             f.write(
                                 f"Receipt\nClient: {client_name}\nEmail: {to}\nFile: {file_name}\nDate: {datetime.now()}")
                         subprocess.Popen(['start', txt_path], shell=True)
 
-                    messagebox.showinfo("Success", f"Email sent to {to}")
+                    messagebox.showinfo("Success", f"Email to {to} queued for delivery.")
                     win.destroy()
 
                 except Exception as e:
-                    messagebox.showerror("Error", f"Failed to send email:\n{e}")
+                    messagebox.showerror("Error", f"Failed to queue email:\n{e}")
 
             tb.Button(win, text="Send Email", bootstyle=SUCCESS, command=send_action).pack(pady=15)
 
@@ -1016,6 +1932,8 @@ class ProductOrganizerApp:
             import tkinter as tk
             text_box = tk.Text(t_win, height=10, wrap="word")
             text_box.pack(padx=10, pady=5, fill="both", expand=True)
+            tb.Label(t_win, text="Placeholders: " + " ".join("{%s}" % p for p in templating.PLACEHOLDERS),
+                     wraplength=460, justify="left").pack(padx=10, anchor="w")
 
             # Save button
             def save_template():
@@ -1030,6 +1948,7 @@ class ProductOrganizerApp:
                           (title, body, datetime.now().strftime("%Y-%m-%d")))
                 conn.commit()
                 conn.close()
+                self.templates.invalidate()
                 t_win.destroy()
                 refresh()
 
@@ -1048,6 +1967,7 @@ class ProductOrganizerApp:
             c.execute("DELETE FROM templates WHERE id = ?", (selected[0],))
             conn.commit()
             conn.close()
+            self.templates.invalidate()
             refresh()
 
         btn_frame = tb.Frame(win)
@@ -1069,11 +1989,11 @@ class ProductOrganizerApp:
             extra_save_paths=[],
             logo_path=None
     ):
-        now = datetime.now().strftime("%Y-%m-%d %H:%M")
-        base_filename = f"{client_name.replace(' ', '_')}_{now.replace(':', '_').replace(' ', '_')}"
-        receipt_dir = os.path.join(FILE_DIR, "receipts")
-        os.makedirs(receipt_dir, exist_ok=True)
-        receipt_path = os.path.join(receipt_dir, f"{base_filename}.pdf")
+        issued = datetime.now()
+        now = issued.strftime("%Y-%m-%d %H:%M")
+        client = self.clients.get(client_email)
+        # receipts/<year>/<month>/<client id>/, under a name no other receipt can already have
+        receipt_path = reserve_receipt_path(RECEIPT_DIR, client_name, client[0] if client else None, issued)
 
         c = canvas.Canvas(receipt_path, pagesize=LETTER)
         width, height = LETTER
@@ -1166,12 +2086,23 @@ class ProductOrganizerApp:
             os.makedirs(os.path.dirname(path), exist_ok=True)
             shutil.copy(receipt_path, path)
 
+        # Keep the figures queryable without re-reading the PDF; filed under the saved address so the
+        # client's sales add up however the address was typed this time
+        self.sales.record(client_name, client[2] if client else client_email, items, discount, tax,
+                          receipt=os.path.relpath(receipt_path, RECEIPT_DIR).replace(os.sep, "/"))
+
         return receipt_path
 
 
 # Run app
 if __name__ == "__main__":
+    # Opt-in: python DPO1.py --profile [--slow-ms 50]  (or DPO_PROFILE=1)
+    profiler = profiling.from_args(sys.argv[1:])
+    if profiler:
+        profiler.install(ProductOrganizerApp)
     init_db()
     root = tb.Window(themename="flatly")
     app = ProductOrganizerApp(root)
+    if profiler:
+        root.bind_all("<Control-Shift-P>", lambda event: profiler.arm_capture())
     root.mainloop()
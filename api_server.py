@@ -0,0 +1,310 @@
+"""Optional local HTTP/JSON API over the catalog, clients, receipts and outbox.
+
+Started by the app when ``API_PORT`` is set, or on its own with
+``python api_server.py --port 8765`` (sends are then delivered by the app's
+dispatcher the next time it checks the outbox). It binds to 127.0.0.1 by
+default; set ``API_TOKEN`` to require ``Authorization: Bearer <token>`` on
+every request. Without it, a random token is generated at start-up, written
+to ``.cache/api_token`` and required for ``POST /api/send``, so nothing but a
+local program that can read that file can queue email.
+
+Any web page the user has open can also reach 127.0.0.1, so requests carrying
+an ``Origin`` header (which browsers add to cross-site requests) or a ``Host``
+other than a loopback name are refused, and ``/api/send`` only accepts an
+``application/json`` body, which a page cannot send without a CORS preflight.
+
+    GET  /api/products?q=&limit=&after=     search (title/tags/category), newest first
+    GET  /api/products/<id>                 metadata
+    GET  /api/products/<id>/file            download (zero-copy sendfile)
+    GET  /api/clients?q=                    prefix search, or newest first without q
+    GET  /api/receipts?client=              active and archived receipts for a client
+    POST /api/send                          {"to", "subject", "body", "product_ids", "compress"}
+
+Requests are served on a thread each and borrow a read-only connection from a
+small pool; the database is in WAL mode (see ``init_db``), so reads run
+concurrently with the app's writes instead of waiting on them.
+"""
+import argparse
+import json
+import mimetypes
+import os
+import queue
+import re
+import secrets
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from bundling import MODES as COMPRESSION_MODES
+from client_directory import ClientDirectory
+from outbox import Outbox
+from receipt_archive import ReceiptArchive
+
+MAX_LIMIT = 500
+MAX_BODY = 1024 * 1024
+TOKEN_FILE = os.path.join(".cache", "api_token")
+_LOOPBACK = ("127.0.0.1", "localhost", "::1")
+
+_PRODUCT = re.compile(r"^/api/products/(\d+)(/file)?$")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class CatalogApi:
+    """The request handlers, independent of HTTP plumbing."""
+
+    def __init__(self, db_file, receipt_dir, receipt_view_dir, on_enqueue=None):
+        self.db_file = db_file
+        self.clients = ClientDirectory(db_file)
+        self.receipts = ReceiptArchive(db_file, receipt_dir, receipt_view_dir)
+        self.outbox = Outbox(db_file)
+        self.on_enqueue = on_enqueue
+        self._readers = queue.LifoQueue()
+
+    @contextmanager
+    def _reader(self):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.db_file)}?mode=ro", uri=True,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @staticmethod
+    def _product(row):
+        path = row["filepath"]
+        size = os.path.getsize(path) if path and os.path.exists(path) else None
+        return {"id": row["id"], "title": row["title"], "tags": row["tags"], "category": row["category"],
+                "file": os.path.basename(path or ""), "size": size, "date_added": row["date_added"],
+                "download": f"/api/products/{row['id']}/file" if size is not None else None}
+
+    def search_products(self, q="", limit=50, after=None):
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        # Keyset paging on rowid: newest id first, `after` is the last id of the previous page
+        after = int(after) if after else 1 << 62
+        pattern = f"%{q.strip()}%"
+        with self._reader() as conn:
+            # plan-ok: substring search cannot use an index; the id range bounds the walk
+            rows = conn.execute(
+                "SELECT id, title, tags, category, filepath, date_added FROM products "
+                "WHERE id < ? AND deleted_at IS NULL AND (title LIKE ? OR tags LIKE ? OR category LIKE ?) "
+                "ORDER BY id DESC LIMIT ?",
+                (after, pattern, pattern, pattern, limit)).fetchall()
+        items = [self._product(row) for row in rows]
+        return {"items": items, "next": items[-1]["id"] if len(items) == limit else None}
+
+    def _product_row(self, product_id):
+        with self._reader() as conn:
+            row = conn.execute("SELECT id, title, tags, category, filepath, date_added FROM products "
+                               "WHERE id = ? AND deleted_at IS NULL", (product_id,)).fetchone()
+        if row is None:
+            raise ApiError(404, f"no product {product_id}")
+        return row
+
+    def product(self, product_id):
+        return self._product(self._product_row(product_id))
+
+    def product_file(self, product_id):
+        path = self._product_row(product_id)["filepath"]
+        if not path or not os.path.isfile(path):
+            raise ApiError(404, "file missing on disk")
+        return path
+
+    def find_clients(self, q="", limit=50):
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        rows = self.clients.search(q, limit) if q.strip() else self.clients.page(None, limit)[0]
+        return {"items": [{"id": cid, "name": name, "email": email, "date_added": added}
+                          for cid, name, email, added in rows]}
+
+    def list_receipts(self, client):
+        if not client.strip():
+            raise ApiError(400, "client is required")
+        return {"items": [{"file": r.filename, "client": r.client, "issued": r.issued.isoformat(),
+                           "size": r.size, "archived": r.bundle is not None}
+                          for r in self.receipts.for_client(client)]}
+
+    def send(self, payload):
+        to = (payload.get("to") or "").strip()
+        if "@" not in to:
+            raise ApiError(400, "'to' must be an email address")
+        subject, body = payload.get("subject") or "", payload.get("body") or ""
+        if not subject or not body:
+            raise ApiError(400, "'subject' and 'body' are required")
+        compress = payload.get("compress", "auto")
+        if compress not in COMPRESSION_MODES:
+            raise ApiError(400, f"'compress' must be one of {', '.join(COMPRESSION_MODES)}")
+        attachments = [self.product_file(int(pid)) for pid in payload.get("product_ids") or []]
+        # Several products may be split across numbered messages to stay under the provider's size limit
+        outbox_ids = self.outbox.enqueue_split(to, subject, body, attachments, compress=compress)
+        if self.on_enqueue:
+            self.on_enqueue()
+        return {"id": outbox_ids[0], "ids": outbox_ids, "status": "pending",
+                "queued_at": datetime.now().isoformat(timespec="seconds")}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "DPO-API/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def log_message(self, format, *args):
+        pass  # keep the app's console quiet
+
+    def _authorized(self, sending):
+        token = self.server.token
+        if not token or not (sending or self.server.token_required):
+            return True
+        return secrets.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}")
+
+    def _local(self):
+        """False for browser cross-site requests and DNS-rebound host names."""
+        if self.headers.get("Origin") is not None:
+            return False
+        host = urlsplit("//" + (self.headers.get("Host") or "")).hostname or ""
+        return host in _LOOPBACK or host == self.server.server_name_allowed
+
+    def _json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        if not self._body_read:
+            # An unread body would be parsed as the next request on this keep-alive connection
+            self.close_connection = True
+        self._json(status, {"error": message})
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._body_read = method != "POST"
+        try:
+            if not self._local():
+                raise ApiError(403, "cross-origin and non-local requests are not accepted")
+            if not self._authorized(sending=method == "POST"):
+                raise ApiError(401, "missing or wrong bearer token")
+            m = _PRODUCT.match(url.path)
+            if method == "GET" and url.path == "/api/products":
+                self._json(200, self.api.search_products(query.get("q", ""), query.get("limit", 50),
+                                                         query.get("after")))
+            elif method == "GET" and m and m.group(2):
+                self._send_file(self.api.product_file(int(m.group(1))))
+            elif method == "GET" and m:
+                self._json(200, self.api.product(int(m.group(1))))
+            elif method == "GET" and url.path == "/api/clients":
+                self._json(200, self.api.find_clients(query.get("q", ""), query.get("limit", 50)))
+            elif method == "GET" and url.path == "/api/receipts":
+                self._json(200, self.api.list_receipts(query.get("client", "")))
+            elif method == "POST" and url.path == "/api/send":
+                if self.headers.get_content_type() != "application/json":
+                    raise ApiError(415, "body must be sent as application/json")
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY:
+                    raise ApiError(413, "request body too large")
+                body = self.rfile.read(length)
+                self._body_read = True
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    raise ApiError(400, "body must be JSON")
+                self._json(202, self.api.send(payload))
+            else:
+                raise ApiError(404, "no such endpoint")
+        except ApiError as e:
+            self._error(e.status, str(e))
+        except ValueError as e:
+            self._error(400, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            self._error(500, str(e))
+
+    def _send_file(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(path)}"')
+            self.end_headers()
+            self.wfile.flush()
+            # socket.sendfile uses os.sendfile where available: the kernel copies file to socket
+            self.connection.sendfile(f)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api, host="127.0.0.1", port=8765, token=None, token_file=TOKEN_FILE):
+        super().__init__((host, port), ApiHandler)
+        self.api = api
+        # An explicit API_TOKEN guards every endpoint; a generated one guards sending
+        self.token_required = bool(token)
+        self.token = token or self._generate_token(token_file)
+        # Bound to a specific address: requests naming it are local by choice, not by a rebound DNS name
+        self.server_name_allowed = host if host not in ("", "0.0.0.0", "::") else None
+
+    @staticmethod
+    def _generate_token(token_file):
+        token = secrets.token_urlsafe(32)
+        if token_file:
+            os.makedirs(os.path.dirname(token_file) or ".", exist_ok=True)
+            fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+        return token
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="api-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the catalog over a local JSON API.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--receipts", default=os.path.join("files", "receipts"))
+    parser.add_argument("--host", default=os.getenv("API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8765")))
+    args = parser.parse_args()
+    api = CatalogApi(args.db, args.receipts, os.path.join(".cache", "receipts"))
+    server = ApiServer(api, args.host, args.port, os.getenv("API_TOKEN"))
+    print(f"Serving on http://{args.host}:{args.port}/api/")
+    if not server.token_required:
+        print(f"POST /api/send requires 'Authorization: Bearer <token>', token in {TOKEN_FILE}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
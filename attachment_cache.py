@@ -0,0 +1,190 @@
+"""On-disk cache of base64-encoded attachment bodies.
+
+Sending the same product to many clients used to re-read and re-encode the
+file for every message. Here each file version is hashed once and its encoded
+body (CRLF line endings, ready for the wire) is written to
+``cache_dir/<sha256>.b64`` once. Messages carry a short placeholder in the
+attachment part, and ``flatten()`` splices the cached bytes in when the message
+is serialized, so neither base64 nor the email generator touch the file again.
+The directory is kept under a size cap by evicting the least recently used
+entries; an entry being read is never evicted, and a file whose encoding
+alone would exceed the cap is encoded straight from the source instead of
+being cached.
+"""
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import Counter, OrderedDict
+from email.generator import BytesGenerator
+from email.message import MIMEPart
+
+_CHUNK = 57 * 1024 * 16  # multiple of 57 bytes so every encoded line is a full 76 chars
+
+
+class AttachmentCache:
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, memory_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._digests = {}          # (path, size, mtime_ns) -> sha256
+        self._memory = OrderedDict()  # sha256 -> encoded bytes, most recently used last
+        self._memory_size = 0
+        self._in_use = Counter()    # entry path -> readers; pinned against eviction
+
+    # ---- hashing ----
+    def digest(self, path):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            self._digests[key] = digest
+        return digest
+
+    def _entry_path(self, digest):
+        return os.path.join(self.cache_dir, digest + ".b64")
+
+    def _cacheable(self, path):
+        # Each 57-byte line of input becomes 76 base64 characters plus CRLF
+        return (os.path.getsize(path) + 56) // 57 * 78 <= self.max_bytes
+
+    def _key_lock(self, digest):
+        with self._lock:
+            return self._key_locks.setdefault(digest, threading.Lock())
+
+    # ---- encoding ----
+    def encoded(self, path):
+        """Return the base64 body for ``path``, encoding it at most once per file version."""
+        return self._encoded(self.digest(path), path)
+
+    def _ensure(self, digest, path):
+        entry = self._entry_path(digest)
+        with self._key_lock(digest):
+            if not os.path.exists(entry):
+                self._encode_to(path, entry)
+                self._evict(keep=entry)
+            else:
+                os.utime(entry)  # mark as recently used for eviction
+        return entry
+
+    def _encoded(self, digest, path):
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                return data
+
+        if not self._cacheable(path):
+            data = b"".join(_encode_chunks(path))
+        else:
+            entry = self._entry_path(digest)
+            with self._lock:
+                self._in_use[entry] += 1
+            try:
+                # Re-created here if another send evicted it since part() was built
+                with open(self._ensure(digest, path), 'rb') as f:
+                    data = f.read()
+            finally:
+                with self._lock:
+                    self._in_use -= Counter({entry: 1})
+        self._remember(digest, data)
+        return data
+
+    def _encode_to(self, path, entry):
+        tmp = f"{entry}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as dst:
+            for chunk in _encode_chunks(path):
+                dst.write(chunk)
+        os.replace(tmp, entry)
+
+    def _remember(self, digest, data):
+        size = len(data)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if digest in self._memory:
+                return
+            self._memory[digest] = data
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_size -= len(dropped)
+
+    def _evict(self, keep=None):
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".b64"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # Checked and removed under the lock: a reader pins its entry before it looks for the file
+            with self._lock:
+                if path == keep or path in self._in_use:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    # ---- MIME ----
+    def part(self, path, filename=None):
+        """An application/octet-stream part whose body is filled in by ``flatten()``."""
+        digest = self.digest(path)
+        if self._cacheable(path):
+            self._ensure(digest, path)
+        part = MIMEPart()
+        part['Content-Type'] = 'application/octet-stream'
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=filename or os.path.basename(path))
+        part.set_payload(_placeholder(digest))
+        part.cached_source = (digest, path)
+        return part
+
+    def flatten(self, msg):
+        """Serialize ``msg`` to wire-format bytes, splicing in cached attachment bodies."""
+        buf = io.BytesIO()
+        BytesGenerator(buf, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+        raw = buf.getvalue()
+        for part in msg.walk():
+            source = getattr(part, 'cached_source', None)
+            if source is None:
+                continue
+            digest, path = source
+            body = self._encoded(digest, path).rstrip(b"\r\n")
+            head, sep, tail = raw.partition(_placeholder(digest).encode('ascii'))
+            if sep:
+                raw = b"".join((head, body, tail))
+        return raw
+
+
+def _encode_chunks(path):
+    with open(path, 'rb') as src:
+        for chunk in iter(lambda: src.read(_CHUNK), b""):
+            yield base64.encodebytes(chunk).replace(b"\n", b"\r\n")
+
+
+def _placeholder(digest):
+    return f"@@attachment-cache:{digest}@@"
+
+
+def attach(msg, part):
+    """Add a pre-built part to an EmailMessage, converting it to multipart/mixed first."""
+    if msg.get_content_maintype() != 'multipart':
+        msg.make_mixed()
+    msg.attach(part)
@@ -0,0 +1,157 @@
+"""Optional zip packaging of outgoing attachments.
+
+In "auto" mode the compression ratio of each file is estimated from a few
+sampled blocks; the files are zipped only when that is expected to save a
+meaningful number of bytes. Bundles are built with streaming deflate (members
+that do not compress are stored as-is) and cached by content hash, so the same
+set of files is only zipped once. A bundle handed out by ``prepare()`` stays
+pinned against eviction until it is given back with ``release()``.
+"""
+import hashlib
+import os
+import threading
+import zipfile
+from collections import Counter
+import zlib
+
+MODES = ("auto", "always", "never")
+
+SAMPLE_SIZE = 64 * 1024
+MIN_SAVING_BYTES = 64 * 1024   # not worth a zip below this
+MIN_SAVING_RATIO = 0.10        # ... or when it saves less than 10% of the upload
+MEMBER_RATIO = 0.90            # members that compress worse than this are stored
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def estimate_ratio(path, sample_size=SAMPLE_SIZE):
+    """Compressed/original size estimated from blocks at the start, middle and end."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 1.0
+    offsets = sorted({0, max(size // 2 - sample_size // 2, 0), max(size - sample_size, 0)})
+    raw = packed = 0
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            block = f.read(sample_size)
+            raw += len(block)
+            packed += len(zlib.compress(block, 1))
+    return min(packed / raw, 1.0) if raw else 1.0
+
+
+def _normalize(attachments):
+    # Entries are paths or [path, display_name] pairs (as stored in the outbox)
+    items = []
+    for entry in attachments:
+        if isinstance(entry, (list, tuple)):
+            items.append((entry[0], entry[1]))
+        else:
+            items.append((entry, os.path.basename(entry)))
+    return items
+
+
+class Bundler:
+    def __init__(self, cache_dir, digest=None, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.digest = digest or _file_digest
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()   # guards the dicts below, never held while zipping
+        self._key_locks = {}            # zip path -> lock held while that bundle is built
+        self._ratios = {}  # (path, size, mtime_ns) -> estimated ratio
+        self._in_use = Counter()  # zip path -> sends still reading it
+
+    def ratio(self, path):
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if key not in self._ratios:
+            self._ratios[key] = estimate_ratio(path)
+        return self._ratios[key]
+
+    def should_bundle(self, paths):
+        total = saved = 0
+        for path in paths:
+            size = os.path.getsize(path)
+            total += size
+            saved += size * (1 - self.ratio(path))
+        return saved >= MIN_SAVING_BYTES and saved >= total * MIN_SAVING_RATIO
+
+    def _key_lock(self, zip_path):
+        with self._lock:
+            return self._key_locks.setdefault(zip_path, threading.Lock())
+
+    def bundle(self, items, name=None):
+        """Zip ``[(path, member_name)]`` (cached by content) and return (zip_path, display_name).
+
+        The zip is pinned against eviction until ``release()`` is called for it.
+        """
+        key = hashlib.sha256()
+        for path, member in items:
+            key.update(member.encode('utf-8') + b"\0" + self.digest(path).encode('ascii') + b"\0")
+        zip_path = os.path.join(self.cache_dir, key.hexdigest() + ".zip")
+        if name is None:
+            name = (os.path.splitext(items[0][1])[0] if len(items) == 1 else "attachments") + ".zip"
+
+        with self._lock:
+            self._in_use[zip_path] += 1
+        try:
+            # Only sends of this same set of files wait for each other here
+            with self._key_lock(zip_path):
+                if os.path.exists(zip_path):
+                    os.utime(zip_path)
+                    return zip_path, name
+                tmp = f"{zip_path}.{threading.get_ident()}.tmp"
+                with zipfile.ZipFile(tmp, 'w') as zf:
+                    for path, member in items:
+                        compress = zipfile.ZIP_DEFLATED if self.ratio(path) < MEMBER_RATIO else zipfile.ZIP_STORED
+                        # ZipFile.write streams the file in chunks rather than loading it whole
+                        zf.write(path, arcname=member, compress_type=compress, compresslevel=6)
+                os.replace(tmp, zip_path)
+        except BaseException:
+            self.release([(zip_path, name)])  # the caller never gets the zip, so never releases it
+            raise
+        self._evict()
+        return zip_path, name
+
+    def release(self, prepared):
+        """Unpin the bundles in a list returned by ``prepare()`` once the send is done with them."""
+        with self._lock:
+            for path, _ in _normalize(prepared):
+                if self._in_use[path] > 1:
+                    self._in_use[path] -= 1
+                else:
+                    self._in_use.pop(path, None)
+
+    def _evict(self):
+        # Least recently used bundles go first once the directory is over its cap
+        with os.scandir(self.cache_dir) as it:
+            entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.name.endswith(".zip"))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # Checked and removed under the lock: a send pins its zip before it looks for the file
+            with self._lock:
+                if path in self._in_use:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def prepare(self, attachments, mode="auto"):
+        """Return the attachment list to actually send: the originals or one zip."""
+        items = _normalize(attachments)
+        if not items or mode == "never":
+            return items
+        if mode == "auto" and not self.should_bundle([path for path, _ in items]):
+            return items
+        return [self.bundle(items)]
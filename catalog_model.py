@@ -0,0 +1,173 @@
+"""Compact in-memory model of the product list shown in the main window.
+
+Products are stored column-wise rather than as one object per product:
+
+- ids in an ``array`` (8 bytes each), with a sorted copy for id lookups;
+- titles and file names packed as UTF-8 into one buffer per column;
+- tags, categories and file directories as interned strings, since they
+  repeat across many products and interning keeps one copy per distinct value.
+
+``order`` holds the ids in display order (newest first). Removed products
+leave a hole in the columns that ``compact()`` reclaims once holes make up
+half of the slots.
+
+The Treeview only ever holds the rows scrolled into view (see
+``ProductOrganizerApp.render_more``); everything else reads from here.
+"""
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+Product = namedtuple("Product", "id title tags category filepath")
+
+
+def _intern(value):
+    return sys.intern(value) if value else ""
+
+
+class _TextColumn:
+    """Strings packed as UTF-8 in one buffer; item i is ``data[offsets[i]:offsets[i + 1]]``."""
+    __slots__ = ("data", "offsets")
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("q", [0])
+
+    def append(self, text):
+        self.data += text.encode("utf-8")
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+
+class CatalogModel:
+    def __init__(self, rows=()):
+        self.load(rows)
+
+    def load(self, rows):
+        """Replace the contents with rows of (id, title, tags, category, filepath), in display order."""
+        self._ids = array("q")          # by slot; 0 marks a removed product
+        self._titles = _TextColumn()
+        self._names = _TextColumn()
+        self._tags = []
+        self._categories = []
+        self._dirs = []
+        self._holes = 0
+        self._lower = {}                # interned value -> lower-cased, for search
+        for row in rows:
+            self._append(row)
+        self.order = array("q", self._ids)
+        slots = sorted(range(len(self._ids)), key=self._ids.__getitem__)
+        self._sorted_ids = array("q", (self._ids[slot] for slot in slots))
+        self._sorted_slots = array("q", slots)
+
+    def _append(self, row):
+        product_id, title, tags, category, filepath = row
+        directory, name = os.path.split(filepath or "")
+        self._ids.append(product_id)
+        self._titles.append(title or "")
+        self._names.append(name)
+        self._tags.append(_intern(tags))
+        self._categories.append(_intern(category))
+        self._dirs.append(_intern(directory))
+        return len(self._ids) - 1
+
+    def _find(self, product_id):
+        i = bisect_left(self._sorted_ids, product_id)
+        return i if i < len(self._sorted_ids) and self._sorted_ids[i] == product_id else None
+
+    def _slot(self, product_id):
+        i = self._find(product_id)
+        return None if i is None else self._sorted_slots[i]
+
+    def __len__(self):
+        return len(self._sorted_ids)
+
+    def __contains__(self, product_id):
+        return self._find(product_id) is not None
+
+    # ---- reading ----
+    def get(self, product_id):
+        slot = self._slot(product_id)
+        if slot is None:
+            return None
+        return Product(product_id, self._titles[slot], self._tags[slot], self._categories[slot],
+                       os.path.join(self._dirs[slot], self._names[slot]))
+
+    def filepath(self, product_id):
+        slot = self._slot(product_id)
+        return None if slot is None else os.path.join(self._dirs[slot], self._names[slot])
+
+    def display(self, product_id):
+        """Treeview values: (title, tags, category, file name)."""
+        slot = self._slot(product_id)
+        return self._titles[slot], self._tags[slot], self._categories[slot], self._names[slot]
+
+    def search(self, keyword):
+        """Ids, in display order, whose title, tags or category contain ``keyword`` (case-insensitive)."""
+        keyword = keyword.lower()
+        if not keyword:
+            return array("q", self.order)
+        matches = array("q")
+        for product_id in self.order:
+            slot = self._slot(product_id)
+            if keyword in self._lowered(self._tags[slot]) or keyword in self._lowered(self._categories[slot]) \
+                    or keyword in self._titles[slot].lower():
+                matches.append(product_id)
+        return matches
+
+    def _lowered(self, value):
+        # Interned values repeat, so each distinct one is lower-cased once
+        lowered = self._lower.get(value)
+        if lowered is None:
+            lowered = self._lower[value] = value.lower()
+        return lowered
+
+    # ---- changes ----
+    def add(self, row, front=True):
+        """Insert or update a product; new ones go to the top of the display order."""
+        product_id = row[0]
+        if product_id in self:
+            self.remove(product_id)
+        slot = self._append(row)
+        i = bisect_left(self._sorted_ids, product_id)
+        self._sorted_ids.insert(i, product_id)
+        self._sorted_slots.insert(i, slot)
+        if front:
+            self.order.insert(0, product_id)
+        else:
+            self.order.append(product_id)
+
+    def remove(self, product_id):
+        return self.remove_many([product_id]) == 1
+
+    def remove_many(self, product_ids):
+        """Drop products by id (one pass over the arrays however many); returns how many were present."""
+        gone = {product_id for product_id in product_ids if product_id in self}
+        if not gone:
+            return 0
+        if len(gone) == 1:
+            product_id = next(iter(gone))
+            i = self._find(product_id)
+            self._ids[self._sorted_slots[i]] = 0
+            del self._sorted_ids[i]
+            del self._sorted_slots[i]
+            self.order.remove(product_id)
+        else:
+            keep = [i for i, product_id in enumerate(self._sorted_ids) if product_id not in gone]
+            for i, product_id in enumerate(self._sorted_ids):
+                if product_id in gone:
+                    self._ids[self._sorted_slots[i]] = 0
+            self._sorted_ids = array("q", (self._sorted_ids[i] for i in keep))
+            self._sorted_slots = array("q", (self._sorted_slots[i] for i in keep))
+            self.order = array("q", (product_id for product_id in self.order if product_id not in gone))
+        self._holes += len(gone)
+        if self._holes * 2 > len(self._ids):
+            self.compact()
+        return len(gone)
+
+    def compact(self):
+        self.load([self.get(product_id) for product_id in self.order])
@@ -0,0 +1,61 @@
+"""Keyset-paged product ids in column order, for the sortable product list.
+
+Sorting a million products must not mean reading a million rows, so each
+heading maps to an expression with a matching partial index (see ``init_db``)
+and pages are fetched with ``ORDER BY <expr>, id LIMIT n``, continuing after
+the last (value, id) seen. Each page is one short index range read wherever
+in the list it starts.
+
+The ``expr >= ? AND (expr > ? OR id > ?)`` form is used instead of a row-value
+comparison because it lets SQLite seek into the index instead of walking it
+from the start.
+"""
+import sqlite3
+
+PAGE_SIZE = 500
+
+# Heading -> (sort expression, collation); NULLs sort as '' so the keyset always compares
+SORT_COLUMNS = {
+    "Title": ("ifnull(title, '')", "NOCASE"),
+    "Tags": ("ifnull(tags, '')", "NOCASE"),
+    "Category": ("ifnull(category, '')", "NOCASE"),
+    "File": ("file_name", "NOCASE"),   # generated from filepath, never NULL
+}
+
+
+def page_sql(column, descending=False, after=False):
+    expr, collation = SORT_COLUMNS[column]
+    key = f"{expr} COLLATE {collation}"
+    direction, past = ("DESC", "<") if descending else ("ASC", ">")
+    sql = f"SELECT id, {expr} FROM products WHERE deleted_at IS NULL"
+    if after:
+        sql += f" AND {key} {past}= ? AND ({key} {past} ? OR id {past} ?)"
+    return sql + f" ORDER BY {key} {direction}, id {direction} LIMIT ?"
+
+
+def planned_statements():
+    """Every statement ``page`` can issue, for query_plans.py (which only sees literal SQL)."""
+    for column in SORT_COLUMNS:
+        for descending in (False, True):
+            for after in (False, True):
+                yield page_sql(column, descending, after)
+
+
+class ProductPages:
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def page(self, column, descending=False, cursor=None, limit=PAGE_SIZE):
+        """The next ``limit`` product ids in ``column`` order.
+
+        Returns (ids, next_cursor); pass next_cursor back for the following
+        page. It is None once the end is reached.
+        """
+        params = [] if cursor is None else [cursor[0], cursor[0], cursor[1]]
+        conn = sqlite3.connect(self.db_file)
+        try:
+            rows = conn.execute(page_sql(column, descending, cursor is not None), (*params, limit)).fetchall()
+        finally:
+            conn.close()
+        next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return [product_id for product_id, _ in rows], next_cursor
@@ -0,0 +1,56 @@
+"""Snapshot of the first screen of the product list, for an instant first paint.
+
+Written on exit and read at start-up, before the database is touched, so the
+window shows products immediately; the app then loads the real list in the
+background and replaces the snapshot rows. The file is a small fixed binary
+layout (header, then per row an id and four length-prefixed UTF-8 strings)
+that loads in well under a millisecond. A missing, truncated or foreign file
+simply yields no rows.
+"""
+import os
+import struct
+
+MAGIC = b"DPOSNAP1"
+SNAPSHOT_ROWS = 200
+
+_HEADER = struct.Struct("<8sI")      # magic, row count
+_ROW = struct.Struct("<qIIII")       # id, then the byte length of title, tags, category, filepath
+
+
+def save(path, rows):
+    """Write rows of (id, title, tags, category, filepath), replacing the old snapshot atomically."""
+    rows = rows[:SNAPSHOT_ROWS]
+    parts = [_HEADER.pack(MAGIC, len(rows))]
+    for product_id, *fields in rows:
+        encoded = [(value or "").encode("utf-8") for value in fields]
+        parts.append(_ROW.pack(product_id, *map(len, encoded)))
+        parts.extend(encoded)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(b"".join(parts))
+    os.replace(tmp, path)
+
+
+def load(path):
+    """The saved rows, or [] if there is no usable snapshot."""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            return []
+        rows, offset = [], _HEADER.size
+        for _ in range(count):
+            product_id, *lengths = _ROW.unpack_from(data, offset)
+            offset += _ROW.size
+            fields = []
+            for length in lengths:
+                if offset + length > len(data):
+                    return []
+                fields.append(data[offset:offset + length].decode("utf-8"))
+                offset += length
+            rows.append((product_id, *fields))
+        return rows
+    except (OSError, struct.error, UnicodeDecodeError):
+        return []
@@ -0,0 +1,193 @@
+"""Paged loading, indexed prefix search and upserts over the clients table.
+
+Both lookups are index range scans (see the COLLATE NOCASE indexes created in
+``init_db``), so dialogs stay fast no matter how many clients are saved.
+
+A client is identified by its normalized address: ``email_norm`` is a column
+generated from the email (trimmed, lower-cased) with a unique index, so
+"Bob@X.com" and "bob@x.com" are one client whichever code path inserts them,
+and finding a client by address is a single index probe.
+``merge_duplicates`` folds together clients saved before the column existed.
+
+Folding is ASCII-only, because SQLite's ``lower()`` is: "ÉMILE@x.com" and
+"émile@x.com" stay two clients. Casefolding in Python would need an
+application-defined SQL function in the column expression, which any
+connection without it (other tools, the sqlite3 shell) could then not read
+or write. Non-ASCII local parts are rare, and the standards leave their case
+to the receiving server anyway.
+"""
+import json
+import re
+import sqlite3
+import string
+from datetime import datetime
+
+from storage_layout import merge_client_folders
+
+PAGE_SIZE = 200
+# Keeps the address first saved; fills in a name only when the client has none yet
+UPSERT_SQL = ("INSERT INTO clients (email, name, date_added) VALUES (?, ?, ?) "
+              "ON CONFLICT (email_norm) DO UPDATE SET name = coalesce(nullif(name, ''), excluded.name)")
+# Highest code point: "prefix" <= x < "prefix\U0010ffff" covers every string starting with prefix
+_PREFIX_END = "\U0010ffff"
+# SQLite's lower() only folds ASCII; probes must build the same key the column holds
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+_ENTRY = re.compile(r"^(.*?)\s*<([^<>\s]+@[^<>\s]+)>\s*$")
+
+
+def normalize_email(email):
+    """The form clients are matched on; the same as the generated ``email_norm`` column.
+
+    Only ASCII letters are lower-cased (see the module docstring).
+    """
+    return (email or "").strip().translate(_ASCII_LOWER)
+
+
+def format_entry(name, email):
+    return f"{name or '(No Name)'} <{email}>"
+
+
+def parse_entry(text):
+    """Return (name, email) from "Name <email>" or a bare address."""
+    text = (text or "").strip()
+    m = _ENTRY.match(text)
+    if m:
+        name = m.group(1)
+        return ("" if name == "(No Name)" else name), m.group(2)
+    if "@" in text and " " not in text:
+        return "", text
+    return "", ""
+
+
+class ClientDirectory:
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def _query(self, sql, params):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def page(self, cursor=None, limit=PAGE_SIZE):
+        """Newest clients first, ``limit`` at a time.
+
+        Returns (rows, next_cursor); rows are (id, name, email, date_added) and
+        next_cursor is None once the end is reached.
+        """
+        if cursor is None:
+            rows = self._query("SELECT id, name, email, date_added FROM clients "
+                               "ORDER BY date_added DESC, id DESC LIMIT ?", (limit,))
+        else:
+            rows = self._query("SELECT id, name, email, date_added FROM clients "
+                               "WHERE (date_added, id) < (?, ?) "
+                               "ORDER BY date_added DESC, id DESC LIMIT ?", (*cursor, limit))
+        next_cursor = (rows[-1][3], rows[-1][0]) if len(rows) == limit else None
+        return rows, next_cursor
+
+    def search(self, prefix, limit=50):
+        """Clients whose name or email starts with ``prefix`` (case-insensitive)."""
+        prefix = (prefix or "").strip()
+        if not prefix:
+            return self.page(limit=limit)[0]
+        hi = prefix + _PREFIX_END
+        rows = self._query(
+            "SELECT id, name, email, date_added FROM ("
+            "  SELECT * FROM (SELECT id, name, email, date_added FROM clients"
+            "                 WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE"
+            "                 ORDER BY name COLLATE NOCASE LIMIT ?)"
+            "  UNION"
+            "  SELECT * FROM (SELECT id, name, email, date_added FROM clients"
+            "                 WHERE email >= ? COLLATE NOCASE AND email < ? COLLATE NOCASE"
+            "                 ORDER BY email COLLATE NOCASE LIMIT ?)"
+            ") ORDER BY name COLLATE NOCASE, email COLLATE NOCASE LIMIT ?",
+            (prefix, hi, limit, prefix, hi, limit, limit))
+        return rows
+
+    def get(self, email):
+        """(id, name, email) of the client with this address in any letter case, or None."""
+        rows = self._query("SELECT id, name, email FROM clients WHERE email_norm = ?", (normalize_email(email),))
+        return rows[0] if rows else None
+
+    def id_for(self, email):
+        """The id of the client with this address, or None."""
+        client = self.get(email)
+        return client[0] if client else None
+
+    def upsert(self, email, name="", date_added=None):
+        """Save a client, or fill in the name of the one already saved under this address; returns its id."""
+        email = (email or "").strip()
+        date_added = date_added or datetime.now().strftime("%Y-%m-%d")
+        conn = sqlite3.connect(self.db_file)
+        try:
+            with conn:
+                conn.execute(UPSERT_SQL, (email, name or "", date_added))
+            return conn.execute("SELECT id FROM clients WHERE email_norm = ?", (normalize_email(email),)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def suggestions(self, prefix, limit=20):
+        return [format_entry(name, email) for _, name, email, _ in self.search(prefix, limit)]
+
+
+def merge_duplicates(conn, receipt_root, client_files_root):
+    """Fold clients whose addresses differ only in case or spaces into the oldest of them.
+
+    Receipts (archive rows and files), client files and ledger lines of the
+    duplicates are re-pointed to the kept client, which takes the first
+    non-empty name if it has none. Runs inside the caller's transaction;
+    returns the number of clients removed.
+    """
+    rows = conn.execute(  # plan-ok: one-off migration, before the unique index can exist
+        "SELECT id, name, email, email_norm FROM clients WHERE email_norm IN ("
+        "SELECT email_norm FROM clients GROUP BY email_norm HAVING COUNT(*) > 1) ORDER BY email_norm, id").fetchall()
+    keep, moves, names = {}, [], []
+    for client_id, name, email, norm in rows:
+        if norm not in keep:
+            keep[norm] = (client_id, email, name)
+            continue
+        kept_id, kept_email, kept_name = keep[norm]
+        moves.append((client_id, kept_id, kept_email, norm))
+        if not kept_name and name:
+            keep[norm] = (kept_id, kept_email, name)
+            names.append((name, kept_id))
+    if not moves:
+        return 0
+
+    # The mappings go in as JSON objects, so each statement below is one pass however many clients merge
+    emails = json.dumps({norm: email for _, _, email, norm in moves})
+    ids = json.dumps({str(old_id): new_id for old_id, new_id, _, _ in moves})
+    conn.executemany("UPDATE receipt_archive SET client_id = ? WHERE client_id = ?",
+                     [(new_id, old_id) for old_id, new_id, _, _ in moves])
+    # plan-ok: one pass over the ledger for every merged address
+    conn.execute("UPDATE sales_ledger SET client_email = "
+                 "(SELECT value FROM json_each(?) WHERE key = lower(trim(client_email))) "
+                 "WHERE lower(trim(client_email)) IN (SELECT key FROM json_each(?))", (emails, emails))
+    # plan-ok: the merged clients' rollups are recomputed from their ledger lines
+    conn.execute("DELETE FROM sales_daily_client WHERE lower(trim(client_email)) IN (SELECT key FROM json_each(?))",
+                 (emails,))
+    conn.execute(  # plan-ok: see above
+        "INSERT INTO sales_daily_client (day, client_email, orders, units, revenue_cents) "
+        "SELECT substr(sold_at, 1, 10), client_email, SUM(line_no = 0), SUM(quantity), SUM(total_cents) "
+        "FROM sales_ledger WHERE client_email IN (SELECT value FROM json_each(?)) "
+        "GROUP BY substr(sold_at, 1, 10), client_email", (emails,))
+    conn.executemany("UPDATE clients SET name = ? WHERE id = ?", names)
+    conn.executemany("DELETE FROM clients WHERE id = ?", [(old_id,) for old_id, _, _, _ in moves])
+    # Files next: the database changes are still uncommitted and roll back if anything above failed
+    renamed = merge_client_folders(receipt_root, client_files_root,
+                                   [(old_id, new_id) for old_id, new_id, _, _ in moves])
+    # Then the ledger's receipt paths: first those renamed to avoid a clash in the kept client's folder...
+    if renamed:
+        # plan-ok: one pass over the ledger, only when a receipt name clashed
+        conn.execute("UPDATE sales_ledger SET receipt = (SELECT value FROM json_each(?) WHERE key = receipt) "
+                     "WHERE receipt IN (SELECT key FROM json_each(?))", (json.dumps(dict(renamed)),) * 2)
+    # ...then the rest, which kept their names and only change client id ("YYYY/MM/<client id>/<name>")
+    # plan-ok: one pass over the ledger for every moved receipt
+    conn.execute("UPDATE sales_ledger SET receipt = substr(receipt, 1, 8) || (SELECT value FROM json_each(?) "
+                 "WHERE key = substr(receipt, 9, instr(substr(receipt, 9), '/') - 1)) || substr(receipt, "
+                 "8 + instr(substr(receipt, 9), '/')) "
+                 "WHERE receipt GLOB '[0-9][0-9][0-9][0-9]/[0-9][0-9]/*' "
+                 "AND substr(receipt, 9, instr(substr(receipt, 9), '/') - 1) IN (SELECT key FROM json_each(?))",
+                 (ids, ids))
+    return len(moves)
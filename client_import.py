@@ -0,0 +1,178 @@
+"""Bulk import of clients from CSV or vCard (.vcf) exports.
+
+Files are read a record at a time, never whole. Each address is validated,
+and then upserted in batches of ``BATCH_SIZE`` with one ``executemany``.
+Addresses are matched on the normalized address, like every other insert
+path (see client_directory.py), so re-importing a file or importing
+"Bob@X.com" next to a saved "bob@x.com" fills in names instead of adding
+duplicates. The whole import is one transaction: it is all saved or, on
+error, none of it is.
+
+    python client_import.py contacts.csv [--db database.db]
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from client_directory import UPSERT_SQL, normalize_email
+
+BATCH_SIZE = 5000
+MAX_ERRORS = 100   # rejected rows reported individually; the rest are only counted
+
+_EMAIL = re.compile(r"^[^@\s<>(),;:\"\[\]]+@[^@\s<>(),;:\"\[\]]+\.[^@\s<>(),;:\"\[\].]{2,}$")
+_EMAIL_HEADERS = ("email", "e-mail", "email address", "e-mail address", "mail", "e-mail 1 - value", "email 1")
+_NAME_HEADERS = ("name", "full name", "display name", "client", "customer")
+
+
+def valid_email(email):
+    return len(email) <= 254 and bool(_EMAIL.match(email))
+
+
+# ---- readers: yield (line number, name, email) ----
+def read_csv(f):
+    sample = f.read(8192)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(f, dialect)
+    header = [h.strip().lower() for h in next(reader, [])]
+    email_col = next((header.index(h) for h in _EMAIL_HEADERS if h in header),
+                     next((i for i, h in enumerate(header) if "mail" in h), None))
+    if email_col is None:
+        raise ValueError("No email column found (expected a header such as 'Email').")
+    name_col = next((header.index(h) for h in _NAME_HEADERS if h in header), None)
+    first_col = next((i for i, h in enumerate(header) if h in ("first name", "given name", "first")), None)
+    last_col = next((i for i, h in enumerate(header) if h in ("last name", "family name", "surname", "last")), None)
+
+    def cell(row, i):
+        return row[i].strip() if i is not None and i < len(row) else ""
+
+    for row in reader:
+        if not any(row):
+            continue
+        name = cell(row, name_col) or " ".join(filter(None, (cell(row, first_col), cell(row, last_col))))
+        yield reader.line_num, name, cell(row, email_col)
+
+
+def _unfolded(f):
+    """vCard lines with folded continuations (leading space or tab) joined back on, with line numbers."""
+    pending, start = None, 0
+    for number, line in enumerate(f, 1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield start, pending
+        pending, start = line, number
+    if pending is not None:
+        yield start, pending
+
+
+def _vcard_value(value):
+    return value.replace("\\,", ",").replace("\\;", ";").replace("\\n", " ").replace("\\\\", "\\").strip()
+
+
+def read_vcard(f):
+    card = None
+    for number, line in _unfolded(f):
+        key, _, value = line.partition(":")
+        params = key.split(";")
+        prop = params[0].split(".")[-1].upper()   # "item1.EMAIL" -> "EMAIL"
+        if prop == "BEGIN" and value.strip().upper() == "VCARD":
+            card = {"line": number, "fn": "", "n": "", "emails": []}
+        elif card is None:
+            continue
+        elif prop == "END":
+            emails = sorted(card["emails"], key=lambda e: not e[0])   # TYPE=pref first
+            name = card["fn"] or " ".join(reversed([p for p in card["n"].split(";")[:2] if p])).strip()
+            yield card["line"], name, emails[0][1] if emails else ""
+            card = None
+        elif prop == "FN":
+            card["fn"] = _vcard_value(value)
+        elif prop == "N":
+            card["n"] = value
+        elif prop == "EMAIL":
+            preferred = any("PREF" in p.upper() for p in params[1:])
+            card["emails"].append((preferred, _vcard_value(value)))
+
+
+def reader_for(path):
+    return read_vcard if os.path.splitext(path)[1].lower() in (".vcf", ".vcard") else read_csv
+
+
+# ---- import ----
+class ClientImport:
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def run(self, path, today=None):
+        """Import every client in ``path``.
+
+        Returns {"inserted", "updated", "rejected": counts, "errors": [(line, reason)]}.
+        A row whose address is already saved (or appeared earlier in the
+        file) counts as updated; its name is filled in if the client has none.
+        """
+        date_added = today or datetime.now().strftime("%Y-%m-%d")
+        summary = {"inserted": 0, "updated": 0, "rejected": 0, "errors": []}
+        seen = set()
+        conn = sqlite3.connect(self.db_file)
+        try:
+            with open(path, newline="", encoding="utf-8-sig", errors="replace") as f, conn:
+                conn.execute("BEGIN IMMEDIATE")
+                batch = []
+                for line, name, email in reader_for(path)(f):
+                    email = email.strip()
+                    if email.lower().startswith("mailto:"):
+                        email = email[7:]
+                    if not valid_email(email):
+                        summary["rejected"] += 1
+                        if len(summary["errors"]) < MAX_ERRORS:
+                            summary["errors"].append((line, f"invalid email {email!r}" if email else "no email"))
+                        continue
+                    batch.append((email, name, date_added))
+                    if len(batch) >= BATCH_SIZE:
+                        self._flush(conn, batch, seen, summary)
+                self._flush(conn, batch, seen, summary)
+        finally:
+            conn.close()
+        return summary
+
+    @staticmethod
+    def _flush(conn, batch, seen, summary):
+        if not batch:
+            return
+        keys = [normalize_email(email) for email, _, _ in batch]
+        # plan-ok: walks the batch's own addresses, one index probe each, to tell inserts from updates
+        saved = {norm for (norm,) in conn.execute(
+            "SELECT email_norm FROM clients WHERE email_norm IN (SELECT value FROM json_each(?))",
+            (json.dumps(keys),))}
+        for norm in keys:
+            if norm in saved or norm in seen:
+                summary["updated"] += 1
+            else:
+                summary["inserted"] += 1
+                seen.add(norm)
+        conn.executemany(UPSERT_SQL, batch)
+        batch.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import clients from a CSV or vCard file.")
+    parser.add_argument("path", help=".csv (with an Email column) or .vcf")
+    parser.add_argument("--db", default="database.db")
+    args = parser.parse_args()
+    summary = ClientImport(args.db).run(args.path)
+    print(f"{summary['inserted']} inserted, {summary['updated']} updated, {summary['rejected']} rejected")
+    for line, reason in summary["errors"]:
+        print(f"  line {line}: {reason}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""Keep the database in step with files added or removed under files/ outside the app.
+
+Uses inotify on Linux and falls back to polling snapshots everywhere else.
+Raw events are coalesced per path and applied in batches, and the resulting
+``ChangeSet`` is handed to a callback so open views can update only the rows
+that changed. Where polling is the only option (Windows), the
+``slow_dirs`` subtrees (receipts, client files: many files, written only by
+the app) are re-scanned once a minute rather than every pass. A file modified within the last ``settle_delay`` seconds is
+assumed to be still being written and is looked at again once it has settled.
+Products whose file disappears are hidden and flagged ``missing_since``, not
+deleted, and are shown again if the file comes back.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+
+# inotify masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def resolve_path(path):
+    # Stored paths may come from Windows ("files\\x.pdf"); make them usable here
+    return path.replace("\\", os.sep).replace("/", os.sep)
+
+
+def path_variants(path):
+    # Every spelling the products table may hold for the same file
+    return {path, path.replace(os.sep, "\\"), path.replace(os.sep, "/")}
+
+
+def scan_tree(roots, skip=()):
+    """Return {path: (size, mtime)} for every regular file below ``roots``, leaving out the ``skip`` subtrees."""
+    found = {}
+    skip = {os.path.normpath(path) for path in skip}
+    stack = [root for root in roots if os.path.normpath(root) not in skip]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in skip:
+                            stack.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        found[entry.path] = (st.st_size, st.st_mtime)
+                except OSError:
+                    continue
+    return found
+
+
+class ChangeSet:
+    """Rows touched by one applied batch."""
+
+    __slots__ = ("products_added", "products_removed", "files_changed", "files_removed")
+
+    def __init__(self):
+        self.products_added = []    # [(id, title, tags, category, filepath)]
+        self.products_removed = []  # [id]
+        self.files_changed = []     # [path]
+        self.files_removed = []     # [path]
+
+    def __bool__(self):
+        return bool(self.products_added or self.products_removed or
+                    self.files_changed or self.files_removed)
+
+
+class PollingBackend:
+    """Snapshot diffing; works on every platform."""
+
+    def __init__(self, roots, interval=2.0, slow_dirs=(), slow_interval=60.0):
+        self.roots = roots
+        self.interval = interval
+        self.slow_dirs = [os.path.normpath(d) for d in slow_dirs]
+        self.slow_interval = slow_interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, emit):
+        def run():
+            # The first walk happens here too, never on the caller's (UI) thread
+            snapshot = scan_tree(self.roots, skip=self.slow_dirs)
+            slow = scan_tree(self.slow_dirs)
+            slow_at = time.monotonic()
+            while not self._stop.wait(self.interval):
+                snapshot = self._diff(snapshot, scan_tree(self.roots, skip=self.slow_dirs), emit)
+                if self.slow_dirs and time.monotonic() - slow_at >= self.slow_interval:
+                    slow = self._diff(slow, scan_tree(self.slow_dirs), emit)
+                    slow_at = time.monotonic()
+
+        self._thread = threading.Thread(target=run, name="fs-poll", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _diff(snapshot, current, emit):
+        for path, meta in current.items():
+            if snapshot.get(path) != meta:
+                emit(path)
+        for path in snapshot.keys() - current.keys():
+            emit(path)
+        return current
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+
+
+class InotifyBackend:
+    """Linux inotify through ctypes, one watch per directory."""
+
+    def __init__(self, roots):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name or not hasattr(os, "pipe"):
+            raise OSError("libc not available")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        self.roots = roots
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._dirs = {}  # wd -> directory
+        self._thread = None
+        self._running = False
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd >= 0:
+            self._dirs[wd] = directory
+
+    def _watch_tree(self, directory, emit=None):
+        self._add_watch(directory)
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for name in dirnames:
+                self._add_watch(os.path.join(dirpath, name))
+            if emit:
+                # Files created before the watch on a new directory was in place
+                for name in filenames:
+                    emit(os.path.join(dirpath, name))
+
+    def start(self, emit):
+        self._running = True
+
+        def run():
+            # Adding the watches walks every directory; do it here, off the caller's (UI) thread
+            for root in self.roots:
+                self._watch_tree(root)
+            while self._running:
+                ready, _, _ = select.select([self._fd, self._wakeup_r], [], [])
+                if self._wakeup_r in ready:
+                    break
+                try:
+                    data = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                self._dispatch(data, emit)
+
+        self._thread = threading.Thread(target=run, name="fs-inotify", daemon=True)
+        self._thread.start()
+
+    def _dispatch(self, data, emit):
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Kernel dropped events: fall back to checking everything we know
+                for path in scan_tree(self.roots):
+                    emit(path)
+                emit(None)
+                continue
+            directory = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            if not name:
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    emit(directory)
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path, emit)
+                else:
+                    emit(path)
+            else:
+                emit(path)
+
+    def stop(self):
+        self._running = False
+        os.write(self._wakeup_w, b"x")
+        if self._thread:
+            self._thread.join(timeout=2)
+        for fd in (self._fd, self._wakeup_r, self._wakeup_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class FileSyncWatcher:
+    """Turn filesystem events under ``roots`` into batched DB upserts/deletes.
+
+    Files directly inside ``product_dir`` are mirrored into ``products``; every
+    file below ``roots`` is tracked in ``file_index``. ``on_change`` is called
+    from the watcher thread with a ``ChangeSet`` after each applied batch.
+    """
+
+    def __init__(self, db_file, roots, product_dir, on_change=None,
+                 batch_delay=0.5, poll_interval=2.0, force_polling=False, settle_delay=2.0, slow_dirs=()):
+        self.db_file = db_file
+        self.roots = [os.path.normpath(r) for r in roots]
+        self.product_dir = os.path.normpath(product_dir)
+        self.on_change = on_change
+        self.batch_delay = batch_delay
+        self.poll_interval = poll_interval
+        self.force_polling = force_polling
+        self.settle_delay = settle_delay
+        self.slow_dirs = slow_dirs
+        self.backend = None
+        self._pending = set()
+        self._rescan_dirs = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flusher = None
+
+    # ---- lifecycle ----
+    def start(self):
+        backend = None
+        if not self.force_polling and os.name == "posix":
+            try:
+                backend = InotifyBackend(self.roots)
+            except (OSError, AttributeError):
+                backend = None
+        if backend is None:
+            backend = PollingBackend(self.roots, self.poll_interval, self.slow_dirs)
+        self.backend = backend
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="fs-sync", daemon=True)
+        self._flusher.start()
+        backend.start(self._emit)
+        # Catch up with anything that changed while the app was closed
+        threading.Thread(target=self._reconcile, name="fs-reconcile", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.backend:
+            self.backend.stop()
+        self._stop.set()
+        self._wake.set()
+        if self._flusher:
+            self._flusher.join(timeout=self.batch_delay + 2)
+        self.flush()
+
+    # ---- event intake ----
+    def _emit(self, path):
+        if path is None:
+            return
+        with self._lock:
+            self._pending.add(os.path.normpath(path))
+        self._wake.set()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            if self._stop.is_set():
+                break
+            # Let bursts (copies, bulk moves) settle into one batch
+            time.sleep(self.batch_delay)
+            self._wake.clear()
+            self.flush()
+
+    def _reconcile(self):
+        on_disk = scan_tree(self.roots)
+        conn = sqlite3.connect(self.db_file)
+        try:
+            # Startup reconcile compares the whole index with the disk
+            known = dict(((p, (s, m)) for p, s, m in
+                          conn.execute("SELECT path, size, mtime FROM file_index")))  # plan-ok: full sync
+            product_paths = [resolve_path(p) for (p,) in  # plan-ok: every product path is needed
+                             conn.execute("SELECT filepath FROM products WHERE filepath IS NOT NULL")]
+        finally:
+            conn.close()
+        with self._lock:
+            for path, meta in on_disk.items():
+                if known.get(path) != meta:
+                    self._pending.add(path)
+            self._pending.update(known.keys() - on_disk.keys())
+            for path in product_paths:
+                path = os.path.normpath(path)
+                if os.path.dirname(path) == self.product_dir and path not in on_disk:
+                    self._pending.add(path)
+        self._wake.set()
+
+    # ---- batch application ----
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return pending
+
+    def flush(self):
+        """Apply all pending paths in a single transaction and report the changes."""
+        pending = self._take_pending()
+        if not pending:
+            return ChangeSet()
+
+        changes = ChangeSet()
+        today = datetime.now().strftime("%Y-%m-%d")
+        now = time.time()
+        unsettled = []
+        conn = sqlite3.connect(self.db_file)
+        try:
+            with conn:
+                for path in sorted(pending):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        st = None
+
+                    if st is not None and not os.path.isfile(path):
+                        continue  # a directory event; its files are reported separately
+                    if st is not None and 0 <= now - st.st_mtime < self.settle_delay:
+                        unsettled.append(path)  # probably still being copied in
+                        continue
+
+                    if st is None:
+                        # Gone: the path may also have been a directory
+                        prefix = path + os.sep
+                        rows = conn.execute(
+                            "SELECT path FROM file_index WHERE path = ? OR (path >= ? AND path < ?)",
+                            (path, prefix, path + chr(ord(os.sep) + 1))).fetchall()
+                        for (gone,) in rows:
+                            changes.files_removed.append(gone)
+                            self._remove_product(conn, gone, changes)
+                        conn.execute("DELETE FROM file_index WHERE path = ? OR (path >= ? AND path < ?)",
+                                     (path, prefix, path + chr(ord(os.sep) + 1)))
+                        if not rows:
+                            self._remove_product(conn, path, changes)
+                        continue
+
+                    conn.execute("""INSERT INTO file_index (path, root, size, mtime) VALUES (?, ?, ?, ?)
+                                    ON CONFLICT(path) DO UPDATE SET size = excluded.size,
+                                                                    mtime = excluded.mtime""",
+                                 (path, self._root_of(path), st.st_size, st.st_mtime))
+                    changes.files_changed.append(path)
+                    if os.path.dirname(path) == self.product_dir:
+                        self._upsert_product(conn, path, today, changes)
+        finally:
+            conn.close()
+
+        if unsettled:
+            with self._lock:
+                self._pending.update(unsettled)
+            timer = threading.Timer(self.settle_delay, self._wake.set)
+            timer.daemon = True
+            timer.start()
+        if changes and self.on_change:
+            self.on_change(changes)
+        return changes
+
+    def _root_of(self, path):
+        for root in sorted(self.roots, key=len, reverse=True):
+            if path == root or path.startswith(root + os.sep):
+                return root
+        return ""
+
+    def _product_ids(self, conn, path):
+        variants = sorted(path_variants(path))
+        marks = ",".join("?" * len(variants))
+        return conn.execute(f"SELECT id FROM products WHERE filepath IN ({marks})", variants).fetchall()
+
+    def _upsert_product(self, conn, path, today, changes):
+        if self._product_ids(conn, path):
+            variants = sorted(path_variants(path))
+            marks = ",".join("?" * len(variants))
+            restored = conn.execute(
+                f"UPDATE products SET deleted_at = NULL, missing_since = NULL "
+                f"WHERE filepath IN ({marks}) AND missing_since IS NOT NULL "
+                f"RETURNING id, title, tags, category, filepath", variants).fetchall()
+            changes.products_added.extend(restored)
+            return
+        title = os.path.splitext(os.path.basename(path))[0]
+        cur = conn.execute(
+            "INSERT INTO products (title, tags, category, filepath, date_added) VALUES (?, ?, ?, ?, ?)",
+            (title, "", "", path, today))
+        changes.products_added.append((cur.lastrowid, title, "", "", path))
+
+    def _remove_product(self, conn, path, changes):
+        if os.path.dirname(path) != self.product_dir:
+            return
+        now = time.time()
+        for (product_id,) in self._product_ids(conn, path):
+            # Hidden and flagged rather than deleted: a file missing at startup (an unplugged drive,
+            # a half-finished restore) must not cost the product its title, tags and sales links
+            cur = conn.execute("UPDATE products SET deleted_at = ?, missing_since = ? "
+                               "WHERE id = ? AND deleted_at IS NULL", (now, now, product_id))
+            if cur.rowcount:
+                changes.products_removed.append(product_id)
@@ -0,0 +1,197 @@
+"""Typo-tolerant product search, for when a plain substring search finds nothing.
+
+Two trigram indexes, both kept current by triggers on ``products`` (see ``init_db``):
+
+- ``products_trgm``: FTS5 with the trigram tokenizer over title and tags, so
+  any string of 3+ characters is found as a substring without a scan;
+- ``search_words``: every distinct lower-cased word of the titles and tags
+  with the number of products using it, indexed by ``search_words_trgm``.
+
+A query word is looked up by its trigrams (and those of its spellings with
+two neighbouring letters swapped) in the word list, which is small
+(tens of thousands of words for hundreds of thousands of products), and the
+words sharing the most trigrams are accepted when they start with it or are
+within one or two edits of it, transpositions included ("recieptt" ->
+"receipt", "barcod" -> "barcode"). Products containing an accepted word for
+every query word are then read from ``products_trgm`` and ranked here by how
+closely their words match. Words of one or two characters ("r1") cannot be
+looked up by trigram; they narrow and rank the results instead, matched at
+the start or end of a word.
+"""
+import sqlite3
+import string
+
+CANDIDATE_WORDS = 300   # vocabulary rows read per query word, best trigram overlap first
+WORDS_PER_TERM = 16     # accepted spellings of one query word
+CANDIDATE_ROWS = 2000
+
+_SPLIT = ("\\", '"', ",", "\t", "\n", "\r")
+
+
+def words_source(title, tags):
+    """SQL for a ``json_each`` table of the words of ``title`` and ``tags`` (column expressions).
+
+    The same split as ``_words``: lower-case, break on whitespace, commas,
+    quotes and backslashes. Shared by the triggers in ``init_db`` and ``rebuild``.
+    """
+    text = f"lower(coalesce({title}, '') || ' ' || coalesce({tags}, ''))"
+    for char in _SPLIT:
+        text = f"replace({text}, {_quote(char)}, ' ')"
+    array = f"""'["' || replace({text}, ' ', '","') || '"]'"""
+    # Any other control character would make the JSON invalid; index no words rather than fail the write
+    return f"json_each(CASE WHEN json_valid({array}) THEN {array} ELSE '[]' END)"
+
+
+def _quote(char):
+    return {"\t": "char(9)", "\n": "char(10)", "\r": "char(13)"}.get(char, f"'{char}'")
+
+
+def _words(text):
+    """The indexed words of ``text``, with punctuation trimmed from their ends ("guide." -> "guide")."""
+    text = (text or "").lower()
+    for char in _SPLIT:
+        text = text.replace(char, " ")
+    return [word for word in (word.strip(string.punctuation) for word in text.split()) if word]
+
+
+def rebuild(conn):
+    """Fill both indexes from the products table (new databases and older ones gaining the index)."""
+    conn.execute("INSERT INTO products_trgm(products_trgm) VALUES ('rebuild')")
+    # plan-ok: one-off backfill, rewrites the whole word list from every product
+    conn.execute("DELETE FROM search_words")
+    conn.execute(  # plan-ok: see above
+        f"INSERT INTO search_words (word, docs) SELECT value, COUNT(DISTINCT p.id) "
+        f"FROM products p, {words_source('p.title', 'p.tags')} WHERE value <> '' GROUP BY value")
+
+
+def trigrams(word):
+    """Trigrams of ``word`` padded pg_trgm style, so short words and word edges count too."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb)
+
+
+def edit_distance(a, b, limit):
+    """Optimal string alignment distance (a swap of neighbours is one edit), or limit + 1 once past ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return current[-1]
+
+
+def _phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+class FuzzySearch:
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def search(self, query, limit=500):
+        """Live product ids matching ``query`` despite typos, best match first."""
+        terms = list(dict.fromkeys(_words(query)))
+        if not terms:
+            return []
+        conn = sqlite3.connect(self.db_file)
+        try:
+            spellings = {term: self._spellings(conn, term) for term in terms}
+            groups = [self._match_group(term, spellings[term]) for term in terms]
+            groups = [group for group in groups if group]
+            if not groups:
+                return []
+            rows = self._rows(conn, " AND ".join(groups))
+            if not rows and len(groups) > 1:
+                rows = self._rows(conn, " OR ".join(groups))  # no product has them all: rank the partial matches
+        finally:
+            conn.close()
+        scored = []
+        for product_id, title, tags in rows:
+            score = self._score(terms, spellings, title, tags)
+            if score > 0:
+                scored.append((-score, -product_id))
+        scored.sort()
+        return [-product_id for _, product_id in scored[:limit]]
+
+    # ---- query words -> indexed words ----
+    def _spellings(self, conn, term):
+        """{indexed word: weight} for a query word of three or more characters."""
+        if len(term) < 3:
+            return {}
+        # A swap of neighbours breaks up to three trigrams ("reprot" shares only "rep" with "report"),
+        # so the trigrams of each swapped spelling are looked up too
+        variants = {term} | {term[:i] + term[i + 1] + term[i] + term[i + 2:] for i in range(len(term) - 1)}
+        grams = sorted({variant[i:i + 3] for variant in variants for i in range(len(variant) - 2)})
+        probe = " OR ".join(_phrase(gram) for gram in grams)
+        rows = conn.execute("SELECT w.word FROM search_words_trgm "
+                            "JOIN search_words w ON w.id = search_words_trgm.rowid "
+                            "WHERE search_words_trgm MATCH ? ORDER BY rank LIMIT ?",
+                            (probe, CANDIDATE_WORDS)).fetchall()
+        allowed = 1 if len(term) <= 4 else 2
+        weights = {}
+        for (indexed,) in rows:
+            word = (_words(indexed) or [""])[0]
+            if not word or word in weights:
+                continue
+            if word == term:
+                weight = 1.0
+            elif word.startswith(term):
+                weight = max(0.95 - 0.05 * (len(word) - len(term)), 0.75)  # "barcod" -> "barcode" before "barcodes"
+            else:
+                distance = edit_distance(term, word, allowed)
+                if distance > allowed:
+                    continue
+                weight = 0.85 - 0.1 * distance + 0.1 * similarity(term, word)
+            weights[word] = weight
+        best = sorted(weights.items(), key=lambda item: -item[1])[:WORDS_PER_TERM]
+        return dict(best)
+
+    @staticmethod
+    def _match_group(term, spellings):
+        if spellings:
+            return "(" + " OR ".join(_phrase(word) for word in spellings) + ")"
+        if len(term) == 2:
+            # Too short for a trigram of its own; the space makes one at a word's start or end
+            return f"({_phrase(' ' + term)} OR {_phrase(term + ' ')})"
+        return None
+
+    @staticmethod
+    def _rows(conn, match):
+        return conn.execute("SELECT p.id, p.title, p.tags FROM products_trgm "
+                            "JOIN products p ON p.id = products_trgm.rowid "
+                            "WHERE products_trgm MATCH ? AND p.deleted_at IS NULL LIMIT ?",
+                            (match, CANDIDATE_ROWS)).fetchall()
+
+    # ---- ranking ----
+    @staticmethod
+    def _score(terms, spellings, title, tags):
+        title_words = _words(title)
+        tag_words = _words(tags)
+        score = 0.0
+        for term in terms:
+            best = 0.0
+            for words, field_weight in ((title_words, 1.0), (tag_words, 0.7)):
+                for word in words:
+                    if word in spellings[term]:
+                        weight = spellings[term][word]
+                    elif word == term:
+                        weight = 1.0
+                    elif word.startswith(term) or (len(term) < 3 and word.endswith(term)):
+                        weight = 0.8
+                    else:
+                        continue
+                    best = max(best, weight * field_weight)
+            score += best
+        return score / len(terms)
@@ -0,0 +1,652 @@
+"""Durable outbox for outgoing email.
+
+Messages are written to the ``outbox`` table first and delivered by a
+background ``Dispatcher``. Each provider has its own messages/minute budget,
+transient failures are retried with exponential backoff, and rows left in
+``sending`` by a crash are picked up again on the next start.
+"""
+import io
+import json
+import logging
+import os
+import queue
+import random
+import smtplib
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from email.generator import BytesGenerator
+from email.message import EmailMessage
+
+from attachment_cache import attach
+
+# Default SMTP settings per provider; SMTP_HOST / SMTP_PORT / SMTP_RATE_PER_MINUTE / SMTP_MAX_MESSAGE_MB
+# override them. max_message_bytes is the provider's limit on the encoded message.
+PROVIDERS = {
+    "gmail": {"host": "smtp.gmail.com", "port": 587, "per_minute": 20, "max_message_bytes": 25 * 1024 * 1024},
+    "outlook": {"host": "smtp.office365.com", "port": 587, "per_minute": 30, "max_message_bytes": 20 * 1024 * 1024},
+    "yahoo": {"host": "smtp.mail.yahoo.com", "port": 587, "per_minute": 20, "max_message_bytes": 25 * 1024 * 1024},
+}
+_DOMAINS = {
+    "gmail.com": "gmail", "googlemail.com": "gmail",
+    "outlook.com": "outlook", "hotmail.com": "outlook", "live.com": "outlook",
+    "yahoo.com": "yahoo",
+}
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 30.0     # seconds before the first retry
+BACKOFF_MAX = 3600.0
+IDLE_DISCONNECT = 30.0  # close a provider connection after this long without work
+MESSAGE_OVERHEAD = 64 * 1024  # headers, body text and MIME boundaries, generously
+
+# SMTP replies that mean "try again later" rather than "never going to work"
+_TRANSIENT_CODES = {421, 450, 451, 452, 454}
+
+# One JSON object per delivery attempt; the app points this at logs/deliveries.jsonl
+delivery_log = logging.getLogger("dpo.delivery")
+
+DELIVERY_STAGES = ("read", "build", "dns", "connect", "starttls", "login", "send")
+
+
+def provider_for(sender):
+    domain = (sender or "").rpartition("@")[2].lower()
+    return _DOMAINS.get(domain, "gmail")
+
+
+def provider_settings(provider):
+    settings = dict(PROVIDERS.get(provider, PROVIDERS["gmail"]))
+    if os.getenv("SMTP_HOST"):
+        settings["host"] = os.getenv("SMTP_HOST")
+    if os.getenv("SMTP_PORT"):
+        settings["port"] = int(os.getenv("SMTP_PORT"))
+    if os.getenv("SMTP_RATE_PER_MINUTE"):
+        settings["per_minute"] = float(os.getenv("SMTP_RATE_PER_MINUTE"))
+    if os.getenv("SMTP_MAX_MESSAGE_MB"):
+        settings["max_message_bytes"] = int(float(os.getenv("SMTP_MAX_MESSAGE_MB")) * 1024 * 1024)
+    return settings
+
+
+def encoded_size(size):
+    """Bytes a file of ``size`` takes in a message: base64, 76-char lines plus CRLF."""
+    return -(-size // 57) * 78
+
+
+def split_for_limit(attachments, limit):
+    """Group attachments into as few messages as possible, each under ``limit`` encoded bytes.
+
+    First-fit decreasing; groups keep the caller's order. A file too big for any
+    message still gets a message of its own (the provider will reject it, which
+    shows up as a failed row rather than silently dropping the file).
+    """
+    budget = max(limit - MESSAGE_OVERHEAD, 1)
+    entries = list(attachments)
+    sizes = [encoded_size(os.path.getsize(e[0] if isinstance(e, (list, tuple)) else e)) for e in entries]
+    groups = []  # [used, [indexes]]
+    for i in sorted(range(len(entries)), key=lambda i: -sizes[i]):
+        for group in groups:
+            if group[0] + sizes[i] <= budget:
+                group[0] += sizes[i]
+                group[1].append(i)
+                break
+        else:
+            groups.append([sizes[i], [i]])
+    ordered = sorted((sorted(indexes) for _, indexes in groups), key=lambda g: g[0])
+    return [[entries[i] for i in group] for group in ordered] or [[]]
+
+
+def backoff_delay(attempts):
+    delay = min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+    # Jitter so a batch that failed together does not retry together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_transient(exc):
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(code in _TRANSIENT_CODES for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code in _TRANSIENT_CODES or exc.smtp_code < 500
+    return isinstance(exc, (smtplib.SMTPException, socket.error, OSError))
+
+
+def read_attachments(attachments, cache=None):
+    """Load attachments as (filename, payload, size); payload is bytes or a cached MIME part."""
+    loaded = []
+    for entry in attachments:
+        # A path, or a [path, filename] pair when the name shown should differ (e.g. a zip bundle)
+        path, filename = entry if isinstance(entry, (list, tuple)) else (entry, os.path.basename(entry))
+        if cache is not None:
+            loaded.append((filename, cache.part(path, filename), os.path.getsize(path)))
+            continue
+        with open(path, 'rb') as f:
+            file_data = f.read()
+        loaded.append((filename, file_data, len(file_data)))
+    return loaded
+
+
+def compose_message(sender, to_email, subject, body, loaded=()):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg.set_content(body)
+    for filename, payload, _ in loaded:
+        if isinstance(payload, bytes):
+            msg.add_attachment(payload, maintype='application', subtype='octet-stream', filename=filename)
+        else:
+            attach(msg, payload)
+    return msg
+
+
+def build_message(sender, to_email, subject, body, attachments=(), cache=None):
+    """Build the EmailMessage; with an AttachmentCache the encoded bodies are reused."""
+    return compose_message(sender, to_email, subject, body, read_attachments(attachments, cache))
+
+
+def flatten(msg, cache=None):
+    if cache is not None:
+        return cache.flatten(msg)
+    buf = io.BytesIO()
+    BytesGenerator(buf, policy=msg.policy.clone(linesep='\r\n')).flatten(msg)
+    return buf.getvalue()
+
+
+class RateLimiter:
+    """Token bucket: ``per_minute`` tokens per minute, at most ``burst`` saved up."""
+
+    def __init__(self, per_minute, burst=1):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def wait_time(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if not self.interval:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.interval
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Outbox:
+    """Thin data-access layer over the ``outbox`` table."""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        return conn
+
+    def enqueue(self, to_email, subject, body, attachments=(), sender=None, provider=None, compress="auto"):
+        return self.enqueue_many([(to_email, subject, body, attachments)], sender, provider, compress)[0]
+
+    def enqueue_split(self, to_email, subject, body, attachments=(), sender=None, provider=None, compress="auto"):
+        """Queue one message, or several numbered parts when the attachments exceed the provider limit."""
+        sender = sender or os.getenv("APP_EMAIL")
+        provider = provider or provider_for(sender)
+        groups = split_for_limit(attachments, provider_settings(provider)["max_message_bytes"])
+        if len(groups) == 1:
+            return self.enqueue_many([(to_email, subject, body, groups[0])], sender, provider, compress)
+        total = len(groups)
+        return self.enqueue_many([(to_email, f"{subject} ({n}/{total})",
+                                   f"{body}\n\n(Part {n} of {total}; the files are split across {total} emails.)",
+                                   group) for n, group in enumerate(groups, 1)], sender, provider, compress)
+
+    def enqueue_many(self, messages, sender=None, provider=None, compress="auto"):
+        """Queue [(to_email, subject, body, attachments)] in one transaction; returns row ids."""
+        sender = sender or os.getenv("APP_EMAIL")
+        provider = provider or provider_for(sender)
+        now = time.time()
+        ids = []
+        conn = self._connect()
+        try:
+            with conn:
+                for to_email, subject, body, attachments in messages:
+                    cur = conn.execute(
+                        "INSERT INTO outbox (to_email, subject, body, attachments, sender, provider, compress, "
+                        "status, attempts, next_attempt_at, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', 0, ?, ?)",
+                        (to_email, subject, body, json.dumps(list(attachments)), sender, provider, compress,
+                         now, now))
+                    ids.append(cur.lastrowid)
+        finally:
+            conn.close()
+        return ids
+
+    def recover(self):
+        # Rows a previous run was in the middle of sending go back in the queue
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+        finally:
+            conn.close()
+
+    def due(self, limit=500, now=None):
+        """Up to ``limit`` pending, due messages as (id, to_email, provider), oldest first."""
+        now = time.time() if now is None else now
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT id, to_email, provider FROM outbox "
+                                "WHERE status = 'pending' AND next_attempt_at <= ? "
+                                "ORDER BY next_attempt_at, id LIMIT ?", (now, limit)).fetchall()
+        finally:
+            conn.close()
+
+    def claim(self, outbox_id):
+        """Move one pending message to ``sending`` and return it, or None if already taken."""
+        conn = self._connect()
+        try:
+            with conn:
+                cur = conn.execute("UPDATE outbox SET status = 'sending' WHERE id = ? AND status = 'pending'",
+                                   (outbox_id,))
+                if cur.rowcount != 1:
+                    return None
+                row = conn.execute("SELECT id, to_email, subject, body, attachments, sender, provider, attempts, "
+                                   "compress FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+        finally:
+            conn.close()
+        keys = ("id", "to_email", "subject", "body", "attachments", "sender", "provider", "attempts", "compress")
+        item = dict(zip(keys, row))
+        item["attachments"] = json.loads(item["attachments"] or "[]")
+        return item
+
+    def next_due(self):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()
+        finally:
+            conn.close()
+        return row[0]
+
+    def mark_sent(self, outbox_id):
+        self._update("UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL, "
+                     "attempts = attempts + 1 WHERE id = ?", (time.time(), outbox_id))
+
+    def mark_failed(self, outbox_id, attempts, error, retry):
+        if retry and attempts < MAX_ATTEMPTS:
+            self._update("UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?, "
+                         "next_attempt_at = ? WHERE id = ?",
+                         (attempts, error, time.time() + backoff_delay(attempts), outbox_id))
+            return "retry"
+        self._update("UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                     (attempts, error, outbox_id))
+        return "failed"
+
+    def retry_failed(self, ids=None):
+        sql = "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE status = 'failed'"
+        params = [time.time()]
+        if ids:
+            sql += " AND id IN (%s)" % ",".join("?" * len(ids))
+            params.extend(ids)
+        self._update(sql, params)
+
+    def counts(self):
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        finally:
+            conn.close()
+
+    def recent(self, limit=200):
+        conn = self._connect()
+        try:
+            # plan-ok: newest rows by rowid, bounded by LIMIT
+            return conn.execute("SELECT id, to_email, subject, status, attempts, last_error FROM outbox "
+                                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        finally:
+            conn.close()
+
+    def record_delivery(self, record):
+        columns = ("outbox_id", "to_email", "status", "started_at", "attachment_bytes", "message_bytes",
+                   "upload_bps", "total_ms", "error") + tuple(f"{stage}_ms" for stage in DELIVERY_STAGES)
+        self._update("INSERT INTO deliveries (%s) VALUES (%s)" % (", ".join(columns), ", ".join("?" * len(columns))),
+                     [record.get(column) for column in columns])
+
+    def delivery_summary(self, limit=500):
+        """p50/p95 of every stage (ms) and byte counters over the last ``limit`` attempts."""
+        stage_columns = [f"{stage}_ms" for stage in DELIVERY_STAGES] + ["total_ms"]
+        conn = self._connect()
+        try:
+            # plan-ok: newest rows by rowid, bounded by LIMIT
+            rows = conn.execute("SELECT %s, attachment_bytes, message_bytes, upload_bps FROM deliveries "
+                                "ORDER BY id DESC LIMIT ?" % ", ".join(stage_columns), (limit,)).fetchall()
+        finally:
+            conn.close()
+        names = list(DELIVERY_STAGES) + ["total", "attachment_bytes", "message_bytes", "upload_bps"]
+        summary = {}
+        for index, name in enumerate(names):
+            values = sorted(row[index] for row in rows if row[index] is not None)
+            summary[name] = {"n": len(values), "p50": _percentile(values, 0.50), "p95": _percentile(values, 0.95)}
+        return len(rows), summary
+
+    def _update(self, sql, params):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(sql, params)
+        finally:
+            conn.close()
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class DispatchStats:
+    """Throughput and per-stage latency of a running ``Dispatcher``."""
+
+    STAGES = DELIVERY_STAGES
+
+    def __init__(self, window=2000):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counts = {"sent": 0, "retry": 0, "failed": 0}
+        self.samples = {stage: deque(maxlen=window) for stage in self.STAGES}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def count(self, status):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            stages = {}
+            for stage, values in self.samples.items():
+                ordered = sorted(values)
+                stages[stage] = {"n": len(ordered),
+                                 "p50": _percentile(ordered, 0.50),
+                                 "p95": _percentile(ordered, 0.95)}
+            return {"elapsed": elapsed,
+                    "sends_per_sec": self.counts["sent"] / elapsed,
+                    "counts": dict(self.counts),
+                    "stages": stages}
+
+
+class DeliveryTimer:
+    """Per-attempt stage timings and byte counts."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = {}
+        self.attachment_bytes = None
+        self.message_bytes = None
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def record(self, outbox_id, to_email, status, error):
+        send = self.stages.get("send")
+        record = {
+            "outbox_id": outbox_id,
+            "to_email": to_email,
+            "status": status,
+            "started_at": self.started_at,
+            "attachment_bytes": self.attachment_bytes,
+            "message_bytes": self.message_bytes,
+            "upload_bps": (self.message_bytes / send) if send and self.message_bytes else None,
+            "total_ms": (time.perf_counter() - self._t0) * 1000,
+            "error": error,
+        }
+        for name in DELIVERY_STAGES:
+            seconds = self.stages.get(name)
+            record[f"{name}_ms"] = None if seconds is None else seconds * 1000
+        return record
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "t")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.stages[self.name] = time.perf_counter() - self.t
+        return False
+
+
+class Dispatcher:
+    """Background delivery for an ``Outbox`` over ``workers`` parallel SMTP sessions.
+
+    A scheduler thread claims due messages, round-robins between recipient
+    domains (at most ``per_domain`` in flight each) and honours the provider
+    rate limits; each worker thread keeps its own SMTP connection per provider.
+    ``on_result(outbox_id, status, to_email, error)`` is called from a worker
+    after every attempt; status is "sent", "retry" or "failed".
+    """
+
+    def __init__(self, outbox, password=None, on_result=None, smtp_factory=None, workers=1, per_domain=2,
+                 attachment_cache=None, bundler=None):
+        self.outbox = outbox
+        self.attachment_cache = attachment_cache
+        self.bundler = bundler
+        self.password = password
+        self.on_result = on_result
+        self.smtp_factory = smtp_factory or smtplib.SMTP
+        self.workers = max(1, int(workers))
+        self.per_domain = max(1, int(per_domain))
+        self.stats = DispatchStats()
+        self.limiters = {}
+        self._lock = threading.Lock()
+        self._inflight = {}      # domain -> messages being sent
+        self._queued_ids = set()
+        self._domains = OrderedDict()  # domain -> deque of (id, provider), rotated round-robin
+        self._work = queue.Queue(maxsize=self.workers)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.outbox.recover()
+        self._threads = [threading.Thread(target=self._schedule, name="outbox", daemon=True)]
+        for n in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work_loop, name=f"outbox-{n}", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for _ in range(self.workers):
+            try:
+                self._work.put_nowait(None)
+            except queue.Full:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=10)
+
+    def wake(self):
+        self._wake.set()
+
+    def limiter(self, provider):
+        with self._lock:
+            if provider not in self.limiters:
+                self.limiters[provider] = RateLimiter(provider_settings(provider)["per_minute"])
+            return self.limiters[provider]
+
+    # ---- scheduling ----
+    def _refill(self):
+        for outbox_id, to_email, provider in self.outbox.due():
+            if outbox_id in self._queued_ids:
+                continue
+            domain = (to_email or "").rpartition("@")[2].lower()
+            self._domains.setdefault(domain, deque()).append((outbox_id, provider))
+            self._queued_ids.add(outbox_id)
+
+    def _next_candidate(self):
+        """Round-robin over domains, skipping busy domains and throttled providers."""
+        shortest_wait = None
+        for _ in range(len(self._domains)):
+            domain, pending = next(iter(self._domains.items()))
+            self._domains.move_to_end(domain)
+            with self._lock:
+                busy = self._inflight.get(domain, 0) >= self.per_domain
+            if busy:
+                continue
+            outbox_id, provider = pending[0]
+            wait = self.limiter(provider).wait_time()
+            if wait > 0:
+                shortest_wait = wait if shortest_wait is None else min(shortest_wait, wait)
+                continue
+            pending.popleft()
+            if not pending:
+                del self._domains[domain]
+            self._queued_ids.discard(outbox_id)
+            return domain, outbox_id, provider, None
+        return None, None, None, shortest_wait
+
+    def _schedule(self):
+        while not self._stop.is_set():
+            if not self._domains or self._wake.is_set():
+                self._wake.clear()
+                self._refill()
+            domain, outbox_id, provider, wait = self._next_candidate()
+            if outbox_id is None:
+                timeout = IDLE_DISCONNECT if wait is None else wait
+                if not self._domains:
+                    due = self.outbox.next_due()
+                    if due is not None:
+                        timeout = min(timeout, max(due - time.time(), 0.05))
+                self._wake.wait(max(min(timeout, IDLE_DISCONNECT), 0.02))
+                continue
+            item = self.outbox.claim(outbox_id)
+            if item is None:
+                continue
+            self.limiter(provider).take()
+            with self._lock:
+                self._inflight[domain] = self._inflight.get(domain, 0) + 1
+            item["domain"] = domain
+            while not self._stop.is_set():
+                try:
+                    self._work.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    # ---- delivery (worker threads) ----
+    def _work_loop(self):
+        sessions = {}  # provider -> (smtp, last_used), owned by this worker only
+        while True:
+            try:
+                item = self._work.get(timeout=IDLE_DISCONNECT)
+            except queue.Empty:
+                self._close_all(sessions)
+                continue
+            if item is None or self._stop.is_set():
+                # An unsent item stays in 'sending' and is recovered on the next start
+                self._close_all(sessions)
+                return
+            try:
+                self._deliver(item, sessions)
+            finally:
+                with self._lock:
+                    self._inflight[item["domain"]] -= 1
+                self._wake.set()
+
+    def _session(self, sessions, provider, sender, timer):
+        entry = sessions.get(provider)
+        if entry is not None:
+            return entry[0]
+        settings = provider_settings(provider)
+        with timer.stage("dns"):
+            # Resolved separately so slow DNS shows up on its own; connect then hits the resolver cache
+            socket.getaddrinfo(settings["host"], settings["port"], type=socket.SOCK_STREAM)
+        with timer.stage("connect"):
+            smtp = self.smtp_factory(settings["host"], settings["port"], timeout=60)
+            smtp.ehlo()
+        if smtp.has_extn("starttls"):
+            with timer.stage("starttls"):
+                smtp.starttls()
+                smtp.ehlo()
+        if self.password:
+            with timer.stage("login"):
+                smtp.login(sender, self.password)
+        sessions[provider] = (smtp, time.monotonic())
+        return smtp
+
+    def _close(self, sessions, provider):
+        entry = sessions.pop(provider, None)
+        if entry is not None:
+            try:
+                entry[0].quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def _close_all(self, sessions):
+        for provider in list(sessions):
+            self._close(sessions, provider)
+
+    def _deliver(self, item, sessions):
+        provider = item["provider"]
+        attempts = item["attempts"] + 1
+        timer = DeliveryTimer()
+        attachments = item["attachments"]
+        try:
+            with timer.stage("read"):
+                if self.bundler is not None:
+                    attachments = self.bundler.prepare(attachments, item["compress"] or "auto")
+                loaded = read_attachments(attachments, self.attachment_cache)
+                timer.attachment_bytes = sum(size for _, _, size in loaded)
+            with timer.stage("build"):
+                msg = compose_message(item["sender"], item["to_email"], item["subject"], item["body"], loaded)
+                raw = flatten(msg, self.attachment_cache)
+                timer.message_bytes = len(raw)
+            smtp = self._session(sessions, provider, item["sender"], timer)
+            with timer.stage("send"):
+                smtp.sendmail(item["sender"], [item["to_email"]], raw)
+            sessions[provider] = (smtp, time.monotonic())
+        except Exception as e:
+            self._close(sessions, provider)
+            retry = is_transient(e) and not isinstance(e, FileNotFoundError)
+            if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code in _TRANSIENT_CODES:
+                # Provider is throttling us: hold every message for it, not just this one
+                self.limiter(provider).pause(backoff_delay(attempts))
+            status = self.outbox.mark_failed(item["id"], attempts, str(e), retry)
+            self._finish(item, timer, status, str(e))
+            return
+        finally:
+            if self.bundler is not None:
+                self.bundler.release(attachments)  # the zip, if any, may be evicted from here on
+        self.outbox.mark_sent(item["id"])
+        self._finish(item, timer, "sent", None)
+
+    def _finish(self, item, timer, status, error):
+        for stage, seconds in timer.stages.items():
+            self.stats.record(stage, seconds)
+        self.stats.count(status)
+        record = timer.record(item["id"], item["to_email"], status, error)
+        try:
+            self.outbox.record_delivery(record)
+        except sqlite3.Error:
+            pass  # timing is best-effort; never lose the delivery result over it
+        delivery_log.info(json.dumps(record))
+        self._notify(item, status, error)
+
+    def _notify(self, item, status, error):
+        if self.on_result:
+            self.on_result(item["id"], status, item["to_email"], error)
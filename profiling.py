@@ -0,0 +1,185 @@
+"""Opt-in profiling for the desktop app.
+
+Enabled with ``--profile`` or ``DPO_PROFILE=1``. Every public method of the
+app class, every Tk callback and every SQLite statement is timed; anything
+slower than the threshold (``--slow-ms`` / ``DPO_SLOW_MS``, default 100 ms) is
+appended to ``logs/slow_ops.log`` with its stack and, for queries, the SQL.
+Pressing Ctrl+Shift+P arms a one-shot cProfile capture: the next UI
+interaction runs under the profiler and is dumped to ``logs/profiles/*.prof``.
+"""
+import argparse
+import cProfile
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+import tkinter
+import traceback
+from datetime import datetime
+
+DEFAULT_SLOW_MS = 100.0
+
+slow_log = logging.getLogger("dpo.slow")
+
+
+class _ProfiledCursor(sqlite3.Cursor):
+    profiler = None
+
+    def execute(self, sql, parameters=()):
+        with self.profiler.timed("query", sql, parameters):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with self.profiler.timed("query", sql, "<executemany>"):
+            return super().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        with self.profiler.timed("query", sql_script, None):
+            return super().executescript(sql_script)
+
+
+class _ProfiledConnection(sqlite3.Connection):
+    cursor_class = _ProfiledCursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_class)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class _Timed:
+    __slots__ = ("profiler", "kind", "name", "detail", "t")
+
+    def __init__(self, profiler, kind, name, detail):
+        self.profiler = profiler
+        self.kind = kind
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.t
+        if elapsed * 1000 >= self.profiler.threshold_ms:
+            self.profiler.report(self.kind, self.name, elapsed, self.detail)
+        return False
+
+
+class Profiler:
+    def __init__(self, threshold_ms=DEFAULT_SLOW_MS, log_dir="logs"):
+        self.threshold_ms = threshold_ms
+        self.log_dir = log_dir
+        self.profile_dir = os.path.join(log_dir, "profiles")
+        self._armed = False
+        self._local = threading.local()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        handler = logging.FileHandler(os.path.join(log_dir, "slow_ops.log"), encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.INFO)
+
+    # ---- reporting ----
+    def timed(self, kind, name, detail=None):
+        return _Timed(self, kind, name, detail)
+
+    def report(self, kind, name, seconds, detail=None):
+        lines = [f"{datetime.now().isoformat(timespec='milliseconds')} SLOW {kind} {name} "
+                 f"{seconds * 1000:.1f} ms [{threading.current_thread().name}]"]
+        if detail is not None:
+            lines.append(f"    params: {detail!r}")
+        # Drop the profiler's own frames from the stack
+        frames = [f for f in traceback.extract_stack() if f.filename != __file__ and "cProfile" not in f.filename]
+        stack = traceback.format_list(frames[-8:])
+        lines.extend("    " + line.rstrip().replace("\n", "\n    ") for line in stack)
+        slow_log.info("\n".join(lines))
+
+    # ---- one-shot cProfile capture ----
+    def arm_capture(self):
+        self._armed = True
+
+    def _call(self, name, func, args, kwargs):
+        depth = getattr(self._local, "depth", 0)
+        capture = self._armed and depth == 0 and threading.current_thread() is threading.main_thread()
+        if capture:
+            self._armed = False
+        self._local.depth = depth + 1
+        try:
+            with self.timed("ui", name):
+                if not capture:
+                    return func(*args, **kwargs)
+                profile = cProfile.Profile()
+                try:
+                    return profile.runcall(func, *args, **kwargs)
+                finally:
+                    path = os.path.join(self.profile_dir,
+                                        f"{name.replace('.', '_')}_{datetime.now():%Y%m%d_%H%M%S}.prof")
+                    profile.dump_stats(path)
+                    slow_log.info(f"{datetime.now().isoformat(timespec='milliseconds')} PROFILE {name} -> {path}")
+        finally:
+            self._local.depth = depth
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self._call(name, func, args, kwargs)
+        wrapper.__profiled__ = True
+        return wrapper
+
+    # ---- installation ----
+    def instrument_class(self, cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("__") or not callable(value) or getattr(value, "__profiled__", False):
+                continue
+            setattr(cls, attr, self.wrap(f"{cls.__name__}.{attr}", value))
+
+    def instrument_tk(self):
+        # Every command=/bind callback (including dialog closures) is registered through Misc._register
+        original = tkinter.Misc._register
+        profiler = self
+
+        def _register(widget, func, subst=None, needcleanup=1):
+            if not getattr(func, "__profiled__", False):
+                func = profiler.wrap(getattr(func, "__qualname__", repr(func)), func)
+            return original(widget, func, subst, needcleanup)
+
+        tkinter.Misc._register = _register
+
+    def instrument_sqlite(self):
+        _ProfiledCursor.profiler = self
+        original = sqlite3.connect
+
+        @functools.wraps(original)
+        def connect(*args, **kwargs):
+            kwargs.setdefault("factory", _ProfiledConnection)
+            return original(*args, **kwargs)
+
+        sqlite3.connect = connect
+
+    def install(self, app_class):
+        self.instrument_class(app_class)
+        self.instrument_tk()
+        self.instrument_sqlite()
+        return self
+
+
+def from_args(argv=None):
+    """Build a Profiler when ``--profile``/``DPO_PROFILE`` asks for one, else return None."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--slow-ms", type=float)
+    args, _ = parser.parse_known_args(argv)
+    enabled = args.profile or os.getenv("DPO_PROFILE", "").lower() in ("1", "true", "yes")
+    if not enabled:
+        return None
+    threshold = args.slow_ms if args.slow_ms is not None else float(os.getenv("DPO_SLOW_MS", DEFAULT_SLOW_MS))
+    return Profiler(threshold)
@@ -0,0 +1,83 @@
+"""Background removal of files belonging to soft-deleted products.
+
+Deleting products only stamps ``deleted_at`` (one UPDATE transaction, however
+many rows), so the UI never waits on the filesystem. This worker later removes
+the files in batches, skipping any file still referenced by a live product,
+and then drops the rows. Files that cannot be removed yet (e.g. open in
+another program on Windows) keep their row and are retried on the next pass.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from fs_watcher import path_variants, resolve_path
+
+BATCH_SIZE = 200
+
+
+class Purger:
+    def __init__(self, db_file, grace=0.0, interval=60.0, batch=BATCH_SIZE):
+        self.db_file = db_file
+        self.grace = grace          # seconds a deleted row is kept before its file goes
+        self.interval = interval
+        self.batch = batch
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="purger", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                while not self._stop.is_set() and self.purge_once() == self.batch:
+                    pass  # a full batch purged means there is probably more
+            except sqlite3.Error as e:
+                self.last_error = str(e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def purge_once(self):
+        """Remove one batch of deleted products' files and rows; returns the number of rows purged."""
+        cutoff = time.time() - self.grace
+        conn = sqlite3.connect(self.db_file)
+        try:
+            # Rows the file watcher hid for a missing file are kept, so they come back with the file
+            rows = conn.execute("SELECT id, filepath FROM products WHERE deleted_at IS NOT NULL AND deleted_at <= ? "
+                                "AND missing_since IS NULL ORDER BY deleted_at LIMIT ?",
+                                (cutoff, self.batch)).fetchall()
+            done = []
+            for product_id, filepath in rows:
+                if filepath and not self._still_used(conn, filepath):
+                    try:
+                        os.remove(resolve_path(filepath))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        self.last_error = f"{filepath}: {e}"
+                        continue
+                done.append((product_id,))
+            with conn:
+                conn.executemany("DELETE FROM products WHERE id = ? AND deleted_at IS NOT NULL", done)
+        finally:
+            conn.close()
+        return len(done)
+
+    @staticmethod
+    def _still_used(conn, filepath):
+        variants = sorted(path_variants(filepath))
+        marks = ",".join("?" * len(variants))
+        return conn.execute(f"SELECT 1 FROM products WHERE filepath IN ({marks}) AND deleted_at IS NULL LIMIT 1",
+                            variants).fetchone() is not None
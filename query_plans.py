@@ -0,0 +1,203 @@
+"""Registry of the app's SQL and an EXPLAIN QUERY PLAN regression check.
+
+Every string literal passed to ``execute``/``executemany`` in the app's modules
+is collected (``%s`` / f-string holes are filled with ``?`` so dynamic
+``IN (...)`` lists still plan), along with the ``planned_statements()`` of
+modules that assemble SQL at run time. Each statement is planned against a freshly
+seeded database and flagged when SQLite reports a full table scan or a temp
+B-tree for ORDER BY/GROUP BY/DISTINCT.
+
+A statement that is meant to scan (exports, substring search, ...) is marked
+with a ``# plan-ok: <reason>`` comment on the line of the call or the line
+above it.
+
+    python query_plans.py            # report, exit status 1 on unmarked findings
+    python -m pytest query_plans.py  # same check as a test
+"""
+import argparse
+import ast
+import importlib
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULES = ("DPO1.py", "fs_watcher.py", "templating.py", "client_directory.py", "outbox.py", "receipt_archive.py",
+           "sales_ledger.py", "api_server.py", "purger.py", "storage_layout.py", "scrubber.py",
+           "fuzzy_search.py", "client_import.py")
+# Modules that build SQL at run time list it through planned_statements()
+GENERATED = ("catalog_pages",)
+
+_MARKER = re.compile(r"#\s*plan-ok\b")
+# A virtual table scan with an index string (e.g. FTS5 MATCH, "INDEX 0:M2") is an index lookup
+_FULL_SCAN = re.compile(r"^SCAN (\w+)\b(?! USING (COVERING )?INDEX| VIRTUAL TABLE INDEX \d+:\S)")
+_TEMP_BTREE = re.compile(r"USE TEMP B-TREE")
+
+
+class Statement:
+    __slots__ = ("path", "line", "sql", "allowed")
+
+    def __init__(self, path, line, sql, allowed):
+        self.path = path
+        self.line = line
+        self.sql = sql
+        self.allowed = allowed
+
+    def __repr__(self):
+        return f"{os.path.basename(self.path)}:{self.line}"
+
+
+def _literal(node):
+    """Best-effort SQL text for an expression, with dynamic parts replaced by '?'."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+            else:
+                parts.append("?")
+        return "".join(parts)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod):
+        left = _literal(node.left)
+        if left is not None:
+            return re.sub(r"%\(?\w*\)?s", "?", left)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _literal(node.left), _literal(node.right)
+        if left is not None and right is not None:
+            return left + right
+    return None
+
+
+def collect_statements(modules=MODULES, root=HERE):
+    statements = []
+    for module in modules:
+        path = os.path.join(root, module)
+        with open(path, encoding="utf-8") as f:
+            source = f.read()
+        lines = source.splitlines()
+        for node in ast.walk(ast.parse(source)):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ("execute", "executemany") and node.args):
+                continue
+            sql = _literal(node.args[0])
+            if sql is None or not sql.strip():
+                continue
+            nearby = lines[max(node.lineno - 2, 0):node.end_lineno]
+            allowed = any(_MARKER.search(line) for line in nearby)
+            statements.append(Statement(path, node.lineno, " ".join(sql.split()), allowed))
+    for name in GENERATED:
+        module = importlib.import_module(name)
+        line = module.planned_statements.__code__.co_firstlineno
+        statements.extend(Statement(module.__file__, line, " ".join(sql.split()), False)
+                          for sql in module.planned_statements())
+    return statements
+
+
+def seed_database(db_file, products=20000, clients=20000, messages=20000):
+    """A database with the app's schema and enough rows for the planner to prefer indexes."""
+    import DPO1
+    DPO1.DB_FILE = db_file
+    DPO1.init_db()
+
+    rng = random.Random(1)
+    start = datetime(2020, 1, 1)
+    day = lambda: (start + timedelta(days=rng.randrange(2000))).strftime("%Y-%m-%d")
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany("INSERT INTO products (title, tags, category, filepath, date_added) VALUES (?, ?, ?, ?, ?)",
+                         ((f"Product {i}", f"tag{i % 50}", f"cat{i % 20}", os.path.join("files", f"p{i}.pdf"),
+                           day()) for i in range(products)))
+        conn.executemany("INSERT INTO clients (email, name, date_added) VALUES (?, ?, ?)",
+                         ((f"user{i}@example{i % 100}.com", f"Client {i}", day()) for i in range(clients)))
+        conn.executemany("INSERT INTO templates (title, body, date_added) VALUES (?, ?, ?)",
+                         ((f"Template {i}", "Hi {client_name}", day()) for i in range(200)))
+        conn.executemany("INSERT INTO outbox (to_email, subject, body, attachments, sender, provider, status, "
+                         "attempts, next_attempt_at, created_at) VALUES (?, 's', 'b', '[]', 'me', 'gmail', ?, 0, ?, ?)",
+                         ((f"user{i}@example.com", rng.choice(("sent",) * 20 + ("pending", "failed")), i, i)
+                          for i in range(messages)))
+        conn.executemany("INSERT INTO file_index (path, root, size, mtime) VALUES (?, 'files', 1, 1)",
+                         ((os.path.join("files", f"f{i}.pdf"),) for i in range(products)))
+        conn.executemany("INSERT INTO sales_ledger (sale_id, line_no, sold_at, client_name, client_email, product, "
+                         "quantity, unit_price_cents, discount_cents, tax_rate, tax_cents, total_cents) "
+                         "VALUES (?, 0, ?, 'Client', ?, ?, 1, 999, 0, 0, 0, 999)",
+                         ((i, f"{day()} 12:00:00", f"user{i % 500}@example.com", f"p{i % 300}.pdf")
+                          for i in range(messages)))
+        conn.execute("ANALYZE")
+    conn.close()
+
+
+def explain(conn, sql):
+    params = [None] * sql.count("?")
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def check(db_file, statements):
+    """Return [(statement, problems, plan)] for every statement; problems is [] when it is indexed."""
+    conn = sqlite3.connect(db_file)
+    results = []
+    try:
+        for statement in statements:
+            verb = statement.sql.split(None, 1)[0].upper()
+            if verb not in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH", "REPLACE"):
+                continue
+            try:
+                plan = explain(conn, statement.sql)
+            except sqlite3.Error as e:
+                results.append((statement, [f"cannot plan: {e}"], []))
+                continue
+            problems = []
+            for detail in plan:
+                scan = _FULL_SCAN.match(detail)
+                if scan:
+                    problems.append(f"full scan of {scan.group(1)}")
+                if _TEMP_BTREE.search(detail):
+                    problems.append(detail.lower())
+            results.append((statement, problems, plan))
+    finally:
+        conn.close()
+    return results
+
+
+def run(verbose=False):
+    statements = collect_statements()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "plans.db")
+        seed_database(db_file)
+        results = check(db_file, statements)
+
+    failures = 0
+    for statement, problems, plan in results:
+        if problems and not statement.allowed:
+            failures += 1
+            status = "FAIL"
+        elif problems:
+            status = "ok (plan-ok)"
+        else:
+            status = "ok"
+        if problems or verbose:
+            print(f"{status:12} {statement!r:24} {statement.sql[:100]}")
+            for detail in plan:
+                print(f"{'':12}   {detail}")
+    print(f"{len(results)} statements planned, {failures} unindexed")
+    return failures
+
+
+def test_queries_use_indexes():
+    assert run() == 0, "new full scans / temp B-trees; add an index or a '# plan-ok: <reason>' marker"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EXPLAIN QUERY PLAN every SQL statement the app issues.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every plan, not just findings")
+    args = parser.parse_args()
+    sys.exit(1 if run(args.verbose) else 0)
+
+
+if __name__ == "__main__":
+    main()
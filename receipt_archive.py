@@ -0,0 +1,212 @@
+"""Bulk archival of receipt PDFs into compressed monthly bundles.
+
+Receipts are written by ``generate_receipt`` into the sharded layout of
+``storage_layout`` (``<YYYY>/<MM>/<client_id>/<Client_Name>_<timestamp>.pdf``);
+a receipt's ``filename`` is that path relative to the receipt directory.
+Archival policies pick receipts by age, client and/or month of issue; the
+selected files are appended to ``<receipt_dir>/archive/<YYYY-MM>.zip`` and
+recorded in the ``receipt_archive`` table before being removed from the active
+directory, so the active listing only holds recent receipts. An archived
+receipt is opened by extracting just that member into a view cache.
+"""
+import os
+import shutil
+import sqlite3
+import zipfile
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from storage_layout import iter_receipts, parse_receipt_name, safe_name
+
+ARCHIVE_SUBDIR = "archive"
+
+# bundle is None for receipts still in the active directory
+Receipt = namedtuple("Receipt", "filename client issued size bundle")
+
+
+def client_key(name):
+    """The client prefix receipts are filed under (as generate_receipt builds it)."""
+    return safe_name(name)
+
+
+def parse_receipt(path, filename=None):
+    st = os.stat(path)
+    client, issued = parse_receipt_name(os.path.basename(path))
+    if issued is None:
+        issued = datetime.fromtimestamp(st.st_mtime).replace(microsecond=0)
+    return Receipt(filename or os.path.basename(path), client, issued, st.st_size, None)
+
+
+def _client_id(filename):
+    """The client id a sharded receipt is filed under, None for the old flat layout."""
+    parts = filename.split("/")
+    return int(parts[2]) if len(parts) == 4 and parts[2].isdigit() else None
+
+
+class ReceiptArchive:
+    def __init__(self, db_file, receipt_dir, view_dir):
+        self.db_file = db_file
+        self.receipt_dir = receipt_dir
+        self.archive_dir = os.path.join(receipt_dir, ARCHIVE_SUBDIR)
+        self.view_dir = view_dir
+
+    # ---- listing ----
+    def active(self, client_id=None, first_month=None, last_month=None):
+        """Active receipts; the filters skip whole shard directories rather than reading them."""
+        return [parse_receipt(os.path.join(self.receipt_dir, relpath), relpath.replace(os.sep, "/"))
+                for relpath, _ in iter_receipts(self.receipt_dir, client_id, first_month, last_month)]
+
+    def archived(self, client=None, client_id=None):
+        conn = sqlite3.connect(self.db_file)
+        try:
+            if client_id is not None:
+                rows = conn.execute("SELECT filename, client, issued, size, bundle FROM receipt_archive "
+                                    "WHERE client_id = ? ORDER BY issued DESC", (client_id,)).fetchall()
+                if client:
+                    # Receipts archived before they were filed by client id
+                    rows += conn.execute("SELECT filename, client, issued, size, bundle FROM receipt_archive "
+                                         "WHERE client = ? COLLATE NOCASE AND client_id IS NULL ORDER BY issued DESC",
+                                         (client_key(client),)).fetchall()
+            elif client is not None:
+                rows = conn.execute("SELECT filename, client, issued, size, bundle FROM receipt_archive "
+                                    "WHERE client = ? COLLATE NOCASE ORDER BY issued DESC",
+                                    (client_key(client),)).fetchall()
+            else:
+                rows = conn.execute("SELECT filename, client, issued, size, bundle FROM receipt_archive "
+                                    "ORDER BY issued DESC").fetchall()
+        finally:
+            conn.close()
+        return [Receipt(f, c, datetime.fromisoformat(i), s, b) for f, c, i, s, b in rows]
+
+    def for_client(self, name, client_id=None):
+        """Active and archived receipts for a client, newest first.
+
+        With a client id, everything filed under it is included whatever name
+        the receipt was issued to; name matching only covers unfiled receipts.
+        """
+        key = client_key(name).lower()
+        if client_id is None:
+            active = [r for r in self.active() if r.client.lower() == key]
+        else:
+            # active(client_id) reads only that client's shards, plus any files still in the flat layout
+            active = [r for r in self.active(client_id)
+                      if _client_id(r.filename) is not None or r.client.lower() == key]
+        receipts = active + self.archived(name, client_id)
+        return sorted(receipts, key=lambda r: r.issued, reverse=True)
+
+    # ---- policies ----
+    def select(self, older_than_days=None, client=None, month=None, now=None, client_id=None):
+        """Active receipts matching every given policy (age in days, client, "YYYY-MM")."""
+        last_month = None
+        if older_than_days is not None:
+            cutoff = (now or datetime.now()) - timedelta(days=older_than_days)
+            last_month = cutoff.strftime("%Y-%m")
+        if month:
+            last_month = min(last_month, month) if last_month else month
+        receipts = self.active(client_id, first_month=month, last_month=last_month)
+        if older_than_days is not None:
+            receipts = [r for r in receipts if r.issued < cutoff]
+        if client_id is not None:
+            key = client_key(client).lower() if client else None
+            receipts = [r for r in receipts if _client_id(r.filename) == client_id
+                        or (_client_id(r.filename) is None and r.client.lower() == key)]
+        elif client:
+            key = client_key(client).lower()
+            receipts = [r for r in receipts if r.client.lower() == key]
+        if month:
+            receipts = [r for r in receipts if r.issued.strftime("%Y-%m") == month]
+        return receipts
+
+    # ---- archival ----
+    def archive(self, receipts):
+        """Move receipts into their monthly bundles; returns (count, bytes_before, bytes_after)."""
+        by_month = {}
+        for receipt in receipts:
+            if receipt.bundle is None:
+                by_month.setdefault(receipt.issued.strftime("%Y-%m"), []).append(receipt)
+        if not by_month:
+            return 0, 0, 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        count = before = after = 0
+        for month, batch in sorted(by_month.items()):
+            bundle = os.path.join(ARCHIVE_SUBDIR, f"{month}.zip")
+            bundle_path = os.path.join(self.receipt_dir, bundle)
+            old_size = os.path.getsize(bundle_path) if os.path.exists(bundle_path) else 0
+            self._append(bundle_path, batch)
+            archived_at = datetime.now().isoformat(timespec="seconds")
+
+            conn = sqlite3.connect(self.db_file)
+            try:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO receipt_archive (filename, client, client_id, issued, "
+                                     "size, bundle, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     [(r.filename, r.client, _client_id(r.filename),
+                                       r.issued.isoformat(timespec="seconds"), r.size, bundle, archived_at)
+                                      for r in batch])
+            finally:
+                conn.close()
+
+            # Only drop the originals once both the bundle and the index have them
+            for receipt in batch:
+                path = os.path.join(self.receipt_dir, receipt.filename)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._prune(os.path.dirname(path))
+            count += len(batch)
+            before += sum(r.size for r in batch)
+            after += os.path.getsize(bundle_path) - old_size
+        return count, before, after
+
+    def _prune(self, folder):
+        # Drop client/month/year shard directories left empty, so listings don't keep visiting them
+        root = os.path.abspath(self.receipt_dir)
+        folder = os.path.abspath(folder)
+        while folder != root and folder.startswith(root):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                return
+            folder = os.path.dirname(folder)
+
+    def _append(self, bundle_path, batch):
+        # Append to a copy and swap it in, so a crash never leaves a half-written bundle
+        tmp = bundle_path + ".tmp"
+        if os.path.exists(bundle_path):
+            shutil.copyfile(bundle_path, tmp)
+        with zipfile.ZipFile(tmp, 'a', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+            present = set(zf.namelist())
+            for receipt in batch:
+                if receipt.filename not in present:
+                    zf.write(os.path.join(self.receipt_dir, receipt.filename), arcname=receipt.filename)
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, bundle_path)
+
+    # ---- opening ----
+    def open_path(self, filename):
+        """A path to the receipt on disk, extracting it from its bundle if it was archived."""
+        active = os.path.join(self.receipt_dir, filename)
+        if os.path.exists(active):
+            return active
+
+        conn = sqlite3.connect(self.db_file)
+        try:
+            row = conn.execute("SELECT bundle, size FROM receipt_archive WHERE filename = ?", (filename,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise FileNotFoundError(f"Receipt not found: {filename}")
+
+        bundle, size = row
+        target = os.path.join(self.view_dir, os.path.basename(filename))
+        if os.path.exists(target) and os.path.getsize(target) == size:
+            return target
+        os.makedirs(self.view_dir, exist_ok=True)
+        with zipfile.ZipFile(os.path.join(self.receipt_dir, bundle)) as zf, \
+                zf.open(filename) as src, open(target + ".tmp", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(target + ".tmp", target)
+        return target
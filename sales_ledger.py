@@ -0,0 +1,205 @@
+"""Sales ledger: one row per receipt line, and revenue reports computed in SQL.
+
+``generate_receipt`` records every sale here, so reporting never has to
+re-read PDFs. Amounts are stored in integer cents. The order-level discount is
+spread over the lines in proportion to their price, and the rounding remainder
+goes on the last line, so the line totals always add up to the receipt's grand
+total. Reports are aggregates over covering indexes (see ``init_db``).
+
+Daily rollups (totals per day, per day and product, per day and client) are
+updated in the same transaction as each sale, so the dashboard reads a few
+rows per day shown instead of every ledger line. ``rebuild_rollups`` (or
+``python sales_ledger.py --rebuild-rollups``) recomputes them from the ledger.
+"""
+import argparse
+import sqlite3
+from datetime import date, datetime, timedelta
+
+
+def to_cents(amount):
+    return int(round(float(amount) * 100))
+
+
+def split_sale(items, discount=0.0, tax=0.0):
+    """Ledger lines for a receipt: [(product, unit_cents, discount_cents, tax_cents, total_cents)].
+
+    ``tax`` is a percentage, applied after the discount exactly as on the receipt.
+    """
+    prices = [to_cents(price) for _, price in items]
+    subtotal = sum(prices)
+    discount_cents = min(to_cents(discount), subtotal)
+    tax_total = to_cents((subtotal - discount_cents) / 100 * (tax / 100)) if tax > 0 else 0
+
+    lines = []
+    discount_left, tax_left = discount_cents, tax_total
+    for i, ((product, _), price) in enumerate(zip(items, prices)):
+        if i == len(items) - 1:
+            line_discount, line_tax = discount_left, tax_left
+        else:
+            line_discount = discount_cents * price // subtotal if subtotal else 0
+            line_tax = tax_total * (price - line_discount) // (subtotal - discount_cents) \
+                if subtotal > discount_cents else 0
+        discount_left -= line_discount
+        tax_left -= line_tax
+        lines.append((str(product), price, line_discount, line_tax, price - line_discount + line_tax))
+    return lines
+
+
+class SalesLedger:
+    def __init__(self, db_file):
+        self.db_file = db_file
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file)
+
+    def record(self, client_name, client_email, items, discount=0.0, tax=0.0, receipt=None, sold_at=None):
+        """Store one sale (all of a receipt's lines) and return its sale_id."""
+        sold_at = (sold_at or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+        lines = split_sale(items, discount, tax)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")  # sale_id allocation and the inserts are one unit
+                sale_id = conn.execute("SELECT COALESCE(MAX(sale_id), 0) + 1 FROM sales_ledger").fetchone()[0]
+                conn.executemany(
+                    "INSERT INTO sales_ledger (sale_id, line_no, sold_at, client_name, client_email, product, "
+                    "quantity, unit_price_cents, discount_cents, tax_rate, tax_cents, total_cents, receipt) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)",
+                    [(sale_id, n, sold_at, client_name, client_email, product, unit, disc, tax, tax_cents, total,
+                      receipt) for n, (product, unit, disc, tax_cents, total) in enumerate(lines)])
+                self._roll_up(conn, sold_at[:10], client_email, lines)
+        finally:
+            conn.close()
+        return sale_id
+
+    # ---- daily rollups ----
+    def _roll_up(self, conn, day, client_email, lines):
+        revenue = sum(line[4] for line in lines)
+        conn.execute("INSERT INTO sales_daily (day, orders, units, revenue_cents) VALUES (?, 1, ?, ?) "
+                     "ON CONFLICT(day) DO UPDATE SET orders = orders + 1, units = units + excluded.units, "
+                     "revenue_cents = revenue_cents + excluded.revenue_cents", (day, len(lines), revenue))
+        conn.execute("INSERT INTO sales_daily_client (day, client_email, orders, units, revenue_cents) "
+                     "VALUES (?, ?, 1, ?, ?) ON CONFLICT(day, client_email) DO UPDATE SET orders = orders + 1, "
+                     "units = units + excluded.units, revenue_cents = revenue_cents + excluded.revenue_cents",
+                     (day, client_email, len(lines), revenue))
+        conn.executemany("INSERT INTO sales_daily_product (day, product, orders, units, revenue_cents) "
+                         "VALUES (?, ?, 1, 1, ?) ON CONFLICT(day, product) DO UPDATE SET orders = orders + 1, "
+                         "units = units + 1, revenue_cents = revenue_cents + excluded.revenue_cents",
+                         [(day, line[0], line[4]) for line in lines])
+
+    def rebuild_rollups(self):
+        """Recompute every rollup table from the ledger (after imports or manual edits)."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM sales_daily")
+                conn.execute("DELETE FROM sales_daily_client")
+                conn.execute("DELETE FROM sales_daily_product")
+                # plan-ok: a rebuild reads the whole ledger by design
+                conn.execute("INSERT INTO sales_daily (day, orders, units, revenue_cents) "
+                             "SELECT substr(sold_at, 1, 10), SUM(line_no = 0), SUM(quantity), SUM(total_cents) "
+                             "FROM sales_ledger GROUP BY substr(sold_at, 1, 10)")
+                # plan-ok: a rebuild reads the whole ledger by design
+                conn.execute("INSERT INTO sales_daily_client (day, client_email, orders, units, revenue_cents) "
+                             "SELECT substr(sold_at, 1, 10), client_email, SUM(line_no = 0), SUM(quantity), "
+                             "SUM(total_cents) FROM sales_ledger GROUP BY substr(sold_at, 1, 10), client_email")
+                # plan-ok: a rebuild reads the whole ledger by design
+                conn.execute("INSERT INTO sales_daily_product (day, product, orders, units, revenue_cents) "
+                             "SELECT substr(sold_at, 1, 10), product, COUNT(*), SUM(quantity), SUM(total_cents) "
+                             "FROM sales_ledger GROUP BY substr(sold_at, 1, 10), product")
+                return conn.execute("SELECT COUNT(*) FROM sales_daily").fetchone()[0]
+        finally:
+            conn.close()
+
+    def dashboard(self, days=30, today=None):
+        """Figures for the last ``days`` days, read from the rollups only.
+
+        Returns {"trend": [(day, orders, revenue_cents)] for every day (zeros
+        filled in), "orders", "revenue_cents", "average_order_cents",
+        "top_products" and "top_clients": [(name, orders, revenue_cents)]}.
+        """
+        last = today or date.today()
+        first = last - timedelta(days=days - 1)
+        start, end = first.isoformat(), last.isoformat()
+        conn = self._connect()
+        try:
+            daily = {day: (orders, revenue) for day, orders, revenue in conn.execute(
+                "SELECT day, orders, revenue_cents FROM sales_daily WHERE day BETWEEN ? AND ?", (start, end))}
+            # plan-ok: ranking sorts the per-product sums for the days shown
+            top_products = conn.execute(
+                "SELECT product, SUM(orders), SUM(revenue_cents) AS revenue FROM sales_daily_product "
+                "WHERE day BETWEEN ? AND ? GROUP BY product ORDER BY revenue DESC LIMIT 10", (start, end)).fetchall()
+            # plan-ok: ranking sorts the per-client sums for the days shown
+            top_clients = conn.execute(
+                "SELECT client_email, SUM(orders), SUM(revenue_cents) AS revenue FROM sales_daily_client "
+                "WHERE day BETWEEN ? AND ? GROUP BY client_email ORDER BY revenue DESC LIMIT 10",
+                (start, end)).fetchall()
+        finally:
+            conn.close()
+
+        trend = []
+        for offset in range(days):
+            day = (first + timedelta(days=offset)).isoformat()
+            orders, revenue = daily.get(day, (0, 0))
+            trend.append((day, orders, revenue))
+        orders = sum(o for _, o, _ in trend)
+        revenue = sum(r for _, _, r in trend)
+        return {"trend": trend, "orders": orders, "revenue_cents": revenue,
+                "average_order_cents": revenue // orders if orders else 0,
+                "top_products": top_products, "top_clients": top_clients}
+
+    # ---- reports ----
+    # Each returns rows of (key, orders, units, revenue_cents)
+    def revenue_by_month(self, first_month=None, last_month=None):
+        """Months are "YYYY-MM", both inclusive."""
+        first, last = first_month or "0000-00", last_month or "9999-99"
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "SELECT substr(sold_at, 1, 7), SUM(line_no = 0), SUM(quantity), SUM(total_cents) "
+                "FROM sales_ledger WHERE substr(sold_at, 1, 7) BETWEEN ? AND ? "
+                "GROUP BY substr(sold_at, 1, 7) ORDER BY substr(sold_at, 1, 7)", (first, last)).fetchall()
+        finally:
+            conn.close()
+
+    def revenue_by_client(self, start=None, end=None, limit=100):
+        """Top clients between two "YYYY-MM-DD" dates, both inclusive."""
+        conn = self._connect()
+        try:
+            # plan-ok: ranking sorts the aggregated groups, not the ledger rows
+            return conn.execute(
+                "SELECT client_email, SUM(line_no = 0), SUM(quantity), SUM(total_cents) AS revenue "
+                "FROM sales_ledger WHERE sold_at >= ? AND sold_at < date(?, '+1 day') "
+                "GROUP BY client_email ORDER BY revenue DESC LIMIT ?",
+                (start or "0000-01-01", end or "9999-12-30", limit)).fetchall()
+        finally:
+            conn.close()
+
+    def revenue_by_product(self, start=None, end=None, limit=100):
+        """Top products between two "YYYY-MM-DD" dates, both inclusive."""
+        conn = self._connect()
+        try:
+            # plan-ok: ranking sorts the aggregated groups, not the ledger rows
+            return conn.execute(
+                "SELECT product, SUM(line_no = 0), SUM(quantity), SUM(total_cents) AS revenue "
+                "FROM sales_ledger WHERE sold_at >= ? AND sold_at < date(?, '+1 day') "
+                "GROUP BY product ORDER BY revenue DESC LIMIT ?",
+                (start or "0000-01-01", end or "9999-12-30", limit)).fetchall()
+        finally:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sales ledger maintenance.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute the daily rollup tables")
+    args = parser.parse_args()
+    if args.rebuild_rollups:
+        print(f"Rebuilt rollups for {SalesLedger(args.db).rebuild_rollups()} days")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Background integrity checks for product files, client files and receipts.
+
+Each pass stats every tracked file and only reads (SHA-256) the ones that are
+new or whose size or mtime changed since the last pass, plus unchanged ones
+whose last full read is older than ``reverify_days``, so a file that changes
+content without changing size or mtime (bit rot, a bad copy) is eventually
+caught as ``corrupt``. Reads are throttled to
+``max_bytes_per_second`` and pause while ``busy()`` says the user is working.
+
+Products the file watcher hid and flagged ``missing_since`` are still
+checked, so their vanished files are reported as ``missing``.
+
+Results go to the ``file_integrity`` table; ``report()`` (and
+``python scrubber.py --report``) summarizes the problems found.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from fs_watcher import resolve_path
+from storage_layout import iter_receipts
+
+OK, MISSING, CORRUPT, UNREADABLE = "ok", "missing", "corrupt", "unreadable"
+PROBLEMS = (MISSING, CORRUPT, UNREADABLE)
+CHUNK = 1024 * 1024
+BATCH_SIZE = 200
+
+
+def _walk(root):
+    for folder, _, files in os.walk(root):
+        for name in files:
+            yield os.path.join(folder, name)
+
+
+class Scrubber:
+    def __init__(self, db_file, client_files_dir, receipt_dir, interval=6 * 3600,
+                 max_bytes_per_second=8 * 1024 * 1024, reverify_days=30, busy=None):
+        self.db_file = db_file
+        self.client_files_dir = client_files_dir
+        self.receipt_dir = receipt_dir
+        self.interval = interval
+        self.max_bytes_per_second = max_bytes_per_second
+        self.reverify_days = reverify_days
+        self.busy = busy or (lambda: False)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_pass = None   # summary dict of the last completed pass
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="scrubber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.last_pass = self.scrub_once()
+            except sqlite3.Error as e:
+                self.last_error = str(e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    # ---- what to check ----
+    def _targets(self, conn):
+        """{path: (kind, product_id)} for every file that should exist."""
+        targets = {}
+        # plan-ok: a pass checks every live product, and those the file watcher hid because their file vanished
+        for product_id, filepath in conn.execute("SELECT id, filepath FROM products "
+                                                 "WHERE deleted_at IS NULL OR missing_since IS NOT NULL"):
+            if filepath:
+                targets[resolve_path(filepath)] = ("product", product_id)
+        for path in _walk(self.client_files_dir):
+            targets.setdefault(path, ("client_file", None))
+        for relpath, _ in iter_receipts(self.receipt_dir):
+            targets.setdefault(os.path.join(self.receipt_dir, relpath), ("receipt", None))
+        for path in _walk(os.path.join(self.receipt_dir, "archive")):
+            if path.endswith(".zip"):
+                targets.setdefault(path, ("receipt_bundle", None))
+        return targets
+
+    # ---- one pass ----
+    def scrub_once(self, now=None):
+        """Check everything once; returns counts of files read, skipped and found with problems."""
+        now = now or time.time()
+        reverify_before = now - self.reverify_days * 86400
+        conn = sqlite3.connect(self.db_file)
+        try:
+            targets = self._targets(conn)
+            known = {path: (size, mtime_ns, digest, status, verified_at) for path, size, mtime_ns, digest, status,
+                     verified_at in conn.execute(  # plan-ok: the pass compares against every stored entry
+                         "SELECT path, size, mtime_ns, sha256, status, verified_at FROM file_integrity")}
+            with conn:
+                conn.executemany("DELETE FROM file_integrity WHERE path = ?",
+                                 [(path,) for path in known if path not in targets])
+
+            summary = {"checked": 0, "hashed": 0, "skipped": 0, "problems": 0}
+            rows = []
+            for path, (kind, product_id) in targets.items():
+                if self._stop.is_set():
+                    break
+                self._yield_to_user()
+                row = self._check(path, kind, product_id, known.get(path), now, reverify_before, summary)
+                if row is not None:
+                    rows.append(row)
+                if len(rows) >= BATCH_SIZE:
+                    self._store(conn, rows)
+                summary["checked"] += 1
+            self._store(conn, rows)
+        finally:
+            conn.close()
+        return summary
+
+    @staticmethod
+    def _store(conn, rows):
+        # Short write transactions, so the app's own writes never wait long on the scrubber
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO file_integrity (path, kind, product_id, size, mtime_ns, sha256, "
+                             "status, detail, checked_at, verified_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        rows.clear()
+
+    def _check(self, path, kind, product_id, previous, now, reverify_before, summary):
+        """The row to store for ``path``, or None when nothing changed."""
+        size, mtime_ns, digest, status, verified_at = previous or (None, None, None, None, None)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            summary["problems"] += 1
+            if status == MISSING:
+                return None
+            return (path, kind, product_id, size, mtime_ns, digest, MISSING, "file not found", now, verified_at)
+        except OSError as e:
+            summary["problems"] += 1
+            return (path, kind, product_id, size, mtime_ns, digest, UNREADABLE, str(e), now, verified_at)
+
+        unchanged = previous is not None and (st.st_size, st.st_mtime_ns) == (size, mtime_ns)
+        if unchanged and status in (OK, CORRUPT) and (verified_at or 0) >= reverify_before:
+            summary["skipped"] += 1
+            summary["problems"] += status == CORRUPT
+            return None  # incremental: nothing about the file changed since it was last read
+
+        try:
+            new_digest = self._hash(path)
+        except OSError as e:
+            summary["problems"] += 1
+            return (path, kind, product_id, st.st_size, st.st_mtime_ns, digest, UNREADABLE, str(e), now, verified_at)
+        summary["hashed"] += 1
+        if unchanged and digest and new_digest != digest:
+            # Same size and mtime but different bytes: the content changed underneath us
+            summary["problems"] += 1
+            return (path, kind, product_id, st.st_size, st.st_mtime_ns, digest, CORRUPT,
+                    f"checksum changed to {new_digest[:12]}", now, now)
+        detail = "modified since last pass" if previous is not None and not unchanged and digest else None
+        return (path, kind, product_id, st.st_size, st.st_mtime_ns, new_digest, OK, detail, now, now)
+
+    # ---- throttling ----
+    def _yield_to_user(self):
+        while self.busy() and not self._stop.is_set():
+            self._stop.wait(1.0)
+
+    def _hash(self, path):
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                started = time.monotonic()
+                chunk = f.read(CHUNK)
+                if not chunk:
+                    break
+                h.update(chunk)
+                if self.max_bytes_per_second:
+                    # Spread reads out so the disk stays free for the app
+                    delay = len(chunk) / self.max_bytes_per_second - (time.monotonic() - started)
+                    if delay > 0:
+                        self._stop.wait(delay)
+                self._yield_to_user()
+        return h.hexdigest()
+
+    # ---- results ----
+    def report(self, limit=500):
+        """{"counts": {(kind, status): n}, "problems": [(path, kind, status, detail, checked_at)]}."""
+        conn = sqlite3.connect(self.db_file)
+        try:
+            counts = {(kind, status): n for kind, status, n in conn.execute(  # plan-ok: totals per status
+                "SELECT kind, status, COUNT(*) FROM file_integrity GROUP BY kind, status")}
+            marks = ",".join("?" * len(PROBLEMS))
+            problems = conn.execute(f"SELECT path, kind, status, detail, checked_at FROM file_integrity "
+                                    f"WHERE status IN ({marks}) ORDER BY status, path LIMIT ?",
+                                    (*PROBLEMS, limit)).fetchall()
+        finally:
+            conn.close()
+        return {"counts": counts, "problems": problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check stored files for missing or corrupted content.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--files", default="files", help="the app's files/ directory")
+    parser.add_argument("--run", action="store_true", help="run one pass now (unthrottled)")
+    parser.add_argument("--report", action="store_true", help="print the problems found so far")
+    args = parser.parse_args()
+    scrubber = Scrubber(args.db, os.path.join(args.files, "ClientFiles"), os.path.join(args.files, "receipts"),
+                        max_bytes_per_second=0)
+    if not (args.run or args.report):
+        parser.print_help()
+        return
+    if args.run:
+        summary = scrubber.scrub_once()
+        print(f"Checked {summary['checked']} files: {summary['hashed']} read, {summary['skipped']} unchanged, "
+              f"{summary['problems']} with problems")
+    if args.report:
+        result = scrubber.report()
+        for (kind, status), n in sorted(result["counts"].items()):
+            print(f"{kind:15} {status:11} {n}")
+        for path, kind, status, detail, _ in result["problems"]:
+            print(f"{status.upper():11} {kind:15} {path}" + (f"  ({detail})" if detail else ""))
+
+
+if __name__ == "__main__":
+    main()
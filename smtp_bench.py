@@ -0,0 +1,110 @@
+"""Measure outbox delivery throughput against a local stand-in SMTP server.
+
+    python smtp_bench.py --messages 500 --workers 1 4 8 --latency 0.01
+
+Nothing leaves the machine: the stand-in accepts every message and adds
+``--latency`` seconds to each SMTP reply to mimic a real round trip.
+"""
+import argparse
+import os
+import socketserver
+import tempfile
+import threading
+import time
+
+import outbox
+from attachment_cache import AttachmentCache
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def reply(self, text):
+        time.sleep(self.server.latency)
+        self.wfile.write((text + "\r\n").encode())
+
+    def handle(self):
+        self.reply("220 stand-in ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii", "replace").strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250-stand-in\r\n250 SIZE 104857600")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                with self.server.lock:
+                    self.server.delivered += 1
+                self.reply("250 OK queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, latency=0.0):
+        super().__init__(("127.0.0.1", 0), _StandInHandler)
+        self.latency = latency
+        self.delivered = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def run(db_file, messages, workers, domains, attachment=None, cache=None):
+    box = outbox.Outbox(db_file)
+    batch = [(f"user{i}@domain{i % domains}.example", f"Bench {i}", "Hello {client_name}",
+              [attachment] if attachment else []) for i in range(messages)]
+    box.enqueue_many(batch, sender="bench@localhost", provider="bench")
+
+    done = threading.Semaphore(0)
+    dispatcher = outbox.Dispatcher(box, workers=workers, on_result=lambda *event: done.release(),
+                                   attachment_cache=cache)
+    start = time.perf_counter()
+    dispatcher.start()
+    for _ in range(messages):
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    dispatcher.stop()
+    return elapsed, dispatcher.stats.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--domains", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds added to every SMTP reply")
+    parser.add_argument("--attachment", help="file attached to every message")
+    parser.add_argument("--cache", action="store_true", help="reuse pre-encoded attachment bodies")
+    args = parser.parse_args()
+
+    from DPO1 import init_db
+    import DPO1
+
+    server = StandInSMTPServer(args.latency).start()
+    os.environ["SMTP_HOST"], os.environ["SMTP_PORT"] = server.server_address[0], str(server.server_address[1])
+    os.environ["SMTP_RATE_PER_MINUTE"] = "0"  # no provider throttling against the stand-in
+
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            DPO1.DB_FILE = os.path.join(tmp, "bench.db")
+            init_db()
+            cache = AttachmentCache(os.path.join(tmp, "attachments")) if args.cache else None
+            elapsed, stats = run(DPO1.DB_FILE, args.messages, workers, args.domains, args.attachment, cache)
+        stages = "  ".join(f"{name} p50={s['p50'] * 1000:.1f}ms p95={s['p95'] * 1000:.1f}ms"
+                           for name, s in stats["stages"].items() if s["n"])
+        print(f"workers={workers:<3} {args.messages / elapsed:8.1f} sends/s  {stages}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
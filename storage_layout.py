@@ -0,0 +1,282 @@
+"""Sharded on-disk layout for receipts and per-client files.
+
+Receipts:      receipts/<YYYY>/<MM>/<client_id>/<Client_Name>_<YYYY-MM-DD_HH_MM_SS>[_n].pdf
+Client files:  ClientFiles/<client_id // 1000, 4 digits>/<client_id>/
+
+No directory grows without bound: a month directory holds one folder per
+client that bought that month, and a client-file bucket holds at most 1000
+clients. Listings prune by path (a month, a client) instead of scanning
+everything. Receipt names carry seconds and are reserved with O_EXCL, adding
+``_2``, ``_3``... on a clash, so two receipts can never overwrite each other.
+Client folders are keyed by id, so renaming a client does not orphan them.
+
+Files in the old flat layout (``receipts/*.pdf``, ``ClientFiles/<Name>/``) are
+still listed, and ``migrate()`` (``python storage_layout.py --migrate``) moves
+them into place; a client's old folder is also moved the first time it is opened.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+from datetime import datetime
+
+UNKNOWN_CLIENT = 0
+CLIENT_BUCKET = 1000
+RECEIPT_EXTENSIONS = (".pdf", ".txt")  # .txt: the plain receipt written when a send has no price
+
+_RECEIPT_NAME = re.compile(r"^(?P<client>.+)_(?P<date>\d{4}-\d{2}-\d{2})_(?P<hour>\d{2})_(?P<minute>\d{2})"
+                           r"(?:_(?P<second>\d{2}))?(?:_\d+)?\.(?:pdf|txt)$", re.IGNORECASE)
+_YEAR = re.compile(r"^\d{4}$")
+_MONTH = re.compile(r"^\d{2}$")
+
+
+def safe_name(name):
+    return (name or "").replace(" ", "_")
+
+
+def parse_receipt_name(filename):
+    """(client, issued) from a receipt file name; issued is None when the name has no timestamp."""
+    m = _RECEIPT_NAME.match(filename)
+    if not m:
+        return os.path.splitext(filename)[0], None
+    stamp = f"{m.group('date')} {m.group('hour')}:{m.group('minute')}:{m.group('second') or '00'}"
+    return m.group("client"), datetime.strptime(stamp, "%Y-%m-%d %H:%M:%S")
+
+
+# ---- receipts ----
+def receipt_dir(root, issued, client_id):
+    return os.path.join(root, f"{issued:%Y}", f"{issued:%m}", str(client_id or UNKNOWN_CLIENT))
+
+
+def _free_name(folder, name):
+    """``name``, or the first of ``<base>_2<ext>``, ``<base>_3<ext>``... not yet taken in ``folder``."""
+    base, ext = os.path.splitext(name)
+    n = 1
+    while os.path.exists(os.path.join(folder, name)):
+        n += 1
+        name = f"{base}_{n}{ext}"
+    return name
+
+
+def reserve_receipt_path(root, client_name, client_id, issued, ext=".pdf"):
+    """Create an empty, uniquely named receipt file and return its path for the caller to fill."""
+    folder = receipt_dir(root, issued, client_id)
+    os.makedirs(folder, exist_ok=True)
+    base = f"{safe_name(client_name)}_{issued:%Y-%m-%d_%H_%M_%S}"
+    n = 1
+    while True:
+        path = os.path.join(folder, f"{base}{ext}" if n == 1 else f"{base}_{n}{ext}")
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            n += 1
+
+
+def iter_receipts(root, client_id=None, first_month=None, last_month=None, include_legacy=True):
+    """Yield (relative_path, client_id) for every receipt (PDF or text), pruning shards outside the filters.
+
+    Months are "YYYY-MM" (inclusive). Legacy flat files report client_id None.
+    """
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for year in entries:
+        if include_legacy and year.is_file() and year.name.lower().endswith(RECEIPT_EXTENSIONS):
+            yield year.name, None
+            continue
+        if not (year.is_dir() and _YEAR.match(year.name)):
+            continue
+        if (first_month and year.name < first_month[:4]) or (last_month and year.name > last_month[:4]):
+            continue
+        with os.scandir(year.path) as it:
+            months = sorted(e.name for e in it if e.is_dir() and _MONTH.match(e.name))
+        for month in months:
+            ym = f"{year.name}-{month}"
+            if (first_month and ym < first_month) or (last_month and ym > last_month):
+                continue
+            month_path = os.path.join(year.path, month)
+            if client_id is not None:
+                clients = [str(client_id)] if os.path.isdir(os.path.join(month_path, str(client_id))) else []
+            else:
+                with os.scandir(month_path) as it:
+                    clients = [e.name for e in it if e.is_dir()]
+            for client in clients:
+                with os.scandir(os.path.join(month_path, client)) as it:
+                    for e in it:
+                        if e.is_file() and e.name.lower().endswith(RECEIPT_EXTENSIONS):
+                            yield os.path.join(year.name, month, client, e.name), int(client)
+
+
+# ---- client files ----
+def client_files_dir(root, client_id, legacy_name=None):
+    """The client's folder (created if needed), taking over the old name-keyed folder if there is one."""
+    folder = os.path.join(root, f"{client_id // CLIENT_BUCKET:04d}", str(client_id))
+    if legacy_name:
+        _move_folder(os.path.join(root, safe_name(legacy_name)), folder)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def _move_folder(src, dst, renamed=None):
+    """Move or merge folder ``src`` into ``dst``; returns 1 if there was anything to move.
+
+    An entry whose name is already taken in ``dst`` is moved under a ``_2``,
+    ``_3``... name like ``reserve_receipt_path`` gives, and (old name, new name)
+    is appended to ``renamed``.
+    """
+    if not os.path.isdir(src) or os.path.abspath(src) == os.path.abspath(dst):
+        return 0
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if not os.path.exists(dst):
+        os.replace(src, dst)
+        return 1
+    # Both exist: merge, never overwriting a file already in the new folder
+    for entry in os.listdir(src):
+        name = _free_name(dst, entry)
+        shutil.move(os.path.join(src, entry), os.path.join(dst, name))
+        if name != entry and renamed is not None:
+            renamed.append((entry, name))
+    os.rmdir(src)
+    return 1
+
+
+def _month_dirs(root):
+    if not os.path.isdir(root):
+        return []
+    months = []
+    with os.scandir(root) as years:
+        for year in years:
+            if year.is_dir() and _YEAR.match(year.name):
+                with os.scandir(year.path) as it:
+                    months.extend(e.path for e in it if e.is_dir() and _MONTH.match(e.name))
+    return months
+
+
+def merge_client_folders(receipt_root, client_files_root, moves):
+    """Move the receipts and files of each old client id in ``moves`` [(old_id, new_id)] to the new id.
+
+    Returns the receipts that had to be renamed to avoid a clash, as
+    [(old relative path, new relative path)] with "/" separators, as the
+    ledger's receipt column holds them.
+    """
+    renamed = []
+    months = _month_dirs(receipt_root)
+    for old_id, new_id in moves:
+        for month in months:
+            clashes = []
+            _move_folder(os.path.join(month, str(old_id)), os.path.join(month, str(new_id)), clashes)
+            prefix = os.path.relpath(month, receipt_root).replace(os.sep, "/")
+            renamed.extend((f"{prefix}/{old_id}/{old}", f"{prefix}/{new_id}/{new}") for old, new in clashes)
+        _move_folder(os.path.join(client_files_root, f"{old_id // CLIENT_BUCKET:04d}", str(old_id)),
+                     os.path.join(client_files_root, f"{new_id // CLIENT_BUCKET:04d}", str(new_id)))
+    return renamed
+
+
+# ---- migration ----
+def _client_ids(db_file):
+    """Lookup from the name receipts/folders were filed under (lower-cased) to client id."""
+    by_name, by_local, ambiguous = {}, {}, set()
+    conn = sqlite3.connect(db_file)
+    try:
+        rows = conn.execute("SELECT id, name, email FROM clients").fetchall()  # plan-ok: migration reads them all
+    finally:
+        conn.close()
+    for client_id, name, email in rows:
+        for table, key in ((by_name, safe_name(name).lower()), (by_local, (email or "").split("@")[0].lower())):
+            if not key:
+                continue
+            if key in table and table[key] != client_id:
+                ambiguous.add(key)
+            table[key] = client_id
+    lookup = dict(by_local)
+    lookup.update(by_name)  # names win over email prefixes
+    for key in ambiguous:
+        lookup.pop(key, None)
+    return lookup
+
+
+def _repoint_ledger(db_file, moved):
+    conn = sqlite3.connect(db_file)
+    try:
+        with conn:
+            # plan-ok: one pass over the ledger for the whole migration
+            conn.execute("UPDATE sales_ledger SET receipt = (SELECT value FROM json_each(?) WHERE key = receipt) "
+                         "WHERE receipt IN (SELECT key FROM json_each(?))", (json.dumps(moved),) * 2)
+    finally:
+        conn.close()
+
+
+def migrate(db_file, receipt_root, client_files_root, dry_run=False):
+    """Move flat-layout receipts and name-keyed client folders into the sharded layout.
+
+    Ledger lines that name a moved receipt by its old flat file name are
+    pointed at its new relative path. Archive rows need no change: archived
+    receipts live in their bundles under the name they were archived with.
+    """
+    ids = _client_ids(db_file)
+    summary = {"receipts": 0, "unmatched_receipts": 0, "client_folders": 0, "unmatched_folders": []}
+    moved = {}  # old flat name -> new path relative to receipt_root, "/"-separated like the ledger
+
+    if os.path.isdir(receipt_root):
+        with os.scandir(receipt_root) as it:
+            legacy = [e for e in it if e.is_file() and e.name.lower().endswith(RECEIPT_EXTENSIONS)]
+        try:
+            for entry in legacy:
+                client, issued = parse_receipt_name(entry.name)
+                if issued is None:
+                    issued = datetime.fromtimestamp(entry.stat().st_mtime)
+                client_id = ids.get(client.lower(), UNKNOWN_CLIENT)
+                summary["receipts"] += 1
+                summary["unmatched_receipts"] += client_id == UNKNOWN_CLIENT
+                if dry_run:
+                    continue
+                folder = receipt_dir(receipt_root, issued, client_id)
+                os.makedirs(folder, exist_ok=True)
+                target = os.path.join(folder, _free_name(folder, entry.name))
+                os.replace(entry.path, target)
+                moved[entry.name] = os.path.relpath(target, receipt_root).replace(os.sep, "/")
+        finally:
+            # Also after an error part-way, so every receipt already moved keeps its ledger link
+            if moved:
+                _repoint_ledger(db_file, moved)
+
+    if os.path.isdir(client_files_root):
+        with os.scandir(client_files_root) as it:
+            folders = [e for e in it if e.is_dir() and not e.name.isdigit()]
+        for entry in folders:
+            client_id = ids.get(entry.name.lower())
+            if client_id is None:
+                summary["unmatched_folders"].append(entry.name)
+                continue
+            summary["client_folders"] += 1
+            if not dry_run:
+                _move_folder(entry.path, os.path.join(client_files_root, f"{client_id // CLIENT_BUCKET:04d}",
+                                                      str(client_id)))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move receipts and client files into the sharded layout.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--files", default="files", help="the app's files/ directory")
+    parser.add_argument("--migrate", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="report what would move")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.print_help()
+        return
+    summary = migrate(args.db, os.path.join(args.files, "receipts"), os.path.join(args.files, "ClientFiles"),
+                      dry_run=args.dry_run)
+    print(f"{'Would move' if args.dry_run else 'Moved'} {summary['receipts']} receipts "
+          f"({summary['unmatched_receipts']} without a matching client, filed under {UNKNOWN_CLIENT}) "
+          f"and {summary['client_folders']} client folders")
+    if summary["unmatched_folders"]:
+        print("Left in place (no matching client):", ", ".join(summary["unmatched_folders"]))
+
+
+if __name__ == "__main__":
+    main()
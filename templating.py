@@ -0,0 +1,144 @@
+"""Email template rendering with per-recipient placeholders.
+
+A template body such as ``"Hi {client_name}, here is {product_title}"`` is
+compiled once into a %-style format string, so rendering a personalized body
+is a single C-level ``%`` operation. Unknown ``{names}`` are left untouched and
+``{{``/``}}`` produce literal braces.
+"""
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+PLACEHOLDERS = (
+    "client_name", "client_email", "product_title", "file_name",
+    "price", "discount", "tax", "total", "date", "sender",
+)
+
+_TOKEN = re.compile(r"\{\{|\}\}|\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+class CompiledTemplate:
+    __slots__ = ("source", "fields", "_fmt")
+
+    def __init__(self, source):
+        self.source = source
+        fields = []
+        parts = []
+        pos = 0
+        for m in _TOKEN.finditer(source):
+            parts.append(source[pos:m.start()].replace("%", "%%"))
+            token = m.group(0)
+            name = m.group(1)
+            if token == "{{":
+                parts.append("{")
+            elif token == "}}":
+                parts.append("}")
+            elif name in PLACEHOLDERS:
+                parts.append(f"%({name})s")
+                if name not in fields:
+                    fields.append(name)
+            else:
+                parts.append(token.replace("%", "%%"))
+            pos = m.end()
+        parts.append(source[pos:].replace("%", "%%"))
+        self.fields = tuple(fields)
+        self._fmt = "".join(parts)
+
+    def render(self, context):
+        # ``context`` must provide every name in ``self.fields``; see make_context()
+        return self._fmt % context
+
+
+@lru_cache(maxsize=512)
+def compile_template(source):
+    return CompiledTemplate(source)
+
+
+def render(source, context):
+    return compile_template(source).render(context)
+
+
+def _money(value):
+    if value in (None, ""):
+        return ""
+    try:
+        return f"${float(value):.2f}"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _percent(value):
+    if value in (None, ""):
+        return ""
+    try:
+        return f"{float(value):g}%"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def make_context(client_name="", client_email="", product_title="", file_name="",
+                 price=None, discount=None, tax=None, total=None, sender="", date=None):
+    """Build a render context with every placeholder present."""
+    if total is None and price not in (None, ""):
+        try:
+            net = float(price) - float(discount or 0)
+            total = net + round(net * float(tax or 0) / 100, 2)
+        except (TypeError, ValueError):
+            total = None
+    return {
+        "client_name": client_name or (client_email.split("@")[0] if client_email else ""),
+        "client_email": client_email or "",
+        "product_title": product_title or "",
+        "file_name": file_name or "",
+        "price": _money(price),
+        "discount": _money(discount),
+        "tax": _percent(tax),
+        "total": _money(total),
+        "date": date or datetime.now().strftime("%Y-%m-%d"),
+        "sender": sender or "",
+    }
+
+
+class TemplateStore:
+    """Cached view of the ``templates`` table, keyed by title.
+
+    Call ``invalidate()`` after any template insert/update/delete; the next
+    lookup reloads the table once and recompiles only bodies that changed.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._by_title = None
+
+    def invalidate(self):
+        with self._lock:
+            self._by_title = None
+
+    def _load(self):
+        with self._lock:
+            if self._by_title is not None:
+                return self._by_title
+            conn = sqlite3.connect(self.db_file)
+            try:
+                rows = conn.execute("SELECT title, body FROM templates ORDER BY date_added DESC").fetchall()
+            finally:
+                conn.close()
+            by_title = {}
+            for title, body in rows:
+                # Newest template wins when titles repeat (matches the old linear search)
+                by_title.setdefault(title, compile_template(body or ""))
+            self._by_title = by_title
+            return by_title
+
+    def titles(self):
+        return list(self._load())
+
+    def get(self, title):
+        return self._load().get(title)
+
+    def body(self, title):
+        compiled = self.get(title)
+        return compiled.source if compiled else None
@@ -0,0 +1,205 @@
+"""Disk cache of product previews, rendered by a small background pool.
+
+Images are downscaled with Pillow; PDFs show their first page, rendered with
+PyMuPDF when it is installed or the ``pdftoppm`` tool otherwise. Anything else
+(or a PDF with no renderer available) has no preview.
+
+Entries are keyed by path, size and mtime, so an edited file simply misses
+and gets re-rendered; ``invalidate()`` drops stale entries as soon as the file
+watcher reports a change. The directory is kept under a size cap by evicting
+the least recently shown previews. Requests are served newest first and only
+the most recent ``max_pending`` are kept, so fast browsing never queues up
+renders for rows that are no longer on screen.
+"""
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".tif", ".tiff"}
+PDF_EXTENSIONS = {".pdf"}
+
+
+def render_image(path, size):
+    with Image.open(path) as img:
+        img.draft("RGB", size)  # lets JPEG decode at reduced scale
+        img = img.convert("RGBA") if img.mode in ("P", "LA", "RGBA") else img.convert("RGB")
+        img.thumbnail(size)
+        return img.copy()
+
+
+def render_pdf(path, size):
+    if fitz is not None:
+        with fitz.open(path) as doc:
+            page = doc[0]
+            zoom = min(size[0] / page.rect.width, size[1] / page.rect.height)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    if shutil.which("pdftoppm"):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "page")
+            subprocess.run(["pdftoppm", "-f", "1", "-l", "1", "-png", "-scale-to", str(max(size)), path, out],
+                           check=True, capture_output=True, timeout=30)
+            with Image.open(next(os.scandir(tmp)).path) as img:
+                img.thumbnail(size)
+                return img.copy()
+    return None
+
+
+def can_preview(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in PDF_EXTENSIONS:
+        return fitz is not None or shutil.which("pdftoppm") is not None
+    return ext in IMAGE_EXTENSIONS
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir, size=(240, 240), max_bytes=200 * 1024 * 1024, workers=2, max_pending=32):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_pending = max_pending
+        os.makedirs(cache_dir, exist_ok=True)
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> (path, [callback]), newest last
+        self._rendering = {}           # key -> [callback] of requests made while it renders
+        self._keys = {}                # abspath -> last key produced, for invalidate()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        self._running = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"thumbnails-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._pending.clear()
+            self._cond.notify_all()
+
+    # ---- lookups ----
+    def _key(self, path):
+        st = os.stat(path)
+        raw = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\0{self.size[0]}x{self.size[1]}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key + ".png")
+
+    def cached(self, path):
+        """The preview's PNG path if it is already rendered, else None (never renders)."""
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            os.utime(entry)  # recently shown, keep it longest
+            self._keys[os.path.abspath(path)] = key
+            return entry
+        return None
+
+    def request(self, path, callback):
+        """Return the cached PNG path now, or None and render in the background.
+
+        ``callback(path, png_path_or_None)`` runs on a worker thread when done.
+        Repeated requests for a file already queued or rendering are not
+        rendered twice, but every caller's callback is run.
+        """
+        if not can_preview(path):
+            return None
+        entry = self.cached(path)
+        if entry:
+            return entry
+        try:
+            key = self._key(path)
+        except OSError:
+            return None
+        with self._cond:
+            if key in self._rendering:
+                self._rendering[key].append(callback)
+                return None
+            _, callbacks = self._pending.pop(key, (path, []))
+            callbacks.append(callback)
+            self._pending[key] = (path, callbacks)
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)  # oldest request is no longer on screen
+            self._cond.notify()
+        return None
+
+    def invalidate(self, path):
+        key = self._keys.pop(os.path.abspath(path), None)
+        if key:
+            try:
+                os.remove(self._entry(key))
+            except OSError:
+                pass
+
+    # ---- workers ----
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                key, (path, callbacks) = self._pending.popitem(last=True)  # newest first
+                self._rendering[key] = callbacks
+            try:
+                entry = self._render(key, path)
+            except Exception:
+                entry = None
+            finally:
+                with self._cond:
+                    callbacks = self._rendering.pop(key)
+            for callback in callbacks:
+                callback(path, entry)
+
+    def _render(self, key, path):
+        ext = os.path.splitext(path)[1].lower()
+        img = render_pdf(path, self.size) if ext in PDF_EXTENSIONS else render_image(path, self.size)
+        if img is None:
+            return None
+        entry = self._entry(key)
+        tmp = f"{entry}.{threading.get_ident()}.tmp"
+        img.save(tmp, "PNG", optimize=False)
+        os.replace(tmp, entry)
+        stale = self._keys.get(os.path.abspath(path))
+        self._keys[os.path.abspath(path)] = key
+        if stale and stale != key:
+            try:
+                os.remove(self._entry(stale))
+            except OSError:
+                pass
+        self._evict(keep=entry)
+        return entry
+
+    def _evict(self, keep):
+        with os.scandir(self.cache_dir) as it:
+            entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.name.endswith(".png"))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass